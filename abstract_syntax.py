@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from typing import List, Set, Dict, Tuple, Any
-from lark.tree import Meta
+from locations import Location
 from fractions import Fraction
 from utilities import *
 from values import *
@@ -35,7 +35,7 @@ def eval_constant(e):
       error(e.location, "expected a constant, not " + str(e))
       
 
-@dataclass
+@dataclass(slots=True)
 class Int(Exp):
   value: int
   __match_args__ = ("value",)
@@ -59,7 +59,7 @@ class Int(Exp):
     return IntType(self.location), self
     
     
-@dataclass
+@dataclass(slots=True)
 class Frac(Exp):
   value: Fraction
   __match_args__ = ("value",)
@@ -82,7 +82,7 @@ class Frac(Exp):
   def step(self, runner,  machine):
       runner.produce_value(Number(self.value), machine, self.location)    
 
-@dataclass
+@dataclass(slots=True)
 class Bool(Exp):
   value: bool
   __match_args__ = ("value",)
@@ -106,7 +106,7 @@ class Bool(Exp):
       runner.produce_value(Boolean(self.value), machine, self.location)
 
       
-@dataclass
+@dataclass(slots=True)
 class IfExp(Exp):
   cond: Exp
   thn: Exp
@@ -125,9 +125,16 @@ class IfExp(Exp):
           | self.els.free_vars()
     
   def const_eval(self, env):
-    new_cond = self.cond.const_eval(env)
+    from variables_and_binding import const_eval_operand
+    new_cond = const_eval_operand(self.cond, env)
     new_thn = self.thn.const_eval(env)
     new_els = self.els.const_eval(env)
+    # When the branches are constants of the same type, so is the
+    # result, and dropping the other branch does not change the type.
+    match new_cond:
+      case Bool(b) if is_constant(new_thn) \
+                      and type(new_thn) is type(new_els):
+        return new_thn if b else new_els
     return IfExp(self.location, new_cond, new_thn, new_els)
       
   def step(self, runner, machine):
@@ -160,9 +167,58 @@ class IfExp(Exp):
     
     
 # Statements
+
+# A statement that is followed by the rest of the body, such as `Seq`
+# and `BindingStmt`. The statements of a long function body form a long
+# chain of them, so their methods loop down the chain with the
+# functions below instead of recursing on the rest. A link provides
+# * `chain_rest()`, the rest of the body,
+# * `head_free_vars()` and `bound_vars()`, the free variables of the
+#   link other than in the rest, and the variables it binds in the rest,
+# * `const_eval_head(env)` and `type_check_head(env, ret)`, which
+#   return the translation of the link other than the rest, and the
+#   environment for the rest, and
+# * `relink(head, rest)`, which builds the link from a translation.
+class Link:
+  __slots__ = ()
+
+def chain(stmt):
+  links = []
+  while isinstance(stmt, Link):
+    links.append(stmt)
+    stmt = stmt.chain_rest()
+  return links, stmt
+
+def chain_free_vars(stmt):
+  links, last = chain(stmt)
+  result = last.free_vars()
+  for link in reversed(links):
+    result = link.head_free_vars() | (result - link.bound_vars())
+  return result
+
+def chain_const_eval(stmt, env):
+  links, last = chain(stmt)
+  heads = []
+  for link in links:
+    head, env = link.const_eval_head(env)
+    heads.append(head)
+  return relink_chain(links, heads, last.const_eval(env))
+
+def chain_type_check(stmt, env, ret):
+  links, last = chain(stmt)
+  heads = []
+  for link in links:
+    head, env = link.type_check_head(env, ret)
+    heads.append(head)
+  return relink_chain(links, heads, last.type_check(env, ret))
+
+def relink_chain(links, heads, result):
+  for link, head in reversed(list(zip(links, heads))):
+    result = link.relink(head, result)
+  return result
       
-@dataclass
-class Seq(Stmt):
+@dataclass(slots=True)
+class Seq(Stmt, Link):
   first: Stmt
   rest: Stmt
   __match_args__ = ("first", "rest")
@@ -176,18 +232,32 @@ class Seq(Stmt):
   def __repr__(self):
     return str(self)
 
+  def chain_rest(self):
+    return self.rest
+
+  def head_free_vars(self):
+    return self.first.free_vars()
+
+  def bound_vars(self):
+    return set()
+
+  def const_eval_head(self, env):
+    return self.first.const_eval(env), env
+
+  def type_check_head(self, env, ret):
+    return self.first.type_check(env, ret), env
+
+  def relink(self, head, rest):
+    return Seq(self.location, head, rest)
+
   def free_vars(self):
-    return self.first.free_vars() | self.rest.free_vars()
+    return chain_free_vars(self)
 
   def const_eval(self, env):
-    new_first = self.first.const_eval(env)
-    new_rest = self.rest.const_eval(env)
-    return Seq(self.location, new_first, new_rest)
+    return chain_const_eval(self, env)
   
   def type_check(self, env, ret):
-    new_first = self.first.type_check(env, ret)
-    new_rest = self.rest.type_check(env, ret)
-    return Seq(self.location, new_first, new_rest)
+    return chain_type_check(self, env, ret)
 
   def step(self, runner, machine):
     if runner.state == 0:
@@ -202,7 +272,7 @@ class Seq(Stmt):
       return True
 
     
-@dataclass
+@dataclass(slots=True)
 class Write(Stmt):
   lhs: Exp
   rhs: Exp
@@ -245,7 +315,7 @@ class Write(Stmt):
       machine.finish_statement(self.location)
 
       
-@dataclass
+@dataclass(slots=True)
 class Expr(Stmt):
   exp: Exp
   __match_args__ = ("exp",)
@@ -274,7 +344,7 @@ class Expr(Stmt):
       machine.finish_statement(self.location)
     
       
-@dataclass
+@dataclass(slots=True)
 class Assert(Stmt):
   exp: Exp
   __match_args__ = ("exp",)
@@ -308,7 +378,7 @@ class Assert(Stmt):
         error(self.location, "assertion failed: " + str(self.exp))
       machine.finish_statement(self.location)
       
-@dataclass
+@dataclass(slots=True)
 class IfStmt(Stmt):
   cond: Exp
   thn: Stmt
@@ -329,8 +399,12 @@ class IfStmt(Stmt):
       return self.cond.free_vars() | self.thn.free_vars() \
           | self.els.free_vars()
 
+  # The dead branch of an `if` with a constant condition is dropped
+  # after type checking (see branch_elimination.py), so that it is
+  # still type checked.
   def const_eval(self, env):
-    new_cond = self.cond.const_eval(env)
+    from variables_and_binding import const_eval_operand
+    new_cond = const_eval_operand(self.cond, env)
     new_thn = self.thn.const_eval(env)
     new_els = self.els.const_eval(env)
     return IfStmt(self.location, new_cond, new_thn, new_els)
@@ -357,7 +431,7 @@ class IfStmt(Stmt):
     return IfStmt(self.location, cast_cond, new_thn, new_els)
     
       
-@dataclass
+@dataclass(slots=True)
 class While(Stmt):
   cond: Exp
   body: Stmt
@@ -373,7 +447,8 @@ class While(Stmt):
       return self.cond.free_vars() | self.body.free_vars()
 
   def const_eval(self, env):
-    new_cond = self.cond.const_eval(env)
+    from variables_and_binding import const_eval_operand
+    new_cond = const_eval_operand(self.cond, env)
     new_body = self.body.const_eval(env)
     return While(self.location, new_cond, new_body)
     
@@ -397,7 +472,7 @@ class While(Stmt):
     else:
       machine.finish_statement(self.location)
     
-@dataclass
+@dataclass(slots=True)
 class Pass(Stmt):
   def __str__(self):
       return "pass"
@@ -418,7 +493,7 @@ class Pass(Stmt):
     machine.finish_statement(self.location)
     
 
-@dataclass
+@dataclass(slots=True)
 class Block(Stmt):
   body: Stmt
   __match_args__ = ("body",)
@@ -451,7 +526,7 @@ class Block(Stmt):
         
 # Declarations
     
-@dataclass
+@dataclass(slots=True)
 class Global(Decl):
   name: str
   type_annot: Type
@@ -494,7 +569,7 @@ class Global(Decl):
                            self.location)
       machine.finish_definition(self.location)
 
-@dataclass
+@dataclass(slots=True)
 class ConstantDef(Exp):
   name: str
   type_annot: Type
@@ -524,7 +599,7 @@ class ConstantDef(Exp):
   def local_vars(self):
     return set([var.ident])
 
-@dataclass
+@dataclass(slots=True)
 class TypeAlias(Decl):
   name: str
   type: Type
@@ -540,7 +615,7 @@ class TypeAlias(Decl):
     env[self.name] = simplify(self.type, env)
     return []
     
-@dataclass
+@dataclass(slots=True)
 class TypeOperator(Decl):
   name: str
   params: list[str]
@@ -562,7 +637,7 @@ class TypeOperator(Decl):
     env[self.name] = TypeOp(self.location, self.params, new_body)
     return []
     
-@dataclass
+@dataclass(slots=True)
 class ApplyCoercion(Exp):
   exp: Exp
   coercion: Coercion
@@ -587,7 +662,7 @@ class ApplyCoercion(Exp):
                            machine, self.location)
 
 def make_cast(exp: Exp, source: Type, target: Type):
-    if source == target:
+    if same_type(source, target):
         return exp
     else:
         return ApplyCoercion(exp.location, exp,
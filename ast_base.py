@@ -1,10 +1,11 @@
 from __future__ import annotations # To refer to class type in the class.
 
-from dataclasses import dataclass
-from lark.tree import Meta
+from dataclasses import dataclass, field
+from locations import Location
 from typing import Any
 from fractions import Fraction
 from error import error
+from type_env import TypeEnv
 
 def copy(exp):
   if exp is None:
@@ -12,18 +13,18 @@ def copy(exp):
   else:
     return exp.copy()
 
+# Type environments are persistent (see type_env.py), so the copy
+# shares the static information of the variables with the original.
 def copy_type_env(type_env):
-  return {x: info.copy() for x,info in type_env.items()}
+  return TypeEnv.of(type_env)
 
 def merge_type_env(tyenv1, tyenv2):
-  tyenv3 = {}
-  for x, info in tyenv1.items():
-    tyenv3[x] = info.copy()
+  tyenv3 = TypeEnv.of(tyenv1)
   for x, info in tyenv2.items():
-    if x in tyenv3.keys():
+    if x in tyenv3:
       tyenv3[x] = info.merge(tyenv3[x])
     else:
-      tyenv3[x] = info.copy()
+      tyenv3[x] = info
   return tyenv3
     
 
@@ -69,21 +70,23 @@ class Void(Value):
   def duplicate(self, percentage, location):
     pass
 
-@dataclass
+@dataclass(slots=True)
 class AST:
-    location: Meta
+    location: Location
     
     def debug_skip(self):
       return False
 
-@dataclass(frozen=True)
+# Types are compared structurally, so the location is not part of
+# their equality (see `intern_type` in ast_types.py).
+@dataclass(frozen=True, slots=True)
 class Type:
-    location: Meta
+    location: Location = field(compare=False)
 
     def is_ground(self) -> bool:
       raise Exception('Type.is_ground unimplemented')
 
-@dataclass
+@dataclass(slots=True)
 class Exp(AST):
   
   # Returns the set of free variables of this expression.
@@ -119,7 +122,7 @@ class Exp(AST):
   def copy(self):
     return self
   
-@dataclass
+@dataclass(slots=True)
 class Stmt(AST):
 
   def __str__(self):
@@ -149,7 +152,7 @@ class Stmt(AST):
 
 
 # TODO: change name of Decl to Definition
-@dataclass
+@dataclass(slots=True)
 class Decl(AST):
   
   def __str__(self):
@@ -0,0 +1,122 @@
+#
+# This file defines an on-disk cache of the front end's output,
+# that is, the declarations produced by parsing, constant evaluation,
+# and type checking a program, so that running the same program again
+# can skip straight to the machine.
+#
+# Like Python's `.pyc` files, the cache lives in a `__pycache__`
+# directory next to the (first) source file. An entry is only used if
+# its key matches, where the key is a hash of
+# * the name and contents of every source file, in order,
+# * the grammar (see `grammar_hash` in parser.py), and
+# * the interpreter version, that is, the Python source of the
+#   interpreter and the version of Python running it,
+# and the module files imported by the program (see module_loader.py)
+# still have the contents they had when the entry was saved.
+#
+# This file also provides the reading and writing of the interface
+# and object files of separately compiled modules (see module_loader.py).
+
+from parser import grammar_hash
+from utilities import with_recursion_limit
+import functools
+import hashlib
+import os
+import pickle
+import sys
+
+interpreter_dir = os.path.dirname(os.path.abspath(__file__))
+
+@functools.cache
+def interpreter_version():
+  h = hashlib.sha256(str(sys.version_info[:2]).encode('utf8'))
+  for name in sorted(os.listdir(interpreter_dir)):
+    if name.endswith('.py'):
+      h.update(name.encode('utf8'))
+      with open(os.path.join(interpreter_dir, name), 'rb') as f:
+        h.update(f.read())
+  return h.hexdigest()
+
+# The `sources` parameter is a list of (filename, contents) pairs,
+# and `options` are the flags that change the translation.
+def translation_key(sources, options=()):
+  h = hashlib.sha256()
+  h.update(grammar_hash.encode('utf8'))
+  h.update(interpreter_version().encode('utf8'))
+  for option in options:
+    h.update(option.encode('utf8') + b'\0')
+  for filename, text in sources:
+    h.update(filename.encode('utf8') + b'\0')
+    h.update(text.encode('utf8') + b'\0')
+  return h.hexdigest()
+
+def cache_filename(sources):
+  first = sources[0][0]
+  names = '\0'.join(os.path.abspath(filename) for filename, _ in sources)
+  tag = hashlib.sha256(names.encode('utf8')).hexdigest()[:8]
+  return os.path.join(os.path.dirname(os.path.abspath(first)), '__pycache__',
+                      os.path.basename(first) + '.' + tag + '.arete')
+
+# The cache file for the module file `filename` with the given
+# extension, such as `.arete-iface` for its interface.
+def module_cache_filename(filename, extension):
+  return os.path.join(os.path.dirname(filename), '__pycache__',
+                      os.path.basename(filename) + extension)
+
+def text_hash(text):
+  return hashlib.sha256(text.encode('utf8')).hexdigest()
+
+def file_hash(filename):
+  try:
+    with open(filename, 'r') as f:
+      return text_hash(f.read())
+  except OSError:
+    return None
+
+# Returns the object stored in the cache file, or None if there
+# is no such file or it cannot be read.
+def read_cache(filename):
+  try:
+    with open(filename, 'rb') as f:
+      return with_recursion_limit(pickle.load, f)
+  except Exception:
+    return None
+
+def write_cache(filename, obj):
+  tmp_filename = filename + '.' + str(os.getpid())
+  try:
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(tmp_filename, 'wb') as f:
+      with_recursion_limit(pickle.dump, obj, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_filename, filename)
+  except (OSError, pickle.PicklingError, RecursionError,
+          TypeError, AttributeError):
+    # The cache is an optimization, so carry on without it,
+    # for example when the directory is read-only or the
+    # AST is too deep to pickle.
+    if os.path.exists(tmp_filename):
+      os.remove(tmp_filename)
+
+# Returns the cached declarations for the program, or None
+# if there are none for this exact key.
+def load_translation(sources, key):
+  if len(sources) == 0:
+    return None
+  entry = read_cache(cache_filename(sources))
+  if entry is None:
+    return None
+  cached_key, imported, decls = entry
+  if cached_key != key:
+    return None
+  for filename, digest in imported:
+    if file_hash(filename) != digest:
+      return None
+  return decls
+
+# The `imported` parameter is a list of (filename, contents) pairs
+# for the module files that were loaded by the program.
+def save_translation(sources, key, decls, imported=[]):
+  if len(sources) == 0:
+    return
+  imported = [(name, text_hash(text)) for name, text in imported]
+  write_cache(cache_filename(sources), (key, imported, decls))
@@ -1,7 +1,8 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, fields
 from ast_base import Type, AST, Exp
 from typing import Any
-from lark.tree import Meta
+from locations import Location
+import functools
 from utilities import tracing_on, error, static_error
 
 
@@ -10,7 +11,7 @@ from utilities import tracing_on, error, static_error
 # Note: we use tuples instead of lists inside types because types need
 # to be hashable, so they may only contain immutable values.
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class AnyType(Type):
     def __str__(self):
         return '?'
@@ -24,7 +25,7 @@ class AnyType(Type):
     def is_ground(self) -> bool:
         return False
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class IntType(Type):
     def __str__(self):
         return 'int'
@@ -39,7 +40,7 @@ class IntType(Type):
         return True
 
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class RationalType(Type):
     def __str__(self):
         return 'rational'
@@ -54,7 +55,7 @@ class RationalType(Type):
         return True
 
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class BoolType(Type):
     def __str__(self):
         return 'bool'
@@ -69,7 +70,7 @@ class BoolType(Type):
         return True
 
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class VoidType(Type):
     def __str__(self):
         return 'void'
@@ -83,7 +84,7 @@ class VoidType(Type):
     def is_ground(self) -> bool:
         return True
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class PointerType(Type):
     type: Type
     __match_args__ = ("type",)
@@ -100,7 +101,7 @@ class PointerType(Type):
     def is_ground(self) -> bool:
         return self.type == AnyType(self.location)
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class RecursiveType(Type):
     name: str
     type: Type
@@ -115,7 +116,7 @@ class RecursiveType(Type):
     def is_ground(self) -> bool:
         return self.type.is_ground()
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class ArrayType(Type):
     element_type: Type
     __match_args__ = ("element_type",)
@@ -133,7 +134,7 @@ class ArrayType(Type):
     def is_ground(self) -> bool:
         return self.element_type == AnyType(self.location)
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class TupleType(Type):
     member_types: tuple[Type]
     __match_args__ = ("member_types",)
@@ -146,13 +147,14 @@ class TupleType(Type):
 
     def __eq__(self, other):
         return isinstance(other, TupleType) \
+               and len(self.member_types) == len(other.member_types) \
                and all([t1 == t2 for t1, t2 in zip(self.member_types,
                                                    other.member_types)])
 
     def is_ground(self) -> bool:
         return all([t == AnyType(self.location) for t in self.member_types])
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class RecordType(Type):
     field_types: tuple[tuple[str, Type]]
     __match_args__ = ("field_types",)
@@ -167,13 +169,14 @@ class RecordType(Type):
     def __eq__(self, other):
         # TODO: allow different orderings
         return isinstance(other, RecordType) \
+               and len(self.field_types) == len(other.field_types) \
                and all([t1 == t2 for t1, t2 in zip(self.field_types,
                                                    other.field_types)])
 
     def is_ground(self) -> bool:
         return all([t == AnyType(self.location) for f,t in self.field_types])
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class VariantType(Type):
     alternative_types: tuple[tuple[str, Type]]
     __match_args__ = ("alternative_types",)
@@ -186,14 +189,16 @@ class VariantType(Type):
         return str(self)
 
     def __eq__(self, other):
-        return isinstance(other, TupleType) \
+        return isinstance(other, VariantType) \
+               and len(self.alternative_types) == len(other.alternative_types) \
                and all([t1 == t2 for t1, t2 in zip(self.alternative_types,
                                                    other.alternative_types)])
 
     def is_ground(self) -> bool:
-        return all([t == AnyType(self.location) for f,t in self.field_types])
+        return all([t == AnyType(self.location)
+                    for f,t in self.alternative_types])
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class FunctionType(Type):
     type_params: tuple[str]
     param_types: tuple[tuple[str, Type]]
@@ -216,7 +221,7 @@ class FunctionType(Type):
         return all([t == AnyType(self.location) for t in self.param_types]) \
             and self.return_type == AnyType(self.location)
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class InterfaceType(Type):
     iface: AST
 
@@ -227,7 +232,7 @@ class InterfaceType(Type):
         return str(self)
 
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class ModuleType(Type):
     member_info: dict[str, Any]
     __match_args__ = ("member_types",)
@@ -240,7 +245,7 @@ class ModuleType(Type):
         return str(self)
 
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class FutureType(Type):
     result_type: Type
     __match_args__ = ("reult_type",)
@@ -252,7 +257,7 @@ class FutureType(Type):
         return str(self)
 
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class TypeVar(Type):
     ident: str
     __match_args__ = ("ident",)
@@ -269,7 +274,7 @@ class TypeVar(Type):
     def is_ground(self) -> bool:
         return True
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class TypeApplication(Type):
     typeop: Type
     args: tuple[Type]
@@ -283,28 +288,145 @@ class TypeApplication(Type):
         return str(self)
 
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class TypeOp(Type):
     params: list[str]
     type: Type
     __match_args__ = ("params", "type")
 
 
+# Hash consing of types
+#
+# Structurally equal types share one canonical object, so that
+# comparing two canonical types is a pointer comparison (see
+# `same_type`) and the results of `consistent`, `join`, `unfold`, and
+# `simplify` can be memoized on the identity of their inputs. The
+# location of a canonical type is that of the first occurrence that was
+# interned; each occurrence in the program keeps its own type node, and
+# with it, its own location. Types that contain other AST nodes, such
+# as the requirements of a generic function type, are not interned.
+
+# Maps the class and the (interned) parts of a type to its canonical object.
+type_table: dict[Any, Type] = {}
+# The ids of the canonical types. They are never freed, so their ids
+# are never reused.
+canonical_type_ids: set[int] = set()
+
+def is_canonical(ty) -> bool:
+    return id(ty) in canonical_type_ids
+
+# The names of the fields of a type class, other than its location.
+@functools.cache
+def type_part_names(cls) -> tuple[str]:
+    return tuple(f.name for f in fields(cls) if f.name != 'location')
+
+def intern_type(ty):
+    if ty is None or is_canonical(ty):
+        return ty
+    parts = [intern_part(getattr(ty, name))
+             for name in type_part_names(type(ty))]
+    if any(key is None for _, key in parts):
+        return ty
+    key = (type(ty),) + tuple(key for _, key in parts)
+    canon = type_table.get(key)
+    if canon is None:
+        canon = type(ty)(ty.location, *[part for part, _ in parts])
+        type_table[key] = canon
+        canonical_type_ids.add(id(canon))
+    return canon
+
+# Returns the part of a type with its types interned, and a key for
+# the part, or None for the key if the part cannot be interned.
+def intern_part(x):
+    if isinstance(x, Type):
+        canon = intern_type(x)
+        return (canon, ('type', id(canon)) if is_canonical(canon) else None)
+    elif isinstance(x, (tuple, list)):
+        parts = [intern_part(y) for y in x]
+        if any(key is None for _, key in parts):
+            return (x, None)
+        return (type(x)(part for part, _ in parts),
+                (type(x).__name__,) + tuple(key for _, key in parts))
+    elif isinstance(x, (str, int)):
+        return (x, x)
+    elif x is None:
+        return (x, ('None',))
+    else:
+        return (x, None)
+
+# Type equality, which takes constant time when both types are canonical.
+def same_type(ty1: Type, ty2: Type) -> bool:
+    if ty1 is ty2:
+        return True
+    elif is_canonical(ty1) and is_canonical(ty2):
+        return False
+    else:
+        return ty1 == ty2
+
+unfold_memo: dict[int, Type] = {}
+
 def unfold(ty: Type) -> Type:
     if isinstance(ty, RecursiveType):
-        ret = substitute({ty.name: ty}, ty.type)
-        return ret
+        canon = intern_type(ty)
+        if not is_canonical(canon):
+            return substitute({ty.name: ty}, ty.type)
+        if id(canon) not in unfold_memo:
+            unfold_memo[id(canon)] = \
+                intern_type(substitute({canon.name: canon}, canon.type))
+        return unfold_memo[id(canon)]
     else:
         return ty
 
 
-def require_consistent(ty1: Type, ty2: Type, msg: str, location: Meta):
+def require_consistent(ty1: Type, ty2: Type, msg: str, location: Location):
     if not consistent(ty1, ty2):
         static_error(location, msg + ', ' + str(ty1)
                      + ' inconsistent with ' + str(ty2))
 
 
+simplify_memo: dict[Any, Type] = {}
+
+# The result of `simplify` depends only on the type and on what `env`
+# says about the type variables that occur in it, so the result is
+# memoized on those, provided that they are all types.
 def simplify(type: Type, env) -> Type:
+    canon = intern_type(type)
+    if not is_canonical(canon):
+        return simplify_type(type, env)
+    bindings = []
+    for x in type_var_names(canon):
+        binding = intern_type(env.get(x))
+        if binding is not None and not is_canonical(binding):
+            return simplify_type(type, env)
+        bindings.append(id(binding))
+    key = (id(canon), tuple(bindings))
+    if key not in simplify_memo:
+        # Simplify the original type, so that an error points to it.
+        simplify_memo[key] = intern_type(simplify_type(type, env))
+    return simplify_memo[key]
+
+type_var_names_memo: dict[int, tuple[str]] = {}
+
+# The names of the type variables that occur in the canonical type `ty`.
+def type_var_names(ty: Type) -> tuple[str]:
+    if id(ty) not in type_var_names_memo:
+        names = set()
+        collect_type_var_names(ty, names)
+        type_var_names_memo[id(ty)] = tuple(sorted(names))
+    return type_var_names_memo[id(ty)]
+
+def collect_type_var_names(x, names):
+    if isinstance(x, TypeVar):
+        names.add(x.ident)
+    elif isinstance(x, Type):
+        for f in fields(x):
+            if f.name != 'location':
+                collect_type_var_names(getattr(x, f.name), names)
+    elif isinstance(x, (tuple, list)):
+        for y in x:
+            collect_type_var_names(y, names)
+
+def simplify_type(type: Type, env) -> Type:
     match type:
         case TypeVar(name):
             if name in env.keys():
@@ -313,24 +435,25 @@ def simplify(type: Type, env) -> Type:
                 error(type.location, "use of undefined type variable " + name)
         case TupleType(ts2):
             ret = TupleType(type.location,
-                            tuple(simplify(elt_ty, env) for elt_ty in ts2))
+                            tuple(simplify_type(elt_ty, env) for elt_ty in ts2))
         case PointerType(elt_ty):
-            ret = PointerType(type.location, simplify(elt_ty, env))
+            ret = PointerType(type.location, simplify_type(elt_ty, env))
         case ArrayType(elt_ty):
-            ret = ArrayType(type.location, simplify(elt_ty, env))
+            ret = ArrayType(type.location, simplify_type(elt_ty, env))
         case RecursiveType(name, elt_ty):
             body_env = env.copy()
             body_env[name] = TypeVar(type.location, name)
-            ret = RecursiveType(type.location, name, simplify(elt_ty, body_env))
+            ret = RecursiveType(type.location, name,
+                                simplify_type(elt_ty, body_env))
         case FunctionType(ty_params, param_tys, ret_ty, requirements):
             body_env = env.copy()
             for k, t in ty_params:
                 body_env[t] = TypeVar(type.location, t)
             ret = FunctionType(type.location,
                                ty_params,
-                               tuple((k, simplify(ty, body_env)) \
+                               tuple((k, simplify_type(ty, body_env)) \
                                      for k, ty in param_tys),
-                               simplify(ret_ty, body_env),
+                               simplify_type(ret_ty, body_env),
                                requirements)  # TODO: simplify requirements
         case IntType():
             ret = type
@@ -344,10 +467,10 @@ def simplify(type: Type, env) -> Type:
             ret = type
         case RecordType(alts):
             ret = RecordType(type.location,
-                             tuple((x, simplify(t, env)) for x, t in alts))
+                             tuple((x, simplify_type(t, env)) for x, t in alts))
         case VariantType(alts):
             ret = VariantType(type.location,
-                              tuple((x, simplify(t, env)) for x, t in alts))
+                              tuple((x, simplify_type(t, env)) for x, t in alts))
         case TypeApplication(tyop, args):
             type_op = simplify(tyop, env)
             match type_op:
@@ -365,6 +488,9 @@ def simplify(type: Type, env) -> Type:
 
 
 def substitute(subst: dict[str, Type], ty2: Type) -> Type:
+    if len(subst) == 0:
+        # Returning the type itself keeps it canonical.
+        return ty2
     match ty2:
         case TypeVar(name):
             if name in subst.keys():
@@ -408,8 +534,31 @@ def substitute(subst: dict[str, Type], ty2: Type) -> Type:
             error(ty2.location, 'in substitute, unrecognized type ' + str(ty2))
 
 
+# The key for a pair of types in a set of assumptions, which avoids
+# hashing the (possibly large) types when they are canonical.
+def assumption(ty1: Type, ty2: Type):
+    if is_canonical(ty1) and is_canonical(ty2):
+        return (id(ty1), id(ty2))
+    else:
+        return (ty1, ty2)
+
+consistent_memo: dict[tuple[int, int], bool] = {}
+
 def consistent(ty1: Type, ty2: Type, assumed_consistent=set()) -> bool:
-    if (ty1, ty2) in assumed_consistent:
+    # The result depends on the assumptions, so only the calls
+    # without any are memoized.
+    if len(assumed_consistent) == 0:
+        canon1, canon2 = intern_type(ty1), intern_type(ty2)
+        if is_canonical(canon1) and is_canonical(canon2):
+            key = (id(canon1), id(canon2))
+            if key not in consistent_memo:
+                consistent_memo[key] = consistent_types(canon1, canon2,
+                                                        assumed_consistent)
+            return consistent_memo[key]
+    return consistent_types(ty1, ty2, assumed_consistent)
+
+def consistent_types(ty1: Type, ty2: Type, assumed_consistent) -> bool:
+    if assumption(ty1, ty2) in assumed_consistent:
         return True
     match (ty1, ty2):
         case (AnyType(), _):
@@ -421,10 +570,10 @@ def consistent(ty1: Type, ty2: Type, assumed_consistent=set()) -> bool:
         case (_, None):
             result = True
         case (RecursiveType(X, t1), _):
-            assm = assumed_consistent | set([(ty1, ty2)])
+            assm = assumed_consistent | set([assumption(ty1, ty2)])
             return consistent(unfold(ty1), ty2, assm)
         case (_, RecursiveType(X, t2)):
-            assm = assumed_consistent | set([(ty1, ty2)])
+            assm = assumed_consistent | set([assumption(ty1, ty2)])
             return consistent(ty1, unfold(ty2), assm)
         case (ArrayType(t1), ArrayType(t2)):
             result = consistent(t1, t2, assumed_consistent)
@@ -462,7 +611,18 @@ def consistent(ty1: Type, ty2: Type, assumed_consistent=set()) -> bool:
     return result
 
 
+join_memo: dict[tuple[int, int], Type] = {}
+
 def join(ty1: Type, ty2: Type) -> Type:
+    canon1, canon2 = intern_type(ty1), intern_type(ty2)
+    if is_canonical(canon1) and is_canonical(canon2):
+        key = (id(canon1), id(canon2))
+        if key not in join_memo:
+            join_memo[key] = intern_type(join_types(canon1, canon2))
+        return join_memo[key]
+    return join_types(ty1, ty2)
+
+def join_types(ty1: Type, ty2: Type) -> Type:
     match (ty1, ty2):
         case (None, _):
             return ty2
@@ -490,16 +650,44 @@ def join(ty1: Type, ty2: Type) -> Type:
             return ty1
 
 
+match_memo: dict[Any, tuple[bool, dict[str, Type]]] = {}
+
+# Matching only adds to `matches`, so the result of matching canonical
+# types, given the matches so far, is memoized along with the matches
+# that it adds.
 def match_types(vars: tuple[str],
                 pat_ty: Type,
                 match_ty: Type,
                 matches: dict[str, Type],
                 assumed_consistent):
+    if len(assumed_consistent) == 0:
+        pat_canon, match_canon = intern_type(pat_ty), intern_type(match_ty)
+        if is_canonical(pat_canon) and is_canonical(match_canon) \
+           and all(is_canonical(t) for t in matches.values()):
+            key = (tuple(vars), id(pat_canon), id(match_canon),
+                   tuple(sorted((x, id(t)) for x, t in matches.items())))
+            if key not in match_memo:
+                new_matches = dict(matches)
+                result = match_types_uncached(vars, pat_canon, match_canon,
+                                              new_matches, assumed_consistent)
+                match_memo[key] = (result, {x: intern_type(t) for x, t
+                                            in new_matches.items()})
+            result, new_matches = match_memo[key]
+            matches.update(new_matches)
+            return result
+    return match_types_uncached(vars, pat_ty, match_ty, matches,
+                                assumed_consistent)
+
+def match_types_uncached(vars: tuple[str],
+                         pat_ty: Type,
+                         match_ty: Type,
+                         matches: dict[str, Type],
+                         assumed_consistent):
     if tracing_on():
         print('match\t' + str(pat_ty) + '\nwith\t' + str(match_ty)
               + '\nassuming\t' + str(assumed_consistent)
               + '\nmatches:\t' + str(matches))
-    if (pat_ty, match_ty) in assumed_consistent:
+    if assumption(pat_ty, match_ty) in assumed_consistent:
         return True
     match (pat_ty, match_ty):
         case (AnyType(), _):
@@ -529,10 +717,10 @@ def match_types(vars: tuple[str],
         case (ArrayType(pt), ArrayType(mt)):
             return match_types(vars, pt, mt, matches, assumed_consistent)
         case (RecursiveType(X, t1), _):
-            assm = assumed_consistent | set([(pat_ty, match_ty)])
+            assm = assumed_consistent | set([assumption(pat_ty, match_ty)])
             return match_types(vars, unfold(pat_ty), match_ty, matches, assm)
         case (_, RecursiveType(X, t2)):
-            assm = assumed_consistent | set([(pat_ty, match_ty)])
+            assm = assumed_consistent | set([assumption(pat_ty, match_ty)])
             return match_types(vars, pat_ty, unfold(match_ty), matches, assm)
         case (FunctionType(tps1, pts1, rt1),
               FunctionType(tps2, pts2, rt2)):
@@ -629,6 +817,9 @@ class StaticVarInfo(StaticInfo):
         return StaticVarInfo(self.type, self.translation,
                              self.state, self.param)
 
+    def with_state(self, state):
+        return StaticVarInfo(self.type, self.translation, state, self.param)
+
     def apply_subst(self, subst):
         return StaticVarInfo(substitute(subst, self.type),
                              self.translation,
@@ -0,0 +1,94 @@
+#
+# This file defines generic traversals of the abstract syntax trees,
+# which the optimization passes (see optimizer.py) use to visit and
+# rewrite a program without a method for each kind of node.
+#
+# The children of a node are the values of its fields, and the items of
+# the lists, tuples, and dictionaries among them. The types and
+# coercions in a node are not its children. Rewriting a node returns a
+# copy of it, in which the children that did not change are shared with
+# the original.
+
+from dataclasses import fields, is_dataclass, replace
+
+from ast_base import *
+from coercions import Coercion
+from variables_and_binding import Param, BindingExp, BindingStmt
+from functions import Function, Lambda
+from tuples_and_arrays import ForIn
+from variants import Match
+
+def is_leaf(x):
+  return isinstance(x, (Type, Coercion)) \
+    or not (is_dataclass(x) or isinstance(x, (list, tuple, dict))) \
+    or isinstance(x, type)
+
+# Returns a copy of the node with `f` applied to its children, or the
+# node itself if no child changed.
+def map_children(x, f):
+  return map_fields(x, lambda name, y: f(y))
+
+def for_children(x, f):
+  if is_leaf(x):
+    return
+  elif is_dataclass(x):
+    for fld in fields(x):
+      f(getattr(x, fld.name))
+  elif isinstance(x, (list, tuple)):
+    for y in x:
+      f(y)
+  elif isinstance(x, dict):
+    for y in x.values():
+      f(y)
+
+# Like `map_children`, but `f` also receives the parameters that are
+# in scope in the child but not around the node, such as the
+# parameters of a function in its body.
+def map_scoped_children(x, f):
+  match x:
+    case Match(condition, cases):
+      new_cases = [(tag, param,
+                    f(body, [param] if isinstance(param, Param) else []))
+                   for (tag, param, body) in cases]
+      if all(new[2] is old[2] for new, old in zip(new_cases, cases)):
+        new_cases = cases
+      return map_fields(x, lambda name, y:
+                        new_cases if name == 'cases' else f(y, []))
+    case _:
+      params = body_params(x)
+      return map_fields(x, lambda name, y:
+                        f(y, params if name == 'body' else []))
+
+# The parameters in scope in the body of the node.
+def body_params(x):
+  match x:
+    case Function(params=params):
+      return params
+    case Lambda(params, captures):
+      return params + captures
+    case BindingExp(param) | BindingStmt(param) | ForIn(param):
+      return [param]
+    case _:
+      return []
+
+def map_fields(x, f):
+  if is_leaf(x):
+    return x
+  elif is_dataclass(x):
+    changes = {}
+    for fld in fields(x):
+      value = getattr(x, fld.name)
+      new_value = f(fld.name, value)
+      if new_value is not value:
+        changes[fld.name] = new_value
+    if len(changes) > 0:
+      return replace(x, **changes)
+  elif isinstance(x, (list, tuple)):
+    items = [f(None, y) for y in x]
+    if any(new is not old for new, old in zip(items, x)):
+      return type(x)(items)
+  elif isinstance(x, dict):
+    items = {k: f(None, y) for k, y in x.items()}
+    if any(items[k] is not y for k, y in x.items()):
+      return items
+  return x
@@ -0,0 +1,41 @@
+#
+# This file defines the branch elimination pass, which drops the
+# branches of the statements whose condition is a constant, such as
+# the ones that const_eval produces by folding the condition (see
+# `const_eval_prim`) or by replacing a constant `let` variable in it.
+#
+# An `if` statement with a constant condition is replaced by the branch
+# that it takes, and a `while` loop whose condition is `false` by `pass`.
+# The pass runs after type checking (see optimizer.py), so that the
+# dropped branches are still type checked.
+
+from dataclasses import dataclass
+
+from ast_base import *
+from abstract_syntax import Bool, IfStmt, While, Pass
+from ast_walk import map_children
+
+@dataclass
+class BranchReport:
+  removed: int = 0
+
+  def __str__(self):
+    return str(self.removed) + ' dead branches removed'
+
+def eliminate_dead_branches(decls):
+  report = BranchReport()
+  return eliminate_in(decls, report, {}), report
+
+def eliminate_in(x, report, memo):
+  if id(x) in memo:
+    return memo[id(x)]
+  result = map_children(x, lambda y: eliminate_in(y, report, memo))
+  match result:
+    case IfStmt(Bool(b), thn, els):
+      report.removed += 1
+      result = thn if b else els
+    case While(Bool(False)):
+      report.removed += 1
+      result = Pass(result.location)
+  memo[id(x)] = result
+  return result
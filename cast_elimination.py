@@ -0,0 +1,152 @@
+#
+# This file defines the cast elimination pass, which runs on the
+# program after type checking and removes the casts (`ApplyCoercion`
+# nodes, see `make_cast` in abstract_syntax.py) that are not needed.
+# Each cast costs a step of the machine and a `Coercion.apply`, so
+#
+# * a cast whose coercion is an identity, such as `Ref(id, id)`, is
+#   removed, so that the program behaves as if the types were equal,
+# * a cast of a cast is fused into one cast by composing the two
+#   coercions (see `compose` in coercions.py), which often cancels them
+#   out, as in `⟨int?⟩⟨int!⟩e`, and
+# * the injection of a `let`-bound variable of ground type inside a
+#   loop, as in passing the variable to a parameter of type `?`, is
+#   hoisted out of the loop. Such a variable does not change during
+#   its scope and an injection cannot fail, so the injection is done
+#   once, before the loop, into a new `let`-bound variable.
+#
+# The pass returns a `CastReport` with the number of casts removed, fused,
+# hoisted, and remaining, which is printed by the `opt_report` flag.
+
+from dataclasses import dataclass
+
+from ast_base import *
+from ast_types import *
+from coercions import *
+from abstract_syntax import ApplyCoercion, While
+from variables_and_binding import Param, Var, BindingStmt
+from functions import Lambda
+from ast_walk import map_children, for_children, map_scoped_children
+
+@dataclass
+class CastReport:
+  removed: int = 0
+  fused: int = 0
+  hoisted: int = 0
+  remaining: int = 0
+
+  def __str__(self):
+    return '{removed} casts removed, {fused} fused, {hoisted} hoisted, ' \
+      '{remaining} remaining'.format(removed=self.removed, fused=self.fused,
+                                     hoisted=self.hoisted,
+                                     remaining=self.remaining)
+
+def eliminate_casts(decls):
+  report = CastReport()
+  decls = simplify_casts(decls, report, {})
+  decls = hoist_casts(decls, {}, report)
+  report.remaining = count_casts(decls, set())
+  return decls, report
+
+def is_identity(c: Coercion) -> bool:
+  match c:
+    case IdCoercion():
+      return True
+    case CoercePointer(_, rd, wt) | CoerceArray(_, rd, wt):
+      return is_identity(rd) and is_identity(wt)
+    case CoerceTuple(_, cs):
+      return all(is_identity(c) for c in cs)
+    case CoerceRecord(_, cs) | CoerceVariant(_, cs):
+      return all(is_identity(c) for c in cs.values())
+    case CoerceFunction(_, ps, r):
+      return all(is_identity(c) for c in ps) and is_identity(r)
+    case _:
+      return False
+
+# Returns a copy of the AST with the identity casts removed and the
+# casts of casts fused. The parts without such casts are shared with
+# the original.
+def simplify_casts(x, report, memo):
+  if id(x) in memo:
+    return memo[id(x)]
+  result = map_children(x, lambda y: simplify_casts(y, report, memo))
+  if isinstance(result, ApplyCoercion):
+    exp, coercion = result.exp, result.coercion
+    while isinstance(exp, ApplyCoercion):
+      coercion = compose(exp.coercion, coercion, result.location)
+      exp = exp.exp
+      report.fused += 1
+    if is_identity(coercion):
+      report.removed += 1
+      result = exp
+    elif exp is not result.exp:
+      result = ApplyCoercion(result.location, exp, coercion)
+  memo[id(x)] = result
+  return result
+
+# Returns a copy of the AST with the hoistable injections moved out of
+# the loops. The `scope` maps each variable in scope to the kind of
+# its binding (`let`, `var`, and so on), and the global variables are
+# not in it.
+def hoist_casts(x, scope, report):
+  if isinstance(x, While):
+    return hoist_out_of_loop(x, scope, report)
+  return map_scoped_children(x, lambda y, params:
+                             hoist_casts(y, scope | {p.ident: p.kind
+                                                     for p in params},
+                                         report))
+
+def hoist_out_of_loop(loop, scope, report):
+  casts = {}
+  bound = set()
+  find_hoistable(loop, scope, casts, bound)
+  hoisted = {key: '⟨' + str(c) + '⟩' + var.ident
+             for key, (var, c) in casts.items()
+             if var.ident not in bound}
+  new_loop = map_children(replace_hoisted(loop, hoisted, report),
+                          lambda y: hoist_casts(y, scope, report))
+  for key, tmp in hoisted.items():
+    var, c = casts[key]
+    param = Param(loop.location, 'let', None, tmp, AnyType(loop.location))
+    new_loop = BindingStmt(loop.location, param,
+                           ApplyCoercion(loop.location, var, c), new_loop)
+  return new_loop
+
+# Collects the injections of `let`-bound variables of ground type in
+# the loop, keyed by the variable and the injected type, and the names
+# bound inside the loop.
+def find_hoistable(x, scope, casts, bound):
+  match x:
+    case ApplyCoercion(Var(ident) as var, Inject(_, source) as c) \
+         if scope.get(ident) == 'let' \
+            and isinstance(source, (IntType, BoolType, RationalType)):
+      casts.setdefault((ident, id(source)), (var, c))
+    case Param(ident=ident):
+      bound.add(ident)
+    case Lambda(params, captures):
+      # the body of a lambda refers to its captures, not to the loop's
+      # variables
+      bound.update(p.ident for p in params + captures)
+    case _:
+      for_children(x, lambda y: find_hoistable(y, scope, casts, bound))
+
+def replace_hoisted(x, hoisted, report):
+  match x:
+    case ApplyCoercion(Var(ident), Inject(_, source)) \
+         if (ident, id(source)) in hoisted:
+      report.hoisted += 1
+      return Var(x.location, hoisted[(ident, id(source))])
+    case Lambda():
+      return x
+    case _:
+      return map_children(x, lambda y: replace_hoisted(y, hoisted, report))
+
+def count_casts(x, seen):
+  if id(x) in seen:
+    return 0
+  seen.add(id(x))
+  count = [1 if isinstance(x, ApplyCoercion) else 0]
+  def add(y):
+    count[0] += count_casts(y, seen)
+  for_children(x, add)
+  return count[0]
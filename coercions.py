@@ -1,12 +1,13 @@
 from ast_base import *
 from ast_types import *
-from values import Box
+from values import Box, Number, Boolean
+from fractions import Fraction
 from tuple_value import TupleValue
 from variant_value import Variant
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Coercion:
-    location: Meta
+    location: Location
 
     def source_type(self) -> Type:
         raise Exception('Coercion.source_type method unimplemented')
@@ -18,7 +19,28 @@ class Coercion:
         raise Exception('Coercion.apply method unimplemented')
 
 
-@dataclass(frozen=True)
+# The values of the ground types int, rational, and bool carry their
+# type with them, as the class of the value (and of the number inside
+# a `Number`). So `Inject` does not wrap them in a `Box`, and `Project`
+# only compares their tag with the target type. The tags are interned,
+# like the types in `Inject` and `Project` (see `make_coercion`).
+int_tag = intern_type(IntType(None))
+rational_tag = intern_type(RationalType(None))
+bool_tag = intern_type(BoolType(None))
+
+# Returns the tag of an unboxed value of ground type, or None.
+def ground_tag(val: Value):
+    match val:
+        case Boolean():
+            return bool_tag
+        case Number(n) if isinstance(n, int) and not isinstance(n, bool):
+            return int_tag
+        case Number(n) if isinstance(n, Fraction):
+            return rational_tag
+        case _:
+            return None
+
+@dataclass(frozen=True, slots=True)
 class Inject(Coercion):
     source: Type
 
@@ -29,12 +51,15 @@ class Inject(Coercion):
         return AnyType(self.location)
 
     def apply(self, val: Value) -> Value:
+        tag = ground_tag(val)
+        if tag is not None and same_type(tag, self.source):
+            return val
         return Box(val, self.source)
 
     def __str__(self):
         return str(self.source) + "!"
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Project(Coercion):
     target: Type
 
@@ -47,17 +72,23 @@ class Project(Coercion):
     def apply(self, val: Value) -> Value:
         match val:
             case Box(v, source):
-                if source == self.target:
+                if same_type(source, self.target):
                     return v
                 else:
                     raise Exception('projection failed, ' + str(val) + ' not of type ' + str(self.target))
             case _:
-                raise Exception('projection failed, ' + str(val) + ' not boxed')
+                tag = ground_tag(val)
+                if tag is None:
+                    raise Exception('projection failed, ' + str(val) + ' not boxed')
+                elif same_type(tag, self.target):
+                    return val
+                else:
+                    raise Exception('projection failed, ' + str(val) + ' not of type ' + str(self.target))
 
     def __str__(self):
         return str(self.target) + "?"
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CoerceTuple(Coercion):
     elt_coercions: list[Coercion]
 
@@ -77,7 +108,7 @@ class CoerceTuple(Coercion):
         vs = [c.apply(elt) for elt,c in zip(val.elts, self.elt_coercions)]
         return TupleValue(vs)
     
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CoerceFunction(Coercion):
     params: list[Coercion]
     ret: Coercion
@@ -117,7 +148,7 @@ class Proxy(Value):
     def kill(self, mem, location, progress=set()):
         self.value.kill(mem, location, progress)
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CoercePointer(Coercion):
     read: Coercion
     write: Coercion
@@ -135,9 +166,14 @@ class CoercePointer(Coercion):
         return PointerType(self.location, self.read.target_type())
 
     def apply(self, val: Value) -> Value:
-        return Proxy(val, self)
+        match val:
+          case Proxy(v, CoercePointer() as c):
+            # keep one layer of proxy, see `compose`
+            return Proxy(v, compose(c, self, self.location))
+          case _:
+            return Proxy(val, self)
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CoerceArray(Coercion):
     read: Coercion
     write: Coercion
@@ -149,7 +185,7 @@ class CoerceArray(Coercion):
         return ArrayType(self.location, self.read.target_type())
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class IdCoercion(Coercion):
     typ: Type
 
@@ -165,7 +201,7 @@ class IdCoercion(Coercion):
     def __str__(self):
         return 'id'
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Compose(Coercion):
     first : Coercion
     second : Coercion
@@ -180,7 +216,7 @@ class Compose(Coercion):
     def __repr__(self):
         return str(self)
     
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CoerceRecord(Coercion):
     elt_coercions: dict[str, Coercion]
 
@@ -194,7 +230,7 @@ class CoerceRecord(Coercion):
         fs = {f: self.elt_coercions[f].apply(v) for f,v in val.fields.items() }
         return Record(fs)
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class CoerceVariant(Coercion):
     elt_coercions: dict[str, Coercion]
 
@@ -216,22 +252,87 @@ class CoerceVariant(Coercion):
             error(self.location,
                   "in CoerceVariant, expected a variant, not " + str(val))
 
-def make_coercion(source: Type, target: Type, loc: Meta) -> Coercion:
+# Returns a coercion that does the same as applying `c1` and then `c2`.
+# The composition is computed eagerly and kept in normal form: an
+# identity is absorbed, an injection followed by a projection to the
+# same type cancels out, and two coercions of the same kind (pointer,
+# array, tuple, and so on) are composed component by component. So a
+# value that crosses many boundaries between typed and untyped code
+# carries a single coercion whose size does not grow with the number of
+# crossings, and a pointer is wrapped in at most one `Proxy`.
+def compose(c1: Coercion, c2: Coercion, loc: Location) -> Coercion:
+    c = compose_pair(c1, c2, loc)
+    if c is not None:
+        return c
+    # Re-associate, but only when the inner composition simplifies.
+    match c1:
+        case Compose(_, first, second):
+            c = compose(second, c2, loc)
+            if not is_plain_compose(c, second, c2):
+                return compose(first, c, loc)
+    match c2:
+        case Compose(_, first, second):
+            c = compose(c1, first, loc)
+            if not is_plain_compose(c, c1, first):
+                return compose(c, second, loc)
+    return Compose(loc, c1, c2)
+
+def is_plain_compose(c: Coercion, c1: Coercion, c2: Coercion) -> bool:
+    return isinstance(c, Compose) and c.first is c1 and c.second is c2
+
+# Returns the composition of two coercions that are not themselves
+# compositions, or None if it does not simplify.
+def compose_pair(c1: Coercion, c2: Coercion, loc: Location):
+    match (c1, c2):
+        case (IdCoercion(), _):
+            return c2
+        case (_, IdCoercion()):
+            return c1
+        case (Inject(_, s), Project(_, t)) if same_type(s, t):
+            return IdCoercion(loc, s)
+        case (CoercePointer(_, r1, w1), CoercePointer(_, r2, w2)):
+            return CoercePointer(loc, compose(r1, r2, loc), compose(w2, w1, loc))
+        case (CoerceArray(_, r1, w1), CoerceArray(_, r2, w2)):
+            return CoerceArray(loc, compose(r1, r2, loc), compose(w2, w1, loc))
+        case (CoerceTuple(_, cs1), CoerceTuple(_, cs2)) \
+              if len(cs1) == len(cs2):
+            return CoerceTuple(loc, [compose(a, b, loc)
+                                     for a, b in zip(cs1, cs2)])
+        case (CoerceRecord(_, cs1), CoerceRecord(_, cs2)) \
+              if cs1.keys() == cs2.keys():
+            return CoerceRecord(loc, {f: compose(cs1[f], c, loc)
+                                      for f, c in cs2.items()})
+        case (CoerceVariant(_, cs1), CoerceVariant(_, cs2)) \
+              if cs1.keys() == cs2.keys():
+            return CoerceVariant(loc, {f: compose(cs1[f], c, loc)
+                                       for f, c in cs2.items()})
+        case (CoerceFunction(_, ps1, r1), CoerceFunction(_, ps2, r2)) \
+              if len(ps1) == len(ps2):
+            return CoerceFunction(loc, [compose(b, a, loc)
+                                        for a, b in zip(ps1, ps2)],
+                                  compose(r1, r2, loc))
+        case _:
+            return None
+
+# The types in the `Inject` and `Project` coercions are interned, so
+# that checking a projection at runtime is a pointer comparison.
+def make_coercion(source: Type, target: Type, loc: Location) -> Coercion:
     match (source, target):
         case (AnyType(), _) if target.is_ground():
-            return Project(loc, target)
+            return Project(loc, intern_type(target))
         case (AnyType(), TupleType(ts)):
             any_types = [AnyType(loc) for t in ts]
             cs = [make_coercion(anyt, t, loc) for anyt, t in zip(any_types, ts)]
-            return Compose(loc, Project(loc, TupleType(loc, any_types)),
+            return Compose(loc,
+                           Project(loc, intern_type(TupleType(loc, any_types))),
                            CoerceTuple(loc, cs))
         case (_, AnyType()) if source.is_ground():
-            return Inject(loc, source)
+            return Inject(loc, intern_type(source))
         case (TupleType(ss), AnyType()):
             any_types = [AnyType(loc) for s in ss]
             cs = [make_coercion(s, anyt, loc) for s, anyt in zip(ss, any_types)]
             return Compose(loc, CoerceTuple(loc, cs),
-                           Inject(loc, TupleType(loc, any_types)))
+                           Inject(loc, intern_type(TupleType(loc, any_types))))
         case (AnyType(), AnyType()):
             return IdCoercion(loc, source)
         case (IntType(), IntType()):
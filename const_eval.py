@@ -15,7 +15,7 @@ from pointers import *
 from futures import *
 from interfaces_and_impls import *
 from dataclasses import dataclass
-from parser import parse, set_filename
+from parser import parse
 from typing import List, Set, Dict, Tuple, Any
 from fractions import Fraction
 import numbers
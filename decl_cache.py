@@ -0,0 +1,276 @@
+#
+# This file defines the declaration cache, which lets the type checker
+# skip the declarations whose inputs did not change since they were
+# last checked, and reuse their translations instead.
+#
+# The inputs of a declaration are its own structure (ignoring source
+# locations) and the static information of the names that its type
+# checking looked up in the type environment, which includes the
+# variables read by `Var.type_check`, the modules read by
+# `ModuleMember`, and the interfaces read by impl searches. The lookups
+# are recorded by the type environment itself (see `read_names` in
+# type_env.py). So an entry of the cache maps the fingerprint of a
+# declaration to the fingerprints of the information of each name it
+# read, and to its translation. The entry is reused if every one of
+# those names still has the same information.
+#
+# Only functions and module definitions are cached, because checking
+# them does not change the environment. The declarations in the body
+# of a module are cached one by one, so editing one function of a large
+# module only rechecks that function. A declaration that only moved is
+# reused too, with the locations in its translation moved along with it.
+#
+# The cache is saved next to the translation cache (see ast_cache.py),
+# so it survives from one run to the next, and the watch daemon (see
+# watch.py) keeps one in memory.
+
+from dataclasses import dataclass, fields, is_dataclass
+from typing import Any
+import copy
+import functools
+import hashlib
+
+from ast_base import Type
+from locations import Location
+from functions import Function
+from modules import ModuleDef
+from parser import grammar_hash
+from ast_cache import cache_filename, interpreter_version, \
+  read_cache, write_cache
+import type_env
+
+@dataclass
+class CacheEntry:
+  # Maps each name that was looked up to the fingerprint of its
+  # information, or None if it was not defined.
+  dependencies: dict[str, Any]
+  # The locations of the declaration that was checked, in the order
+  # of `describe`.
+  locations: list[Location]
+  translation: list[Any]
+  # The keys of the entries for the declarations inside this one,
+  # such as the members of a module.
+  parts: list[str]
+
+class DeclCache:
+  def __init__(self, entries=None):
+    self.entries = entries if entries is not None else {}
+    # The entries used or added by this run.
+    self.used = {}
+    self.hits = 0
+    self.misses = 0
+    # Maps the id of a declaration or of some static information to
+    # the object, its fingerprint, and its locations.
+    self.fingerprints = {}
+    self.type_structures = {}
+    # The keys of the entries used while checking the current
+    # declaration.
+    self.parts = []
+
+  def fingerprint(self, x):
+    return self.describe(x)[0]
+
+  # Returns the fingerprint and the locations of the declaration.
+  def describe(self, x):
+    if id(x) not in self.fingerprints:
+      self.fingerprints[id(x)] = (x,) + describe(x, self.type_structures)
+    return self.fingerprints[id(x)][1:]
+
+  # Starts another run with the same cache, as in the watch daemon.
+  # The entries that the last run did not use are forgotten, unless it
+  # stopped early, and so are the fingerprints of the objects other
+  # than the given declarations.
+  def next_run(self, decls, complete):
+    self.entries = self.used if complete else self.entries | self.used
+    self.used = {}
+    self.hits = 0
+    self.misses = 0
+    self.fingerprints = {id(d): self.fingerprints[id(d)] for d in decls
+                         if id(d) in self.fingerprints}
+    self.type_structures = {}
+
+  def info_fingerprint(self, name, env):
+    if name == type_env.all_names:
+      return fingerprint([(x, self.fingerprint(info))
+                          for x, info in env.items()])
+    info = env.get(name)
+    return None if info is None else self.fingerprint(info)
+
+  # Returns the cached translation of the declaration, or None.
+  def lookup(self, d, env):
+    key, locations = self.describe(d)
+    entry = self.used.get(key) or self.entries.get(key)
+    if entry is None:
+      return None
+    for name, fp in entry.dependencies.items():
+      if self.info_fingerprint(name, env) != fp:
+        return None
+    self.hits += 1
+    self.use(key, entry)
+    self.parts.append(key)
+    mapping = {old: new for old, new in zip(entry.locations, locations)
+               if old != new}
+    if len(mapping) == 0:
+      return entry.translation
+    return relocate(entry.translation, mapping, {})
+
+  def check(self, d, env):
+    translation = self.lookup(d, env)
+    if translation is not None:
+      return translation
+    self.misses += 1
+    outer_names, outer_parts = type_env.read_names, self.parts
+    type_env.read_names, self.parts = set(), []
+    try:
+      translation = d.type_check(env)
+    finally:
+      names, parts = type_env.read_names, self.parts
+      type_env.read_names, self.parts = outer_names, outer_parts
+      if outer_names is not None:
+        outer_names |= names
+    dependencies = {name: self.info_fingerprint(name, env)
+                    for name in sorted(names)}
+    key, locations = self.describe(d)
+    self.used[key] = CacheEntry(dependencies, locations, translation, parts)
+    self.parts.append(key)
+    return translation
+
+  # Keeps the entry, and the entries of its parts, in the cache.
+  def use(self, key, entry):
+    self.used[key] = entry
+    for part in entry.parts:
+      part_entry = self.used.get(part) or self.entries.get(part)
+      if part_entry is not None:
+        self.use(part, part_entry)
+
+  # Saves the entries used by this run. If the run stopped early, for
+  # example at a static error, the other entries are kept as well.
+  # The file is not rewritten if no entry was added or removed.
+  def save(self, sources, complete):
+    if len(sources) == 0:
+      return
+    if self.misses == 0 \
+       and (not complete or len(self.used) == len(self.entries)):
+      return # nothing changed
+    entries = self.used if complete else self.entries | self.used
+    write_cache(decl_cache_filename(sources),
+                (grammar_hash, interpreter_version(), entries))
+
+def load_decl_cache(sources):
+  if len(sources) == 0:
+    return DeclCache()
+  entry = read_cache(decl_cache_filename(sources))
+  if entry is not None:
+    cached_grammar, cached_version, entries = entry
+    if cached_grammar == grammar_hash \
+       and cached_version == interpreter_version():
+      return DeclCache(entries)
+  return DeclCache()
+
+def decl_cache_filename(sources):
+  return cache_filename(sources) + '-decls'
+
+# The cache used by `check_declaration`, or None.
+active_cache = None
+
+def check_declaration(d, env):
+  if active_cache is not None and isinstance(d, (Function, ModuleDef)):
+    return active_cache.check(d, env)
+  else:
+    return d.type_check(env)
+
+# The fingerprint of a declaration (or static information) is a hash
+# of its structure without its locations, so that a declaration that
+# only moved has the same fingerprint. (The `str` of a declaration
+# abbreviates the statements of a block.) The locations are returned
+# too, in the order they were visited, except for the locations in
+# types (see `relocate`).
+#
+# The structure of each type is remembered in `type_memo`, because
+# after constant evaluation the same (possibly large) type object
+# appears in many places.
+def describe(x, type_memo=None):
+  parts = []
+  locations = []
+  structure(x, parts, locations, {} if type_memo is None else type_memo)
+  return hashlib.sha256(''.join(parts).encode('utf8')).hexdigest(), locations
+
+def fingerprint(x):
+  return describe(x)[0]
+
+def structure(x, parts, locations, type_memo):
+  if isinstance(x, Type):
+    if id(x) not in type_memo:
+      type_parts = []
+      structure_of_dataclass(x, type_parts, [], type_memo)
+      type_memo[id(x)] = (x, ''.join(type_parts))
+    parts.append(type_memo[id(x)][1])
+  elif isinstance(x, (list, tuple)):
+    parts.append('[')
+    for y in x:
+      structure(y, parts, locations, type_memo)
+      parts.append(',')
+    parts.append(']')
+  elif isinstance(x, dict):
+    parts.append('{')
+    for k, v in x.items():
+      parts.append(repr(k) + ':')
+      structure(v, parts, locations, type_memo)
+      parts.append(',')
+    parts.append('}')
+  elif is_dataclass(x) and not isinstance(x, type):
+    structure_of_dataclass(x, parts, locations, type_memo)
+  else:
+    parts.append(repr(x))
+
+def structure_of_dataclass(x, parts, locations, type_memo):
+  parts.append(type(x).__name__ + '(')
+  for name in field_names(type(x)):
+    if name == 'location':
+      locations.append(getattr(x, name))
+    else:
+      structure(getattr(x, name), parts, locations, type_memo)
+      parts.append(',')
+  parts.append(')')
+
+# The fields that are part of the identity of a node or an info, which
+# leaves out the caches declared with `compare=False` (see
+# `InterfaceImplInfo`).
+@functools.cache
+def field_names(cls):
+  return tuple(f.name for f in fields(cls) if f.compare or f.name == 'location')
+
+# Returns a copy of the translation with its locations replaced
+# according to the mapping. The parts that have no location to replace
+# are shared with the original, and so are the types, whose locations
+# are not part of their identity.
+def relocate(x, mapping, memo):
+  if id(x) in memo:
+    return memo[id(x)]
+  result = x
+  if isinstance(x, Type):
+    pass
+  elif is_dataclass(x) and not isinstance(x, type):
+    changes = {}
+    for name in field_names(type(x)):
+      value = getattr(x, name)
+      if name == 'location' and isinstance(value, Location):
+        new_value = mapping.get(value, value)
+      else:
+        new_value = relocate(value, mapping, memo)
+      if new_value is not value:
+        changes[name] = new_value
+    if len(changes) > 0:
+      result = copy.copy(x)
+      for name, value in changes.items():
+        object.__setattr__(result, name, value)
+  elif isinstance(x, (list, tuple)):
+    items = [relocate(y, mapping, memo) for y in x]
+    if any(new is not old for new, old in zip(items, x)):
+      result = type(x)(items)
+  elif isinstance(x, dict):
+    items = {k: relocate(y, mapping, memo) for k, y in x.items()}
+    if any(items[k] is not y for k, y in x.items()):
+      result = items
+  memo[id(x)] = result
+  return result
@@ -0,0 +1,92 @@
+#
+# This file defines the dup elimination pass, which removes from the IR
+# (see ir.py) the duplications and kills that do not change what the
+# program does.
+#
+# The machine duplicates the value of a variable that is an operand,
+# as in `i < n`, and kills the duplicate once the operation is done.
+# When the operands are numbers or Booleans, as the arithmetic,
+# comparison, and logical operations require, the duplicate is a copy
+# that the operation only reads and that has nothing to kill. So a
+# `dup x` whose result is only read by such operations, or by a
+# `branch`, an `assert`, an index, or the size of an array, becomes a
+# `load x`, and its kills are removed. The pass also removes the kills
+# of the numbers and Booleans that constants and operations produce.
+
+from dataclasses import dataclass, replace
+
+from functions import Function
+from modules import ModuleDef
+from primitive_operations import pure_ops
+import ir
+
+# The operations that only read their operands as numbers or Booleans,
+# and fail on other values. `equal` also compares other values.
+number_ops = pure_ops - {'equal', 'not_equal'}
+
+@dataclass
+class DupReport:
+  dups: int = 0
+  kills: int = 0
+
+  def __str__(self):
+    return str(self.dups) + ' duplications and ' + str(self.kills) \
+      + ' kills removed'
+
+def eliminate_dups(decls):
+  report = DupReport()
+  return [eliminate_in(d, report) for d in decls], report
+
+def eliminate_in(d, report):
+  match d:
+    case Function(body=ir.IRBody() as body):
+      return replace(d, body=eliminate_in_body(body, report))
+    case ModuleDef(body=decls):
+      return replace(d, body=[eliminate_in(d, report) for d in decls])
+    case _:
+      return d
+
+def eliminate_in_body(body, report):
+  defs = {}
+  readers = {}
+  for block in body.blocks:
+    for instr in block.instrs:
+      if instr.target() is not None:
+        defs[instr.target()] = instr
+      for t in instr.uses():
+        readers.setdefault(t, []).append(instr)
+  loads = {t for t, instr in defs.items()
+           if isinstance(instr, ir.Load) and instr.duplicate
+           and all(isinstance(user, ir.Kill) or reads_number(user, t)
+                   for user in readers.get(t, []))}
+  report.dups += len(loads)
+  new_blocks = []
+  for block in body.blocks:
+    instrs = []
+    for instr in block.instrs:
+      match instr:
+        case ir.Load(result=t) if t in loads:
+          instr = replace(instr, duplicate=False)
+        case ir.Kill(arg=t) if t in loads:
+          continue
+        case ir.Kill(arg=t) if defs[t].kind() == 'scalar':
+          report.kills += 1
+          continue
+      instrs.append(instr)
+    new_blocks.append(ir.BasicBlock(instrs))
+  return replace(body, blocks=new_blocks)
+
+# Whether the instruction only reads the temporary `t` as a number or
+# Boolean.
+def reads_number(instr, t):
+  match instr:
+    case ir.Prim(op=op):
+      return op in number_ops
+    case ir.Branch() | ir.Assert():
+      return True
+    case ir.Index(arg=arg):
+      return arg != t
+    case ir.Array(init=init):
+      return init != t
+    case _:
+      return False
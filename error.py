@@ -20,21 +20,21 @@ def set_expect_static_fail(b):
   global expect_static_fail_flag
   expect_static_fail_flag = b
   
+from locations import Location
+
 def error_header(location):
-  # seeing a strange error where some Meta objects don't have a line member.
-  if hasattr(location, 'line'):
-    return '{file}:{line1}.{column1}-{line2}.{column2}: ' \
-        .format(file=location.filename,
-                line1=location.line, column1=location.column,
-                line2=location.end_line, column2=location.end_column)
+  # The location is unknown for nodes made up by the interpreter.
+  if not isinstance(location, Location) or location.source() is None:
+    return ''
+  source = location.source()
+  return '{file}:{line1}.{column1}-{line2}.{column2}: ' \
+    .format(file=source.filename,
+            line1=source.line, column1=source.column,
+            line2=source.end_line, column2=source.end_column)
             
 def warning(location, msg):
   if not expect_fail():
-    header = '{file}:{line1}.{column1}-{line2}.{column2}: ' \
-        .format(file=location.filename,
-                line1=location.line, column1=location.column,
-                line2=location.end_line, column2=location.end_column)
-    print(header + 'warning: ' + msg)
+    print(error_header(location) + 'warning: ' + msg)
 
 def error(location, msg):
   raise Exception(error_header(location) + msg)
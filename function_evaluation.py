@@ -0,0 +1,187 @@
+#
+# This file defines the function evaluation pass, which runs the calls
+# to pure functions whose arguments are constants at compile time and
+# replaces each call by its result, such as a table size computed by a
+# helper function from a `const` value.
+#
+# A top-level function is pure if its parameters are all `let`, so it
+# cannot change its arguments, and its body does not do input or
+# output, spawn a thread, or refer to a variable outside the function
+# other than a pure function. Such a call always produces the same
+# result, so it is run once, on a machine of its own (see machine.py)
+# that has only the pure functions in its environment. The calls in
+# the bodies of modules are not evaluated, because there a name may
+# refer to a member of the module instead of a top-level function.
+#
+# The machine stops after `max_eval_steps` steps, so that a call that
+# takes long or does not terminate is left for runtime, and so is a
+# call that fails, such as on an `assert`, so that the error is
+# reported when the program runs. Once a call to a function runs out
+# of steps, the other calls to it are left for runtime too, and all
+# the calls together take at most `max_program_eval_steps` steps, so
+# that the pass does not move a long computation into the startup of
+# the program. Only results that are numbers or Booleans replace the
+# calls.
+
+from dataclasses import dataclass, field
+from fractions import Fraction
+import random
+
+from ast_base import *
+from utilities import debug, set_debug
+from values import Number, Boolean
+from abstract_syntax import Int, Frac, Bool, is_constant
+from variables_and_binding import Param, Var
+from functions import Function, Call, Return
+from modules import ModuleDef
+from futures import FutureExp, Wait
+from primitive_operations import PrimitiveCall
+from ast_walk import map_scoped_children
+
+# The number of steps that the machine may take to evaluate a call,
+# and to evaluate all the calls in the program.
+max_eval_steps = 100000
+max_program_eval_steps = 300000
+
+# The primitive operations that interact with the outside of the program.
+effect_ops = {'input', 'print', 'input_array', 'print_array', 'exit',
+              'breakpoint'}
+
+@dataclass
+class EvalReport:
+  evaluated: int = 0
+  over_budget: int = 0
+  failed: int = 0
+
+  def __str__(self):
+    return '{evaluated} calls evaluated, {over_budget} over the step ' \
+      'budget, {failed} failed'.format(evaluated=self.evaluated,
+                                       over_budget=self.over_budget,
+                                       failed=self.failed)
+
+@dataclass
+class Evaluator:
+  pure: dict
+  report: EvalReport
+  # The results of the calls, by the function and the arguments.
+  memo: dict = field(default_factory=dict)
+  # The steps left for evaluating the calls in the program.
+  steps_left: int = max_program_eval_steps
+  # The functions with a call that ran out of steps.
+  too_long: set = field(default_factory=set)
+
+def evaluate_pure_calls(decls):
+  report = EvalReport()
+  pure = pure_functions(decls)
+  if len(pure) == 0:
+    return decls, report
+  evaluator = Evaluator(pure, report)
+  # The names in the body of a module refer to the members of the
+  # module before the top-level functions, so its calls are left alone.
+  return [d if isinstance(d, ModuleDef)
+          else evaluate_in(d, set(), evaluator)
+          for d in decls], report
+
+# The pure top-level functions, by name. The `main` function is not
+# among them, because the machine that evaluates a call starts by
+# calling its own `main`.
+def pure_functions(decls):
+  funs = {d.name: d for d in decls
+          if isinstance(d, Function) and d.name != 'main'
+          and len(d.type_params) == 0 and d.return_mode == 'value'
+          and all(p.kind == 'let' for p in d.params)}
+  # A function that calls a function that is not pure is not pure
+  # either, so remove functions until none is removed.
+  pure = set(funs.keys())
+  changed = True
+  while changed:
+    changed = False
+    for name in list(pure):
+      fun = funs[name]
+      if not is_pure(fun.body, {p.ident for p in fun.params}, pure):
+        pure.remove(name)
+        changed = True
+  return {name: fun for name, fun in funs.items() if name in pure}
+
+# Whether the AST has no effects outside of its own variables, where
+# `bound` are the variables in scope inside the function and `pure`
+# the names of the functions that may be called.
+def is_pure(x, bound, pure):
+  match x:
+    case Var(ident):
+      return ident in bound or ident in pure
+    case FutureExp() | Wait():
+      return False
+    case PrimitiveCall(op) if op in effect_ops:
+      return False
+  impure = []
+  def check(y, params):
+    if len(impure) == 0 \
+       and not is_pure(y, bound | {p.ident for p in params
+                                   if isinstance(p, Param)}, pure):
+      impure.append(y)
+    return y
+  map_scoped_children(x, check)
+  return len(impure) == 0
+
+# Returns a copy of the AST with the calls to pure functions on
+# constants replaced by their results. The `bound` are the local
+# variables in scope, which may shadow the functions.
+def evaluate_in(x, bound, evaluator):
+  x = map_scoped_children(x, lambda y, params:
+                          evaluate_in(y, bound | {p.ident for p in params
+                                                  if isinstance(p, Param)},
+                                      evaluator))
+  match x:
+    case Call(Var(name), args) if name in evaluator.pure \
+         and name not in bound and all(is_constant(arg) for arg in args):
+      key = (name,) + tuple((type(arg), arg.value) for arg in args)
+      if key not in evaluator.memo:
+        if name in evaluator.too_long or evaluator.steps_left <= 0:
+          return x
+        evaluator.memo[key] = run_call(x, name, evaluator)
+      result = constant_of(evaluator.memo[key], x.location)
+      if result is not None:
+        evaluator.report.evaluated += 1
+        return result
+  return x
+
+# Runs the call on a new machine and returns the value it produces, or
+# None if it fails or runs out of steps.
+def run_call(call, name, evaluator):
+  # machine.py runs this pass, so import it here.
+  from machine import Machine, StepBudgetExceeded
+  from memory import Memory
+  loc = call.location
+  main = Function(loc, 'main', [], [], None, 'value', [], Return(loc, call))
+  budget = min(max_eval_steps, evaluator.steps_left)
+  machine = Machine(Memory(), [], None, None, None, step_budget=budget)
+  # The machine picks threads at random, so keep the random numbers
+  # of the program's run the same as without this pass.
+  random_state = random.getstate()
+  old_debug = debug()
+  set_debug(False)
+  try:
+    return machine.run(list(evaluator.pure.values()) + [main])
+  except StepBudgetExceeded:
+    evaluator.report.over_budget += 1
+    evaluator.too_long.add(name)
+    return None
+  except Exception:
+    evaluator.report.failed += 1
+    return None
+  finally:
+    evaluator.steps_left -= budget - max(machine.step_budget, 0)
+    set_debug(old_debug)
+    random.setstate(random_state)
+
+def constant_of(val, loc):
+  match val:
+    case Boolean(b):
+      return Bool(loc, b)
+    case Number(n) if isinstance(n, Fraction):
+      return Frac(loc, n)
+    case Number(n) if isinstance(n, int) and not isinstance(n, bool):
+      return Int(loc, n)
+    case _:
+      return None
@@ -8,15 +8,142 @@
 # * lambda expressions.
 #
 
-from dataclasses import dataclass
-from variables_and_binding import Param, clear_borrowed_vars, get_borrowed_vars
+from dataclasses import dataclass, fields, is_dataclass, replace
+from variables_and_binding import Param, Var, clear_borrowed_vars, \
+    get_borrowed_vars
 from ast_base import *
 from ast_types import *
 from values import Result, Pointer
 from utilities import *
-from abstract_syntax import make_cast
+from abstract_syntax import make_cast, Global
 
 
+# ========================================================================
+# The instantiation of a function type for some argument types: the
+# deduced type arguments, the parameter and return types with the type
+# arguments substituted, and the (source, target) types of the cast of
+# each argument to its parameter type, or None if it needs no cast. The
+# calls that share an instantiation make their own coercions from these
+# types, so that the coercions carry the location of each argument.
+@dataclass(frozen=True)
+class Instantiation:
+    deduced_types: dict[str, Type]
+    param_types: list[Type]
+    return_type: Type
+    casts: list[tuple[Type, Type] | None]
+
+# ========================================================================
+# Monomorphization
+#
+# With the `monomorphize` flag, a call to a generic top-level function
+# whose type arguments contain no type variables is translated into a
+# call to an instance of the function for those type arguments, which
+# is type checked separately (see `Function.type_check_instance`) and
+# added to the program. The instance takes no witnesses for the impl
+# requirements, so its uses of the impl members are field accesses on
+# the impls themselves instead of on parameters, or, for the members
+# bound to top-level functions and globals, references to those (see
+# `impl_members`). A call inside an
+# instance is instantiated in turn, so the generic functions called
+# from an instance are specialized too.
+
+# Maps the name of each generic top-level function to the function and
+# its declared type.
+generic_functions: dict[str, tuple[Any, Type]] = {}
+# Maps the name of a generic function and the ids of its (canonical)
+# type arguments to the name of the instance.
+instance_names: dict[tuple, str] = {}
+# The instances that still need to be type checked, as triples of the
+# function, the instance name, and the type arguments.
+pending_instances: list[tuple[Any, str, dict[str, Type]]] = []
+# The limit on the number of instances, beyond which generic functions
+# are called with witnesses as usual. (Polymorphic recursion would
+# otherwise produce instances forever.)
+max_instances = 1000
+# Maps the name of each top-level impl to its members that are bound to
+# top-level functions or globals, and the names they are bound to. The
+# functions and globals are never written, so an instance refers to
+# them instead of reading the members from the record of the impl.
+impl_members: dict[str, dict[str, str]] = {}
+
+def start_monomorphization(decls, env):
+    # imported here because interfaces_and_impls.py is loaded after
+    # this file
+    from interfaces_and_impls import Impl
+    generic_functions.clear()
+    instance_names.clear()
+    pending_instances.clear()
+    impl_members.clear()
+    top_level = {d.name for d in decls if isinstance(d, (Function, Global))}
+    for d in decls:
+        if isinstance(d, Function) and len(d.type_params) > 0:
+            generic_functions[d.name] = (d, env[d.name].type)
+        elif isinstance(d, Impl):
+            impl_members[d.name] = {x: e.ident for x, e in d.assignments
+                                    if isinstance(e, Var)
+                                    and e.ident in top_level}
+
+# Type checks the instances requested so far, and those that they
+# request in turn, and returns their translations.
+def type_check_instances(env):
+    new_decls = []
+    while len(pending_instances) > 0:
+        fun, name, type_args = pending_instances.pop(0)
+        new_decls.append(fun.type_check_instance(env, name, type_args))
+    return new_decls
+
+def instantiate_type(ty, type_args):
+    if ty is None or len(set(type_var_names(intern_type(ty)))
+                         & type_args.keys()) == 0:
+        return ty
+    return substitute(type_args, ty)
+
+# Returns a copy of the AST with the type arguments substituted for the
+# type parameters in the types inside it. The parts without such types
+# are shared with the original.
+def instantiate_types_in(x, type_args, memo):
+    if id(x) in memo:
+        return memo[id(x)]
+    result = x
+    if isinstance(x, Type):
+        result = instantiate_type(x, type_args)
+    elif is_dataclass(x) and not isinstance(x, type):
+        changes = {}
+        for f in fields(x):
+            value = getattr(x, f.name)
+            new_value = instantiate_types_in(value, type_args, memo)
+            if new_value is not value:
+                changes[f.name] = new_value
+        if len(changes) > 0:
+            result = replace(x, **changes)
+    elif isinstance(x, (list, tuple)):
+        items = [instantiate_types_in(y, type_args, memo) for y in x]
+        if any(new is not old for new, old in zip(items, x)):
+            result = type(x)(items)
+    memo[id(x)] = result
+    return result
+
+# Adds the names of the parameters and variables bound in the AST.
+def add_bound_names(x, names):
+    if isinstance(x, Param):
+        names.add(x.ident)
+    elif isinstance(x, Type):
+        pass
+    elif is_dataclass(x) and not isinstance(x, type):
+        for f in fields(x):
+            add_bound_names(getattr(x, f.name), names)
+    elif isinstance(x, (list, tuple)):
+        for y in x:
+            add_bound_names(y, names)
+    return names
+
+# Maps the ids of a canonical function type and canonical argument
+# types to their instantiation (see ast_types.py on canonical types).
+# The deduced types and the coercions do not depend on the call or on
+# the environment, so calling the same generic function with the same
+# argument types many times only deduces them once.
+instantiation_memo: dict[tuple[int, ...], Instantiation] = {}
+
 # ========================================================================
 @dataclass
 class Closure(Value):
@@ -67,7 +194,7 @@ class Closure(Value):
 
 
 # ========================================================================
-@dataclass
+@dataclass(slots=True)
 class Function(Decl):
     name: str
     type_params: list[str]
@@ -161,6 +288,37 @@ class Function(Decl):
             print('finished type checking function\n' + str(new_fun))
         return [new_fun]
 
+    # Type checks the instance of this generic function for the given
+    # type arguments, which is named `name`. The type parameters are
+    # replaced by the type arguments, and the members of the required
+    # impls refer directly to the impls for the type arguments, or to
+    # the functions and globals that they are bound to, so the instance
+    # has no witness parameters. A member refers to the impl if the
+    # function binds a variable with the name of the impl or of the
+    # function or global, which would capture the reference.
+    def type_check_instance(self, env, name, type_args):
+        if tracing_on():
+            print('type checking instance ' + name + ' of ' + self.name)
+        body_env = copy_type_env(env)
+        new_params = [p.with_type(instantiate_type(p.type_annot, type_args))
+                      for p in self.params]
+        for p in new_params:
+            p.bind_type(body_env)
+        bound = add_bound_names([self.params, self.body], set())
+        direct = {impl: {x: Var(self.location, f)
+                         for x, f in members.items() if f not in bound}
+                  for impl, members in impl_members.items()
+                  if impl not in bound}
+        for req in self.requirements:
+            req_env = req.declare_instance(body_env, type_args, self.location,
+                                           direct)
+            body_env = merge_type_env(body_env, req_env)
+        new_return_type = instantiate_type(self.return_type, type_args)
+        new_body = instantiate_types_in(self.body, type_args, {}) \
+            .type_check(body_env, new_return_type)
+        return Function(self.location, name, [], new_params, new_return_type,
+                        self.return_mode, [], new_body)
+
     def step(self, runner, machine):
         if runner.state == 0:
             lam = Lambda(self.location, self.params, [], self.return_mode,
@@ -174,7 +332,7 @@ class Function(Decl):
 
 
 # ========================================================================
-@dataclass
+@dataclass(slots=True)
 class Call(Exp):
     fun: Exp
     args: list[Exp]
@@ -197,6 +355,57 @@ class Call(Exp):
         new_args = [arg.const_eval(env) for arg in self.args]
         return Call(self.location, new_fun, new_args)
 
+    # Returns the instantiation of the function type for the argument
+    # types, using the cache when both are canonical (see
+    # `instantiation_memo`).
+    def instantiate(self, fun_type, arg_types):
+        fun_canon = intern_type(fun_type)
+        arg_canons = [intern_type(t) for t in arg_types]
+        cacheable = is_canonical(fun_canon) \
+            and all(is_canonical(t) for t in arg_canons)
+        if cacheable:
+            key = (id(fun_canon),) + tuple(id(t) for t in arg_canons)
+            if key in instantiation_memo:
+                return instantiation_memo[key]
+        deduced_types = self.type_argument_deduction(fun_type.type_params,
+                                                     fun_type.param_types,
+                                                     arg_types)
+        param_types = [substitute(deduced_types, pt)
+                       for (kind, pt) in fun_type.param_types]
+        inst = Instantiation(deduced_types, param_types,
+                             substitute(deduced_types, fun_type.return_type),
+                             [None if same_type(arg_ty, param_ty)
+                              else (arg_ty, param_ty)
+                              for arg_ty, param_ty
+                              in zip(arg_types, param_types)])
+        if cacheable:
+            instantiation_memo[key] = inst
+        return inst
+
+    # Returns the name of the instance of the called function for the
+    # deduced type arguments, or None if the call is not to a generic
+    # top-level function or the type arguments are not known yet.
+    def instance_name(self, fun_type, deduced_types, env):
+        if not isinstance(self.fun, Var) \
+           or self.fun.ident not in generic_functions:
+            return None
+        fun, declared_type = generic_functions[self.fun.ident]
+        if fun_type is not declared_type:
+            return None # the function is shadowed
+        type_args = {t: intern_type(deduced_types.get(t))
+                     for t in fun.type_params}
+        if any(ty is None or not is_canonical(ty) or len(type_var_names(ty)) > 0
+               for ty in type_args.values()):
+            return None
+        key = (fun.name,) + tuple(id(ty) for ty in type_args.values())
+        if key not in instance_names:
+            if len(instance_names) >= max_instances:
+                return None
+            instance_names[key] = fun.name + '<' \
+                + ', '.join(str(ty) for ty in type_args.values()) + '>'
+            pending_instances.append((fun, instance_names[key], type_args))
+        return instance_names[key]
+
     def type_argument_deduction(self, type_params, param_types, arg_types):
         deduced_types = {}
         for ((kind, param_ty), arg_ty) in zip(param_types, arg_types):
@@ -238,26 +447,30 @@ class Call(Exp):
                              + str(len(arg_types))
                              + '\nexpected: ' + str(len(fun_type.param_types)))
 
-            param_types = fun_type.param_types
-            rt = fun_type.return_type
-
-            deduced_types = self.type_argument_deduction(fun_type.type_params,
-                                                         param_types, arg_types)
+            inst = self.instantiate(fun_type, arg_types)
+            deduced_types = inst.deduced_types
             if tracing_on():
                 print('deduced: ' + str(deduced_types))
 
+            instance = self.instance_name(fun_type, deduced_types, env) \
+                if monomorphize() else None
             for req in fun_type.requirements:
                 wit_exp = req.satisfy_impl(deduced_types, env, self.location)
-                new_args.append(wit_exp)
+                if instance is None:
+                    new_args.append(wit_exp)
+            if instance is not None:
+                new_fun = Var(self.fun.location, instance)
 
-            inst_param_types = [substitute(deduced_types, pt)
-                                for (kind,pt) in param_types]
             cast_args = []
-            for arg, arg_type, param_type in zip(new_args, arg_types,
-                                                 inst_param_types):
-                cast_args.append(make_cast(arg, arg_type, param_type))
+            for arg, cast in zip(new_args, inst.casts):
+                if cast is not None:
+                    cast_args.append(make_cast(arg, *cast))
+                else:
+                    cast_args.append(arg)
+            # The witnesses for the requirements follow the arguments.
+            cast_args += new_args[len(inst.casts):]
 
-            ret = substitute(deduced_types, rt)
+            ret = inst.return_type
             if tracing_on():
                 print('finished type checking: ' + str(self))
                 print('type: ' + str(ret))
@@ -293,85 +506,104 @@ class Call(Exp):
         elif runner.state == 1 + len(self.args):
             self.set_closure(runner, machine)
             # call the function
-            match runner.clos:
-                case Closure(name, params, ret_mode, reqs, body, clos_env):
-                    if len(params) != len(self.args):
-                        error(self.location, 'wrong number of arguments, expected '
-                              + str(len(params)) + ' not ' + str(len(self.args)))
-                    runner.params = params
-                    runner.body_env = clos_env.copy()
-                    runner.args = runner.results[1:]
-                    # TODO: check that the captured free vars have
-                    # enough permission. (See fail_capture2.rte.)
-
-                    # Bind the parameters to their arguments.
-                    for param, arg in zip(params, runner.args):
-                        param.bind(arg, runner.body_env, machine.memory, self.location)
-
-                    machine.push_frame()
-                    if machine.current_thread.pause_on_call:
-                        machine.pause = True
-                        machine.current_thread.pause_on_call = False
-                    if tracing_on():
-                        print('calling function ' + runner.clos.name)
-                    # This treatment of the duplicate context is problematic
-                    # wrt. separate compilation.
-                    # Instead it needs to be declared.
-                    duplicate = runner.context.duplicate
-                    machine.schedule(body, runner.body_env,
-                                     ValueCtx(duplicate=duplicate),
-                                     return_mode=ret_mode)
-                    if debug_mode() == 'n':
-                        if machine.pause:
-                            machine.pause = False
-                            runner.pause_on_finish = True
-                case _:
-                    error(self.location, 'expected function in call, not '
-                          + str(runner.clos))
+            begin_call(runner, runner.clos, runner.results[1:],
+                       runner.context, self.location, machine)
         else:
-            # return from the function:
-            # deallocate the parameters
-            for (param, arg) in zip(runner.params, runner.args):
-                param.dealloc(machine.memory, arg, runner.body_env,
-                              runner.clos.body.location)
-
-            if runner.return_value is None:
-                runner.return_value = Void()
-            if isinstance(runner.context, ValueCtx):
-                if runner.clos.return_mode == 'value':
-                    result = Result(True, runner.return_value)
-                elif runner.clos.return_mode == 'address':
-                    val = machine.memory.read(runner.return_value, self.location)
-                    if runner.context.duplicate:
-                        result = Result(True,
-                                        val.duplicate(runner.return_value.get_permission(),
-                                                      self.location))
-                        runner.return_value.kill(machine.memory, self.location)
-                    else:
-                        result = Result(False, val)  # experimental
-                else:
-                    raise Exception('unrecognized return_mode: '
-                                    + runner.clos.return_mode)
-            elif isinstance(runner.context, AddressCtx):
-                if runner.clos.return_mode == 'value':
-                    result = Result(True, machine.memory.allocate(runner.return_value))
-                elif runner.clos.return_mode == 'address':
-                    if runner.context.duplicate:
-                        result = Result(True, runner.return_value.duplicate(Fraction(1, 1),
-                                                                            self.location))
-                        runner.return_value.kill(machine.memory, self.location)
-                    else:
-                        result = Result(False, runner.return_value)
-                else:
-                    raise Exception('unrecognized return_mode: '
-                                    + runner.clos.return_mode)
-            else:
-                error(self.location, 'unknown context ' + repr(runner.context))
+            # return from the function
+            result = end_call(runner, runner.context, self.location, machine)
             machine.finish_expression(result, self.location)
 
 
+# Binds the parameters of the closure to the argument results and
+# schedules its body in a new frame, for a call in the given context.
+# The runner of the call keeps the closure, the arguments, and the
+# environment of the body for `end_call`, which the runner calls once
+# the body has returned. The `call` instruction of the IR (see ir.py)
+# calls a closure with these too.
+def begin_call(runner, clos, args, context, location, machine):
+    runner.clos = clos
+    match runner.clos:
+        case Closure(name, params, ret_mode, reqs, body, clos_env):
+            if len(params) != len(args):
+                error(location, 'wrong number of arguments, expected '
+                      + str(len(params)) + ' not ' + str(len(args)))
+            runner.params = params
+            runner.body_env = clos_env.copy()
+            runner.args = args
+            # TODO: check that the captured free vars have
+            # enough permission. (See fail_capture2.rte.)
+
+            # Bind the parameters to their arguments.
+            for param, arg in zip(params, runner.args):
+                param.bind(arg, runner.body_env, machine.memory, location)
+
+            machine.push_frame()
+            if machine.current_thread.pause_on_call:
+                machine.pause = True
+                machine.current_thread.pause_on_call = False
+            if tracing_on():
+                print('calling function ' + runner.clos.name)
+            # This treatment of the duplicate context is problematic
+            # wrt. separate compilation.
+            # Instead it needs to be declared.
+            duplicate = context.duplicate
+            machine.schedule(body, runner.body_env,
+                             ValueCtx(duplicate=duplicate),
+                             return_mode=ret_mode)
+            if debug_mode() == 'n':
+                if machine.pause:
+                    machine.pause = False
+                    runner.pause_on_finish = True
+        case _:
+            error(location, 'expected function in call, not '
+                  + str(runner.clos))
+
+
+# Deallocates the parameters of the call and returns its result, made
+# from the value that the body returned (see `Return.step`).
+def end_call(runner, context, location, machine):
+    # deallocate the parameters
+    for (param, arg) in zip(runner.params, runner.args):
+        param.dealloc(machine.memory, arg, runner.body_env,
+                      runner.clos.body.location)
+
+    if runner.return_value is None:
+        runner.return_value = Void()
+    if isinstance(context, ValueCtx):
+        if runner.clos.return_mode == 'value':
+            result = Result(True, runner.return_value)
+        elif runner.clos.return_mode == 'address':
+            val = machine.memory.read(runner.return_value, location)
+            if context.duplicate:
+                result = Result(True,
+                                val.duplicate(runner.return_value.get_permission(),
+                                              location))
+                runner.return_value.kill(machine.memory, location)
+            else:
+                result = Result(False, val)  # experimental
+        else:
+            raise Exception('unrecognized return_mode: '
+                            + runner.clos.return_mode)
+    elif isinstance(context, AddressCtx):
+        if runner.clos.return_mode == 'value':
+            result = Result(True, machine.memory.allocate(runner.return_value))
+        elif runner.clos.return_mode == 'address':
+            if context.duplicate:
+                result = Result(True, runner.return_value.duplicate(Fraction(1, 1),
+                                                                    location))
+                runner.return_value.kill(machine.memory, location)
+            else:
+                result = Result(False, runner.return_value)
+        else:
+            raise Exception('unrecognized return_mode: '
+                            + runner.clos.return_mode)
+    else:
+        error(location, 'unknown context ' + repr(context))
+    return result
+
+
 # ========================================================================
-@dataclass
+@dataclass(slots=True)
 class Return(Stmt):
     arg: Exp
     __match_args__ = ("arg",)
@@ -411,7 +643,7 @@ class Return(Stmt):
 
 
 # ========================================================================
-@dataclass
+@dataclass(slots=True)
 class Lambda(Exp):
     params: list[Param]
     captures: list[Param]
@@ -26,7 +26,7 @@ class Future(Value):
     def __repr__(self):
         return str(self)
     
-@dataclass
+@dataclass(slots=True)
 class FutureExp(Exp):
   arg: Exp
   __match_args__ = ("arg",)
@@ -59,7 +59,7 @@ class FutureExp(Exp):
     machine.finish_expression(Result(True, result), self.location)
 
     
-@dataclass
+@dataclass(slots=True)
 class Wait(Exp):
   arg: Exp
   __match_args__ = ("arg",)
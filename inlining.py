@@ -0,0 +1,252 @@
+#
+# This file defines the inlining pass, which replaces the calls to
+# small functions by the bodies of the functions. A call costs many
+# steps of the machine (see `Call.step`), which for a function such
+# as `fun less(let x: int, let y: int) -> bool { return x < y; }`
+# is far more than the work that the function does.
+#
+# A call is inlined if the function is known, that is, the call is to
+# a top-level function, to a member of a module, or to a member of an
+# impl, and the function
+# * is not generic and returns by value,
+# * has a body of the form `return e;`, after inlining the calls in it,
+#   where `e` has at most `max_inline_size` nodes, and
+# * refers to no variables other than its parameters in `e`, so that
+#   `e` means the same at the call, even in another module.
+# A recursive function is never inlined, because it is still being
+# inlined into when its calls to itself are reached.
+#
+# The call `f(a1, ..., an)` becomes the binding expressions
+#
+#   x1 = a1; ... xn = an; copy(e)
+#
+# where each `xi` is a new name for the i-th parameter, bound with the
+# same kind (`let`, `var`, `inout`, or `ref`), so the arguments are
+# bound and deallocated as in the call. `copy` does the copy that
+# `return` does. A call binds its parameters after evaluating all the
+# arguments, while the binding expressions evaluate each argument
+# after binding the parameters before it, so only the first argument
+# may be an arbitrary expression. The others must be variables or
+# constants, for which the order does not matter, or, if the
+# parameters before them are all `let`, expressions that only read,
+# such as `A[i]`, because a `let` binding leaves a permission to read.
+
+from dataclasses import dataclass, field, replace
+
+from ast_base import *
+from abstract_syntax import Int, Frac, Bool, Block, Global, is_constant
+from variables_and_binding import Param, Var, BindingExp
+from functions import Function, Call, Return, Lambda
+from tuples_and_arrays import Index
+from records import RecordExp, FieldAccess
+from modules import ModuleDef, Import, ModuleMember
+from pointers import Transfer
+from primitive_operations import PrimitiveCall, pure_ops
+from ast_walk import map_scoped_children, for_children
+
+# The largest number of nodes in the body of an inlined function.
+max_inline_size = 16
+
+@dataclass
+class InlineReport:
+  inlined: int = 0
+
+  def __str__(self):
+    return str(self.inlined) + ' calls inlined'
+
+@dataclass
+class Inliner:
+  report: InlineReport
+  # The bodies of the functions after inlining, by the id of the function.
+  bodies: dict = field(default_factory=dict)
+  # The ids of the functions whose bodies are being inlined into.
+  active: set = field(default_factory=set)
+  # The number of inlined calls, for the new names of the parameters.
+  count: int = 0
+
+def inline_calls(decls):
+  report = InlineReport()
+  inliner = Inliner(report)
+  return inline_decls(decls, program_scope(decls, {}), inliner), report
+
+# Maps the names declared by the declarations to the declaration and the
+# scope of the names that it refers to. The body of a module refers to
+# its own members and to the names around it.
+def program_scope(decls, outer):
+  scope = dict(outer)
+  for d in decls:
+    match d:
+      case Function(name) | Global(name) | ModuleDef(name):
+        scope[name] = (d, scope)
+  for d in decls:
+    match d:
+      case ModuleDef(name, exports, body):
+        scope[name] = (d, program_scope(body, scope))
+      case Import(Var(mod), imports):
+        for x in imports:
+          scope[x] = export_of(scope.get(mod), x)
+  return scope
+
+def export_of(binding, x):
+  match binding:
+    case (ModuleDef(_, exports), members) if x in exports:
+      return members.get(x)
+    case _:
+      return None
+
+def inline_decls(decls, scope, inliner):
+  new_decls = []
+  for d in decls:
+    match d:
+      case Function():
+        new_decls.append(replace(d, body=inlined_body(d, scope, inliner)))
+      case ModuleDef(name, exports, body):
+        new_body = inline_decls(body, scope[name][1], inliner)
+        new_decls.append(replace(d, body=new_body))
+      case _:
+        new_decls.append(inline_in(d, scope, set(), inliner))
+  return new_decls
+
+def inlined_body(fun, scope, inliner):
+  if id(fun) not in inliner.bodies:
+    inliner.active.add(id(fun))
+    inliner.bodies[id(fun)] = inline_in(fun.body, scope,
+                                        {p.ident for p in fun.params},
+                                        inliner)
+    inliner.active.discard(id(fun))
+  return inliner.bodies[id(fun)]
+
+# Returns a copy of the AST with the calls inlined. The `local` are the
+# local variables in scope, which may shadow the names in `scope`.
+def inline_in(x, scope, local, inliner):
+  if isinstance(x, Transfer):
+    # The operands of a transfer are not copied (see `Transfer.step`),
+    # unlike the result of a call.
+    return x
+  x = map_scoped_children(x, lambda y, params:
+                          inline_in(y, scope,
+                                    local | {p.ident for p in params
+                                             if isinstance(p, Param)},
+                                    inliner))
+  match x:
+    case Call(fun, args):
+      callee = resolve(fun, scope, local)
+      if callee is not None and len(args) == len(callee[0].params) \
+         and in_order(callee[0].params, args):
+        e = inlinable_exp(callee, inliner)
+        if e is not None:
+          inliner.report.inlined += 1
+          return expand(x, callee[0], e, inliner)
+  return x
+
+# Whether binding the parameters one at a time evaluates the arguments
+# as the call does.
+def in_order(params, args):
+  for i in range(1, len(args)):
+    if not (isinstance(args[i], Var) or is_constant(args[i])
+            or (is_read(args[i])
+                and all(p.kind == 'let' for p in params[:i]))):
+      return False
+  return True
+
+def is_read(e):
+  match e:
+    case Var() | Int() | Frac() | Bool():
+      return True
+    case Index(arg, index):
+      return is_read(arg) and is_read(index)
+    case FieldAccess(arg):
+      return is_read(arg)
+    case PrimitiveCall(op, args) if op in pure_ops:
+      return all(is_read(arg) for arg in args)
+    case _:
+      return False
+
+# The function that the expression refers to and its scope, or None.
+def resolve(e, scope, local):
+  match e:
+    case Var(f) if f not in local:
+      binding = scope.get(f)
+    case ModuleMember(Var(mod), f) if mod not in local:
+      binding = export_of(scope.get(mod), f)
+    case FieldAccess(Var(impl), f) if impl not in local:
+      # The members of an impl are the fields of a global record
+      # (see `Impl.type_check`), which cannot be written.
+      match scope.get(impl):
+        case (Global(rhs=RecordExp(fields)), impl_scope):
+          members = dict(fields)
+          binding = resolve(members[f], impl_scope, set()) \
+            if f in members else None
+        case _:
+          binding = None
+    case _:
+      binding = None
+  match binding:
+    case (Function(), _):
+      return binding
+    case _:
+      return None
+
+# The expression that the function returns, after inlining, if a call
+# to the function can be replaced by it.
+def inlinable_exp(callee, inliner):
+  fun, scope = callee
+  if id(fun) in inliner.active or len(fun.type_params) > 0 \
+     or fun.return_mode != 'value':
+    return None
+  match inlined_body(fun, scope, inliner):
+    case Block(Return(e)) | Return(e):
+      params = {p.ident for p in fun.params}
+      if size(e) <= max_inline_size and not has_lambda(e) \
+         and len(free_vars(e, params)) == 0:
+        return e
+  return None
+
+def expand(call, fun, e, inliner):
+  inliner.count += 1
+  names = {p.ident: p.ident + '⟨' + str(inliner.count) + '⟩'
+           for p in fun.params}
+  result = PrimitiveCall(call.location, 'copy', [rename(e, names)])
+  for param, arg in reversed(list(zip(fun.params, call.args))):
+    result = BindingExp(call.location, replace(param, ident=names[param.ident]),
+                        arg, result)
+  return result
+
+def size(x):
+  count = [1 if isinstance(x, AST) else 0]
+  def add(y):
+    count[0] += size(y)
+  for_children(x, add)
+  return count[0]
+
+def has_lambda(x):
+  found = [isinstance(x, (Lambda, Function))]
+  def check(y):
+    found[0] = found[0] or has_lambda(y)
+  for_children(x, check)
+  return found[0]
+
+# The variables that occur in the AST outside of the bindings in it,
+# where `bound` are those bound around it.
+def free_vars(x, bound):
+  match x:
+    case Var(ident):
+      return set() if ident in bound else {ident}
+  result = set()
+  def add(y, params):
+    result.update(free_vars(y, bound | {p.ident for p in params
+                                        if isinstance(p, Param)}))
+    return y
+  map_scoped_children(x, add)
+  return result
+
+# Returns a copy of the AST with the variables renamed, except where a
+# binding in the AST shadows them.
+def rename(x, names):
+  match x:
+    case Var(ident) if ident in names:
+      return Var(x.location, names[ident])
+  return map_scoped_children(x, lambda y, params:
+                             rename(y, {k: v for k, v in names.items()
+                                        if k not in {p.ident for p in params
+                                                     if isinstance(p, Param)}}))
@@ -60,7 +60,7 @@
 
 # TODO: describe how we implement interface inheritance
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from ast_base import *
 from ast_types import *
 from abstract_syntax import TypeOperator, Global
@@ -74,7 +74,35 @@ class InterfaceImplInfo(StaticInfo):
   iface: Decl
   impls: list[tuple[list[Type], Exp]]
   type: Type
-  
+  # The impls indexed by the head constructors of their types, and the
+  # witnesses already found, by the types (see `find_impl`). They are
+  # computed from `impls`, so they are not compared, and they are not
+  # part of the fingerprint of the info (see decl_cache.py).
+  index: dict | None = field(default=None, compare=False, repr=False)
+  witnesses: dict | None = field(default=None, compare=False, repr=False)
+
+  # Returns the witness of the first impl for the given types, or None.
+  # A search only compares the types of the impls with the same heads.
+  # The info is never changed once it is in a type environment, so the
+  # witnesses found stay valid.
+  def find_impl(self, impl_types):
+    key = tuple(intern_type(ty) for ty in impl_types)
+    if self.witnesses is None:
+      self.witnesses = {}
+    if key in self.witnesses:
+      return self.witnesses[key]
+    if self.index is None:
+      self.index = {}
+      for tys, exp in self.impls:
+        self.index.setdefault(type_heads(tys), []).append((tys, exp))
+    witness_exp = None
+    for tys, exp in self.index.get(type_heads(key), []):
+      if all(same_type(t1, t2) for t1, t2 in zip(key, tys)):
+        witness_exp = exp
+        break
+    self.witnesses[key] = witness_exp
+    return witness_exp
+
   def extend(self, new_impls):
     return InterfaceImplInfo(self.iface, self.impls + new_impls,
                              self.type)
@@ -105,6 +133,10 @@ class InterfaceImplInfo(StaticInfo):
   #                for (tys, exp) in self.impls]
   #   return InterfaceImplInfo(self.iface, new_impls)
 
+def type_heads(types):
+  return tuple(ty.ident if isinstance(ty, TypeVar) else type(ty)
+               for ty in types)
+
 def prefix_access(exp, prefix):
   match exp:
     case FieldAccess(arg, field):
@@ -114,17 +146,17 @@ def prefix_access(exp, prefix):
     case _:
       error(prefix.location, "in prefix_access, unhandled " + str(exp))
 
-def prefix_info(info, name, loc):
+def prefix_info(info, prefix):
   match info:
     case StaticVarInfo(ty, transl, state, param):
-      return StaticVarInfo(ty, prefix_access(transl, Var(loc,name)),
+      return StaticVarInfo(ty, prefix_access(transl, prefix),
                            state, param)
     case InterfaceImplInfo(iface, impls, typ):
-      new_impls = [(tys, prefix_access(exp, Var(loc, name))) \
+      new_impls = [(tys, prefix_access(exp, prefix)) \
                    for (tys, exp) in impls]
       return InterfaceImplInfo(iface, new_impls, typ)
   
-@dataclass
+@dataclass(slots=True)
 class Interface(Decl):
   name: str
   type_params: list[str]
@@ -184,7 +216,7 @@ class Interface(Decl):
                                    self.location)
     machine.finish_definition(self.location)
 
-@dataclass
+@dataclass(slots=True)
 class Impl(Decl):
   name: str
   iface_name: str
@@ -210,7 +242,7 @@ class Impl(Decl):
 
   # Adds this impl to the impl list for its interface.
   def declare_type(self, env):
-    if not self.iface_name in env.keys():
+    if not self.iface_name in env:
       error(self.location, "undefined interface " + self.iface_name)
     info = env[self.iface_name]
     return {self.iface_name: \
@@ -267,7 +299,7 @@ class Impl(Decl):
                               [(x,t) for x,t in member_types.items()]),
                    RecordExp(self.location, new_assignments))] 
 
-@dataclass(eq=True, frozen=True)
+@dataclass(eq=True, frozen=True, slots=True)
 class ImplReq(Type):
   name: str
   iface_name: str
@@ -292,49 +324,60 @@ class ImplReq(Type):
   # Brings the required impl members into scope
   # and returns the new parameters for the witnesses.
   def declare(self, env):
+    witness = Var(self.location, self.name)
+    return Param(self.location, 'let', 'none', self.name, None), \
+      self.declare_witness(env, self.impl_types, witness)
+
+  # Used in the type checking of an instance of a generic function
+  # (see `Function.type_check_instance`). Brings the members of the impl
+  # for the given type arguments into scope, as direct references to
+  # that impl instead of to a witness parameter. The `direct` members,
+  # by the name of the impl, are the translations of the members that
+  # refer to what the impl binds them to.
+  def declare_instance(self, env, type_args, loc, direct):
+    impl_types = tuple(substitute(type_args, ty) for ty in self.impl_types)
+    witness = self.search_impl(impl_types, env, loc)
+    members = direct.get(witness.ident, {}) if isinstance(witness, Var) \
+      else {}
+    return self.declare_witness(env, impl_types, witness, members)
+
+  def declare_witness(self, env, impl_types, witness, members={}):
     output_env = {}
-    if not self.iface_name in env.keys():
+    if not self.iface_name in env:
       error(self.location, "undefined interface " + self.iface_name)
     info = env[self.iface_name]
-    subst = { x:ty for x, ty in zip(info.iface.type_params,
-                                    self.impl_types)}
+    subst = { x:ty for x, ty in zip(info.iface.type_params, impl_types)}
     # Bring the impl into scope
     output_env[self.iface_name] = \
       InterfaceImplInfo(info.iface,
-                        [(self.impl_types, Var(self.location, self.name))],
+                        [(impl_types, witness)],
                         InterfaceType(self.location, info.iface))
     if tracing_on():
-      print('declare impl ' + self.iface_name + str(self.impl_types))
+      print('declare impl ' + self.iface_name + str(impl_types))
 
-    witness = Var(self.location, self.name)
-    
     # Bring the impl members into scope
     for x, ty in info.iface.members:
-      output_env[x] = StaticVarInfo(ty,
-                                    FieldAccess(self.location, witness, x),
+      translation = members.get(x, FieldAccess(self.location, witness, x))
+      output_env[x] = StaticVarInfo(ty, translation,
                                     ProperFraction()).apply_subst(subst)
       
     # Bring the inherited impls into scope
     for req in info.iface.extends:
        (_, req_env) = req.declare(env)
        sub_env = {x: info.apply_subst(subst) for x, info in req_env.items()}
-       # prefix everything in sub_env with this impl name
-       sub_env = {x: prefix_info(info, self.name, self.location) \
+       # prefix everything in sub_env with the witness
+       sub_env = {x: prefix_info(info, witness) \
                   for x, info in sub_env.items()}
        output_env = merge_type_env(output_env, sub_env)
          
-    return Param(self.location, 'let', 'none', self.name, None), output_env
+    return output_env
 
   def search_impl(self, req_impl_types, env, loc):
     if tracing_on():
       print('searching for impl of ' + self.iface_name
             + ' for ' + ', '.join([str(t) for t in req_impl_types]))
     info = env[self.iface_name]
-    witness_exp = None
-    for impl_tys, wit_exp in info.impls:
-      if all([t1 == t2 for t1, t2 in zip(req_impl_types, impl_tys)]):
-        witness_exp = wit_exp
-        break
+    witness_exp = info.find_impl(req_impl_types)
     if witness_exp is None:
       error(loc, 'could not find impl of ' + self.iface_name
             + ' for ' + str(req_impl_types)
@@ -0,0 +1,704 @@
+#
+# This file defines the lowered intermediate representation (IR) of
+# function bodies, which the `lowering` pass produces from the
+# translation of the type checker (see lowering.py), the passes after
+# it optimize (see optimizer.py), and the machine runs (see `IRBody`).
+#
+# The IR is in A-normal form: each instruction performs one operation
+# of the machine, on the variables of the function and on temporaries,
+# written `%n`, that hold the results of the instructions before it
+# (see `Result`). The permission operations that the machine performs
+# as part of evaluating an AST node are explicit:
+# * `dup x` reads the variable `x` and duplicates the value, producing
+#   a new result, while `load x` only reads it, as an operand that is
+#   not duplicated does (see `Var.step`),
+# * `alloc %t` moves the value of `%t` into a new memory block, as
+#   evaluating an expression for its address does,
+# * `kill %t` kills the value of `%t` if the result is new, as the
+#   machine does with the results of the operands of an AST node once
+#   the node is done (see `Machine.finish_expression`),
+# * `transfer %p, %q of %r` transfers a percentage of the permission of
+#   `%r` to `%p`, and `bind` and `unbind` bind a variable to the address
+#   in a temporary and deallocate it at the end of its scope (see
+#   `Param.bind` and `Param.dealloc`).
+# A body is a list of basic blocks, each of which ends with a `jump`, a
+# `branch`, or an `exit`. A `return` stores the value to return, and
+# the code after it unbinds the variables in scope and jumps to the
+# `exit`, which finishes the call.
+#
+# A temporary is defined once, and a temporary that may hold a new
+# result is consumed once on each path through the body, by a `kill` or
+# by an `alloc`. A temporary that holds the value of a variable, or a
+# number or Boolean, which have nothing to kill, need not be consumed.
+# `verify_ir` checks these rules, and the variables in scope.
+
+from dataclasses import dataclass, field
+from fractions import Fraction
+from typing import Any
+
+from ast_base import *
+from error import error
+from utilities import *
+from values import Result, Number, Boolean, Pointer, PointerOffset, Box, \
+  duplicate_if_temporary, to_number, to_integer, to_boolean
+from tuple_value import TupleValue
+from coercions import Coercion
+from variables_and_binding import Param
+from functions import begin_call, end_call
+from primitive_operations import eval_prim, pure_ops
+
+# The kinds of the results of instructions: `old` for a value that the
+# result does not own, such as the value of a variable, `new` for one
+# that it owns, `scalar` for a new number or Boolean, and `dynamic` for
+# a result that is new or not depending on an operand.
+droppable_kinds = {'old', 'scalar'}
+
+def temp_str(t):
+  return '%' + str(t)
+
+def context_str(context):
+  return ('' if isinstance(context, ValueCtx) else ' address') \
+    + ('' if context.duplicate else ' nodup')
+
+# The `origin` of an instruction is the source of the AST node that it
+# is part of, for the error messages (see `NodeRunner.node_str`).
+@dataclass
+class Instr:
+  location: Location
+  origin: str = field(default='', kw_only=True, compare=False, repr=False)
+
+  # The temporary that the instruction defines, or None.
+  def target(self):
+    return getattr(self, 'result', None)
+
+  # The temporaries that the instruction reads, and those that it
+  # consumes.
+  def uses(self):
+    return []
+
+  def consumes(self):
+    return []
+
+  def kind(self):
+    return 'new'
+
+  def successors(self):
+    return []
+
+  def is_terminator(self):
+    return False
+
+  def __str__(self):
+    return temp_str(self.result) + ' = ' + self.operation()
+
+@dataclass
+class Const(Instr):
+  result: int
+  value: Any
+
+  def kind(self):
+    return 'scalar'
+
+  def operation(self):
+    return 'const ' + str(self.value).lower()
+
+  def run(self, runner, machine):
+    if isinstance(self.value, bool):
+      val = Boolean(self.value)
+    else:
+      val = Number(self.value)
+    runner.temps[self.result] = Result(True, val)
+
+@dataclass
+class Alloc(Instr):
+  result: int
+  arg: int
+
+  def uses(self):
+    return [self.arg]
+
+  def consumes(self):
+    return [self.arg]
+
+  def operation(self):
+    return 'alloc ' + temp_str(self.arg)
+
+  def run(self, runner, machine):
+    val = runner.temps[self.arg].value
+    runner.temps[self.arg] = None
+    runner.temps[self.result] = Result(True, machine.memory.allocate(val))
+
+# The address of a variable.
+@dataclass
+class Address(Instr):
+  result: int
+  var: str
+
+  def kind(self):
+    return 'old'
+
+  def operation(self):
+    return 'addr ' + self.var
+
+  def run(self, runner, machine):
+    runner.temps[self.result] = Result(False, variable(runner, self))
+
+# The value of a variable, duplicated or not.
+@dataclass
+class Load(Instr):
+  result: int
+  var: str
+  duplicate: bool
+
+  def kind(self):
+    return 'new' if self.duplicate else 'old'
+
+  def operation(self):
+    return ('dup ' if self.duplicate else 'load ') + self.var
+
+  def run(self, runner, machine):
+    ptr = variable(runner, self)
+    val = machine.memory.read(ptr, self.location)
+    if self.duplicate:
+      val = val.duplicate(ptr.get_permission(), self.location)
+    runner.temps[self.result] = Result(self.duplicate, val)
+
+def variable(runner, instr):
+  if instr.var not in runner.env:
+    error(instr.location, 'use of undefined variable ' + instr.var)
+  return runner.env[instr.var]
+
+@dataclass
+class Prim(Instr):
+  result: int
+  op: str
+  args: list[int]
+
+  def uses(self):
+    return self.args
+
+  def kind(self):
+    return 'scalar' if self.op in pure_ops else 'new'
+
+  def operation(self):
+    return self.op + '(' + ', '.join(temp_str(a) for a in self.args) + ')'
+
+  def run(self, runner, machine):
+    vals = [runner.temps[a].value for a in self.args]
+    val = eval_prim(self.op, vals, machine, self.location)
+    runner.temps[self.result] = Result(True, val)
+
+# A call of the closure in `fun`, in the given context (see `Call.step`).
+# The machine runs the body of the closure in a new frame, and then the
+# runner of the IR finishes the call (see `IRBody.step`).
+@dataclass
+class Call(Instr):
+  result: int
+  fun: int
+  args: list[int]
+  context: Context
+
+  def uses(self):
+    return [self.fun] + self.args
+
+  def kind(self):
+    return 'new' if self.context.duplicate else 'dynamic'
+
+  def operation(self):
+    return 'call ' + temp_str(self.fun) \
+      + '(' + ', '.join(temp_str(a) for a in self.args) + ')' \
+      + context_str(self.context)
+
+  def run(self, runner, machine):
+    clos = runner.temps[self.fun].value
+    args = [runner.temps[a] for a in self.args]
+    runner.call = self
+    begin_call(runner, clos, args, self.context, self.location, machine)
+
+  def finish(self, runner, machine):
+    result = end_call(runner, self.context, self.location, machine)
+    runner.return_value = None
+    runner.temps[self.result] = result
+
+# An element of the tuple or array at the address in `arg` (see
+# `Index.step`).
+@dataclass
+class Index(Instr):
+  result: int
+  arg: int
+  index: int
+  context: Context
+
+  def uses(self):
+    return [self.arg, self.index]
+
+  def kind(self):
+    return 'dynamic'
+
+  def operation(self):
+    return 'index ' + temp_str(self.arg) + '[' + temp_str(self.index) + ']' \
+      + context_str(self.context)
+
+  def run(self, runner, machine):
+    arg = runner.temps[self.arg]
+    i = to_integer(runner.temps[self.index].value, self.location)
+    if isinstance(self.context, ValueCtx):
+      tup_ptr = arg.value
+      tup = machine.memory.read(tup_ptr, self.location)
+      if isinstance(tup, Box):
+        tup = tup.value
+      if not isinstance(tup, TupleValue):
+        error(self.location, 'expected a tuple, not ' + str(tup))
+      val = tup.get_subobject([int(i)], self.location, machine.memory)
+      if arg.temporary:
+        val = val.duplicate(tup_ptr.get_permission(), self.location)
+      result = Result(arg.temporary, val)
+    else:
+      res = duplicate_if_temporary(arg, self.location)
+      result = Result(arg.temporary, PointerOffset(res.value, int(i)))
+    runner.temps[self.result] = result
+
+@dataclass
+class Coerce(Instr):
+  result: int
+  arg: int
+  coercion: Coercion
+
+  def uses(self):
+    return [self.arg]
+
+  def operation(self):
+    return 'coerce ⟨' + str(self.coercion) + '⟩' + temp_str(self.arg)
+
+  def run(self, runner, machine):
+    val = self.coercion.apply(runner.temps[self.arg].value)
+    runner.temps[self.result] = Result(True, val.duplicate(1, self.location))
+
+@dataclass
+class Tuple(Instr):
+  result: int
+  inits: list[int]
+
+  def uses(self):
+    return self.inits
+
+  def operation(self):
+    return 'tuple(' + ', '.join(temp_str(t) for t in self.inits) + ')'
+
+  def run(self, runner, machine):
+    vals = [runner.temps[t].value.duplicate(1, self.location)
+            for t in self.inits]
+    runner.temps[self.result] = Result(True, TupleValue(vals))
+
+# An array of `size` elements that share the value of `init` (see
+# `Array.step`).
+@dataclass
+class Array(Instr):
+  result: int
+  size: int
+  init: int
+
+  def uses(self):
+    return [self.size, self.init]
+
+  def operation(self):
+    return 'array ' + temp_str(self.size) + ' of ' + temp_str(self.init)
+
+  def run(self, runner, machine):
+    size = to_integer(runner.temps[self.size].value, self.location)
+    val = runner.temps[self.init].value
+    vals = [val.duplicate(Fraction(1,2), self.location)
+            for i in range(0, size-1)]
+    vals.append(val)
+    runner.temps[self.result] = Result(True, TupleValue(vals))
+
+@dataclass
+class Deref(Instr):
+  result: int
+  arg: int
+  context: Context
+
+  def uses(self):
+    return [self.arg]
+
+  def kind(self):
+    return 'new' if isinstance(self.context, ValueCtx) else 'dynamic'
+
+  def operation(self):
+    return 'deref ' + temp_str(self.arg) + context_str(self.context)
+
+  def run(self, runner, machine):
+    arg = runner.temps[self.arg]
+    if isinstance(self.context, ValueCtx):
+      ptr = arg.value
+      val = ptr.read(machine.memory, self.location)
+      result = Result(True, val.duplicate(ptr.get_permission(),
+                                          self.location))
+    else:
+      result = duplicate_if_temporary(arg, self.location)
+    runner.temps[self.result] = result
+
+# A duplicate of the value of `arg` if its result is new, or the same
+# value otherwise (see `duplicate_if_temporary`).
+@dataclass
+class Share(Instr):
+  result: int
+  arg: int
+
+  def uses(self):
+    return [self.arg]
+
+  def kind(self):
+    return 'dynamic'
+
+  def operation(self):
+    return 'share ' + temp_str(self.arg)
+
+  def run(self, runner, machine):
+    runner.temps[self.result] = \
+      duplicate_if_temporary(runner.temps[self.arg], self.location)
+
+@dataclass
+class Kill(Instr):
+  arg: int
+
+  def uses(self):
+    return [self.arg]
+
+  def consumes(self):
+    return [self.arg]
+
+  def __str__(self):
+    return 'kill ' + temp_str(self.arg)
+
+  def run(self, runner, machine):
+    res = runner.temps[self.arg]
+    runner.temps[self.arg] = None
+    if res.temporary:
+      res.value.kill(machine.memory, self.location)
+
+@dataclass
+class Bind(Instr):
+  param: Param
+  arg: int
+
+  def uses(self):
+    return [self.arg]
+
+  def __str__(self):
+    return 'bind ' + self.param.kind + ' ' + self.param.ident \
+      + ' = ' + temp_str(self.arg)
+
+  def run(self, runner, machine):
+    self.param.bind(runner.temps[self.arg], runner.env, machine.memory,
+                    self.location)
+
+@dataclass
+class Unbind(Instr):
+  param: Param
+  arg: int
+
+  def uses(self):
+    return [self.arg]
+
+  def __str__(self):
+    return 'unbind ' + self.param.ident + ', ' + temp_str(self.arg)
+
+  def run(self, runner, machine):
+    self.param.dealloc(machine.memory, runner.temps[self.arg], runner.env,
+                       self.location)
+    del runner.env[self.param.ident]
+
+@dataclass
+class Write(Instr):
+  ptr: int
+  arg: int
+
+  def uses(self):
+    return [self.ptr, self.arg]
+
+  def __str__(self):
+    return 'write ' + temp_str(self.ptr) + ', ' + temp_str(self.arg)
+
+  def run(self, runner, machine):
+    machine.memory.write(runner.temps[self.ptr].value,
+                         runner.temps[self.arg].value, self.location)
+
+@dataclass
+class Transfer(Instr):
+  dest: int
+  percent: int
+  source: int
+
+  def uses(self):
+    return [self.dest, self.percent, self.source]
+
+  def __str__(self):
+    return 'transfer ' + temp_str(self.dest) + ', ' + temp_str(self.percent) \
+      + ' of ' + temp_str(self.source)
+
+  def run(self, runner, machine):
+    percent = to_number(runner.temps[self.percent].value, self.location)
+    runner.temps[self.dest].value.transfer(percent,
+                                           runner.temps[self.source].value,
+                                           self.location)
+
+@dataclass
+class Delete(Instr):
+  arg: int
+
+  def uses(self):
+    return [self.arg]
+
+  def __str__(self):
+    return 'delete ' + temp_str(self.arg)
+
+  def run(self, runner, machine):
+    ptr = runner.temps[self.arg].value
+    if not isinstance(ptr, Pointer):
+      error(self.location, 'in delete, expected a pointer, not ' + str(ptr))
+    if not writable(ptr.get_permission()):
+      error(self.location, 'delete needs writable pointer, not ' + str(ptr))
+    machine.memory.deallocate(ptr.get_address(), self.location, set())
+    ptr.address = None
+    ptr.permission = Fraction(0,1)
+
+# The `text` is the asserted expression, for the error message.
+@dataclass
+class Assert(Instr):
+  arg: int
+  text: str
+
+  def uses(self):
+    return [self.arg]
+
+  def __str__(self):
+    return 'assert ' + temp_str(self.arg)
+
+  def run(self, runner, machine):
+    if not to_boolean(runner.temps[self.arg].value, self.location):
+      error(self.location, 'assertion failed: ' + self.text)
+
+@dataclass
+class Return(Instr):
+  arg: int
+
+  def uses(self):
+    return [self.arg]
+
+  def __str__(self):
+    return 'return ' + temp_str(self.arg)
+
+  def run(self, runner, machine):
+    runner.return_result = \
+      runner.temps[self.arg].value.duplicate(1, self.location)
+
+@dataclass
+class Jump(Instr):
+  label: int
+
+  def successors(self):
+    return [self.label]
+
+  def is_terminator(self):
+    return True
+
+  def __str__(self):
+    return 'jump L' + str(self.label)
+
+  def run(self, runner, machine):
+    runner.instrs = runner.ast.blocks[self.label].instrs
+    runner.pc = 0
+
+@dataclass
+class Branch(Instr):
+  cond: int
+  thn: int
+  els: int
+
+  def uses(self):
+    return [self.cond]
+
+  def successors(self):
+    return [self.thn, self.els]
+
+  def is_terminator(self):
+    return True
+
+  def __str__(self):
+    return 'branch ' + temp_str(self.cond) + ', L' + str(self.thn) \
+      + ', L' + str(self.els)
+
+  def run(self, runner, machine):
+    if to_boolean(runner.temps[self.cond].value, self.location):
+      label = self.thn
+    else:
+      label = self.els
+    runner.instrs = runner.ast.blocks[label].instrs
+    runner.pc = 0
+
+@dataclass
+class Exit(Instr):
+  def is_terminator(self):
+    return True
+
+  def __str__(self):
+    return 'exit'
+
+  def run(self, runner, machine):
+    runner.return_value = runner.return_result
+    machine.finish_statement(self.location)
+
+@dataclass
+class BasicBlock:
+  instrs: list[Instr]
+
+# The body of a function in the IR. The `source` is the body that it
+# was lowered from, which the machine runs instead when the call does
+# not duplicate the result of the body (see `Return.step`), because the
+# IR duplicates it. The body prints as its source, except in verbose
+# mode, as the other statements do, and `listing` prints the IR.
+@dataclass(slots=True)
+class IRBody(Stmt):
+  blocks: list[BasicBlock]
+  num_temps: int
+  source: Stmt
+
+  def __str__(self):
+    if verbose():
+      return self.listing()
+    else:
+      return str(self.source)
+
+  def __repr__(self):
+    return str(self)
+
+  def listing(self):
+    lines = []
+    for label, block in enumerate(self.blocks):
+      lines.append('L' + str(label) + ':')
+      for instr in block.instrs:
+        lines.append('  ' + str(instr))
+    return '\n'.join(lines)
+
+  def free_vars(self):
+    return self.source.free_vars()
+
+  # Runs one instruction per step. The runner keeps the temporaries,
+  # the instructions of the current block and the position in them,
+  # the instruction being run, the value to return, and the `call`
+  # instruction that waits for the body of a function to return.
+  def step(self, runner, machine):
+    if runner.state == 0:
+      if not runner.context.duplicate:
+        runner.temps = None
+        machine.schedule(self.source, runner.env, runner.context)
+        return
+      runner.temps = [None] * self.num_temps
+      runner.instrs = self.blocks[0].instrs
+      runner.pc = 0
+      runner.return_result = None
+      runner.call = None
+    elif runner.temps is None:
+      machine.finish_statement(self.location)
+      return
+    elif runner.call is not None:
+      call = runner.call
+      runner.call = None
+      call.finish(runner, machine)
+      return
+    instr = runner.instrs[runner.pc]
+    runner.pc += 1
+    runner.instr = instr
+    instr.run(runner, machine)
+
+# Checks that the body is well formed (see the top of this file), to
+# catch a pass that breaks it, where `after` is the name of the pass.
+# The `params` are the variables in scope at the start of the body.
+def verify_ir(body, params, after):
+  def fail(loc, msg):
+    error(loc, 'after ' + after + ', ' + msg)
+  blocks = body.blocks
+  kinds = {}
+  locals_ = set()
+  for block in blocks:
+    if len(block.instrs) == 0 or not block.instrs[-1].is_terminator():
+      fail(body.location, 'block does not end with a jump, branch, or exit')
+    for instr in block.instrs:
+      if instr.is_terminator() and instr is not block.instrs[-1]:
+        fail(instr.location, 'terminator in the middle of a block: '
+             + str(instr))
+      for label in instr.successors():
+        if not (0 <= label < len(blocks)):
+          fail(instr.location, 'jump to missing block in ' + str(instr))
+      t = instr.target()
+      if t is not None:
+        if t in kinds or not (0 <= t < body.num_temps):
+          fail(instr.location, 'temporary ' + temp_str(t)
+               + ' is defined twice or out of range')
+        kinds[t] = instr.kind()
+      if isinstance(instr, Bind):
+        locals_.add(instr.param.ident)
+
+  # The state at the start of each block: the temporaries that must be
+  # consumed, those that may be used, and the local variables in scope.
+  def merge(label, state, loc):
+    if label not in states:
+      states[label] = state
+      work.append(label)
+      return
+    must, may, bound = states[label]
+    if must != state[0] or bound != state[2]:
+      fail(loc, 'the temporaries or variables at L' + str(label)
+           + ' differ between the paths to it')
+    if not may <= state[1]:
+      states[label] = (must, may & state[1], bound)
+      work.append(label)
+
+  states = {}
+  work = []
+  merge(0, (frozenset(), frozenset(), frozenset()), body.location)
+  while len(work) > 0:
+    label = work.pop()
+    must, may, bound = states[label]
+    must, may, bound = set(must), set(may), set(bound)
+    for instr in blocks[label].instrs:
+      for t in instr.uses():
+        if t not in must and t not in may:
+          fail(instr.location, 'use of undefined or consumed temporary '
+               + temp_str(t) + ' in ' + str(instr))
+      for t in instr.consumes():
+        must.discard(t)
+        may.discard(t)
+      var = getattr(instr, 'var', None)
+      if var in locals_ and var not in bound:
+        fail(instr.location, 'variable ' + var + ' is not in scope in '
+             + str(instr))
+      if isinstance(instr, Bind):
+        if instr.param.ident in bound or instr.param.ident in params:
+          fail(instr.location, 'variable ' + instr.param.ident
+               + ' is bound twice')
+        bound.add(instr.param.ident)
+      elif isinstance(instr, Unbind):
+        if instr.param.ident not in bound:
+          fail(instr.location, 'unbind of variable ' + instr.param.ident
+               + ' that is not in scope')
+        bound.remove(instr.param.ident)
+      t = instr.target()
+      if t is not None:
+        (may if kinds[t] in droppable_kinds else must).add(t)
+      if isinstance(instr, Exit):
+        if len(must) > 0 or len(bound) > 0:
+          fail(instr.location, 'temporaries '
+               + ', '.join(temp_str(t) for t in sorted(must))
+               + ' or variables ' + ', '.join(sorted(bound))
+               + ' are live at the exit')
+      for label in instr.successors():
+        merge(label, (frozenset(must), frozenset(may), frozenset(bound)),
+              instr.location)
+
+# The function with its body in the IR, for `dump_passes`.
+def function_listing(fun):
+  return 'fun ' + fun.name \
+    + '(' + ', '.join(str(p) for p in fun.params) + ')' \
+    + ' -> ' + str(fun.return_type) + '\n' + fun.body.listing()
@@ -1,10 +1,31 @@
-from .utils import logger
-from .tree import Tree
-from .visitors import Transformer, Visitor, v_args, Discard, Transformer_NonRecursive
-from .visitors import InlineTransformer, inline_args   # XXX Deprecated
-from .exceptions import (ParseError, LexError, GrammarError, UnexpectedToken,
-                         UnexpectedInput, UnexpectedCharacters, UnexpectedEOF, LarkError)
-from .lexer import Token
-from .lark import Lark
+# The public names are imported on first use (PEP 562), so that
+# importing a submodule such as `lark.tree` does not load the grammar
+# loader and every parser frontend.
+
+_lazy_names = {
+    'logger': 'utils',
+    'Tree': 'tree',
+    'Transformer': 'visitors', 'Visitor': 'visitors', 'v_args': 'visitors',
+    'Discard': 'visitors', 'Transformer_NonRecursive': 'visitors',
+    'InlineTransformer': 'visitors', 'inline_args': 'visitors',  # XXX Deprecated
+    'ParseError': 'exceptions', 'LexError': 'exceptions',
+    'GrammarError': 'exceptions', 'UnexpectedToken': 'exceptions',
+    'UnexpectedInput': 'exceptions', 'UnexpectedCharacters': 'exceptions',
+    'UnexpectedEOF': 'exceptions', 'LarkError': 'exceptions',
+    'Token': 'lexer',
+    'Lark': 'lark',
+}
+
+def __getattr__(name):
+    if name in _lazy_names:
+        import importlib
+        module = importlib.import_module('.' + _lazy_names[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazy_names))
 
 __version__ = "0.11.4"
@@ -9,7 +9,6 @@ import tempfile
 from warnings import warn
 
 from .utils import STRING_TYPE, Serialize, SerializeMemoizer, FS, isascii, logger, ABC, abstractmethod
-from .load_grammar import load_grammar, FromPackageLoader, Grammar, verify_used_files
 from .tree import Tree
 from .common import LexerConf, ParserConf
 
@@ -187,6 +186,15 @@ class LarkOptions(Serialize):
 
 
 # Options that can be passed to the Lark parser, even when it was loaded from cache/standalone.
+# The grammar loader is only needed when the grammar is not loaded from
+# the cache, so it is imported on demand.
+def _verify_used_files(file_hashes):
+    if not file_hashes:
+        return True
+    from .load_grammar import verify_used_files
+    return verify_used_files(file_hashes)
+
+
 # These option are only used outside of `load_grammar`.
 _LOAD_ALLOWED_OPTIONS = {'postlex', 'transformer', 'lexer_callbacks', 'use_bytes', 'debug', 'g_regex_flags', 'regex', 'propagate_positions', 'tree_class'}
 
@@ -284,7 +292,7 @@ class Lark(Serialize):
                         try:
                             file_md5 = f.readline().rstrip(b'\n')
                             cached_used_files = pickle.load(f)
-                            if file_md5 == cache_md5.encode('utf8') and verify_used_files(cached_used_files):
+                            if file_md5 == cache_md5.encode('utf8') and _verify_used_files(cached_used_files):
                                 cached_parser_data = pickle.load(f)
                                 self._load(cached_parser_data, **options)
                                 return
@@ -297,8 +305,10 @@ class Lark(Serialize):
 
 
             # Parse the grammar file and compose the grammars
+            from .load_grammar import load_grammar
             self.grammar, used_files = load_grammar(grammar, self.source_path, self.options.import_paths, self.options.keep_all_tokens)
         else:
+            from .load_grammar import Grammar
             assert isinstance(grammar, Grammar)
             self.grammar = grammar
 
@@ -512,6 +522,7 @@ class Lark(Serialize):
 
             Lark.open_from_package(__name__, "example.lark", ("grammars",), parser=...)
         """
+        from .load_grammar import FromPackageLoader
         package_loader = FromPackageLoader(package, search_paths)
         full_path, text = package_loader(None, grammar_path)
         options.setdefault('source_path', full_path)
@@ -2,7 +2,6 @@ from .exceptions import ConfigurationError, GrammarError, assert_config
 from .utils import get_regexp_width, Serialize
 from .parsers.grammar_analysis import GrammarAnalyzer
 from .lexer import LexerThread, TraditionalLexer, ContextualLexer, Lexer, Token, TerminalDef
-from .parsers import earley, xearley, cyk
 from .parsers.lalr_parser import LALR_Parser
 from .tree import Tree
 from .common import LexerConf, ParserConf
@@ -190,12 +189,14 @@ class EarleyRegexpMatcher:
 
 def create_earley_parser__dynamic(lexer_conf, parser_conf, options=None, **kw):
         earley_matcher = EarleyRegexpMatcher(lexer_conf)
+        from .parsers import xearley
         return xearley.Parser(parser_conf, earley_matcher.match, ignore=lexer_conf.ignore, **kw)
 
 def _match_earley_basic(term, token):
     return term.name == token.type
 
 def create_earley_parser__basic(lexer_conf, parser_conf, options, **kw):
+    from .parsers import earley
     return earley.Parser(parser_conf, _match_earley_basic, **kw)
 
 def create_earley_parser(lexer_conf, parser_conf, options):
@@ -219,6 +220,7 @@ def create_earley_parser(lexer_conf, parser_conf, options):
 class CYK_FrontEnd:
     def __init__(self, lexer_conf, parser_conf, options=None):
         self._analysis = GrammarAnalyzer(parser_conf)
+        from .parsers import cyk
         self.parser = cyk.Parser(parser_conf.rules)
 
         self.callbacks = parser_conf.callbacks
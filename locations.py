@@ -0,0 +1,56 @@
+#
+# This file defines the source locations of AST and type nodes.
+#
+# Instead of a lark `Meta` object, each node stores a `Location`, a
+# small integer that indexes the location table. Nodes from the same
+# part of the source share one `Location`, and the file name, line, and
+# column are only looked up when reporting an error or warning (see
+# `error_header` in error.py).
+#
+# A `Location` is pickled as its source location and interned again
+# when unpickled, so cached translations (see ast_cache.py) remain
+# valid in a process whose location table is different.
+
+from dataclasses import dataclass
+
+@dataclass(frozen=True, slots=True)
+class SourceLocation:
+  filename: str
+  line: int
+  column: int
+  end_line: int
+  end_column: int
+
+class Location(int):
+  __slots__ = ()
+
+  def source(self):
+    return location_table[self]
+
+  def __repr__(self):
+    return 'Location(' + str(self.source()) + ')'
+
+  def __reduce__(self):
+    return (intern_location, (self.source(),))
+
+# The source of location 0 is unknown.
+location_table: list[SourceLocation] = [None]
+locations: dict[SourceLocation, Location] = {}
+unknown_location = Location(0)
+
+def intern_location(source):
+  if source is None:
+    return unknown_location
+  loc = locations.get(source)
+  if loc is None:
+    loc = Location(len(location_table))
+    location_table.append(source)
+    locations[source] = loc
+  return loc
+
+# The location of a node of the lark parse tree in the given file.
+def location_of(meta, filename):
+  if meta.empty:
+    return unknown_location
+  return intern_location(SourceLocation(filename, meta.line, meta.column,
+                                        meta.end_line, meta.end_column))
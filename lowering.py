@@ -0,0 +1,373 @@
+#
+# This file defines the lowering pass, which translates the bodies of
+# functions to the IR (see ir.py), for the passes after it to optimize
+# and for the machine to run.
+#
+# Each AST node becomes the instructions that perform the steps that
+# the machine takes to evaluate it, in the same order and with the
+# same contexts, so a lowered function does what its body does. For
+# example, `x = x + 1;` becomes
+#
+#   %0 = dup x
+#   %1 = const 1
+#   %2 = add(%0, %1)
+#   kill %0
+#   kill %1
+#   %3 = addr x
+#   write %3, %2
+#   kill %2
+#
+# The statements become basic blocks: an `if` branches on its
+# condition, and a `while` loop jumps back to its condition. A
+# `return` is followed by the steps that the machine takes while the
+# statements around it finish, which deallocate the bindings in scope
+# and, in a `while` loop, evaluate the condition once more (see
+# `While.step`).
+#
+# The bindings of a body all go in the environment of the call, so a
+# binding that would shadow a parameter, a variable that the function
+# captures, or another binding in scope gets a new name. A function
+# whose body has a node that the IR does not express, such as a
+# conditional expression, a lambda, or a future, is left as it is.
+
+from dataclasses import dataclass, field, replace
+from typing import Any
+
+from ast_base import *
+from utilities import ValueCtx, AddressCtx
+from abstract_syntax import Int, Frac, Bool, Seq, Block, Write, Expr, \
+  Assert, IfStmt, While, Pass, ApplyCoercion
+from variables_and_binding import Var, BindingExp, BindingStmt
+from functions import Function, Call, Return
+from tuples_and_arrays import Index, Array, TupleExp
+from pointers import Deref, AddressOf, Transfer, Delete
+from primitive_operations import PrimitiveCall
+from modules import ModuleDef
+import ir
+
+@dataclass
+class LoweringReport:
+  lowered: int = 0
+  skipped: int = 0
+
+  def __str__(self):
+    return str(self.lowered) + ' functions lowered, ' + str(self.skipped) \
+      + ' left as ASTs'
+
+# A node of the body that the IR does not express.
+class NotLowerable(Exception):
+  pass
+
+def lower_functions(decls):
+  report = LoweringReport()
+  return lower_decls(decls, report), report
+
+def lower_decls(decls, report):
+  new_decls = []
+  for d in decls:
+    match d:
+      case Function(body=ir.IRBody()):
+        new_decls.append(d)
+      case Function():
+        try:
+          body = Lowerer(d).lower()
+          report.lowered += 1
+          new_decls.append(replace(d, body=body))
+        except NotLowerable:
+          report.skipped += 1
+          new_decls.append(d)
+      case ModuleDef(body=body):
+        new_decls.append(replace(d, body=lower_decls(body, report)))
+      case _:
+        new_decls.append(d)
+  return new_decls
+
+@dataclass
+class Lowerer:
+  fun: Function
+  blocks: list = field(default_factory=list)
+  # The instructions of the block being lowered into, or None after a
+  # jump, where the code is unreachable.
+  instrs: Any = None
+  num_temps: int = 0
+  # The new names of the bindings in scope, and the names of all the
+  # variables in scope.
+  names: dict = field(default_factory=dict)
+  scope: set = field(default_factory=set)
+  # What the machine does when a `return` leaves each enclosing
+  # binding and loop, innermost last.
+  unwind: list = field(default_factory=list)
+  # The jumps to the exit.
+  exits: list = field(default_factory=list)
+  # The node being lowered, which the instructions are part of (see
+  # `Instr`), and the node of `text`, its last source computed.
+  node: Any = None
+  text_node: Any = None
+  text: str = ''
+
+  def lower(self):
+    body = self.fun.body
+    self.scope = body.free_vars() | {p.ident for p in self.fun.params}
+    self.instrs = self.new_block()
+    self.stmt(body)
+    self.node = body
+    exit_label = len(self.blocks)
+    if self.instrs is not None:
+      self.emit(ir.Jump(body.location, exit_label))
+    for jump in self.exits:
+      jump.label = exit_label
+    self.instrs = self.new_block()
+    self.emit(ir.Exit(body.location))
+    return ir.IRBody(body.location, self.blocks, self.num_temps, body)
+
+  def new_block(self):
+    block = ir.BasicBlock([])
+    self.blocks.append(block)
+    return block.instrs
+
+  def emit(self, instr):
+    if self.text_node is not self.node:
+      self.text_node = self.node
+      self.text = str(self.node)
+    instr.origin = self.text
+    self.instrs.append(instr)
+    return instr.target()
+
+  def temp(self):
+    self.num_temps += 1
+    return self.num_temps - 1
+
+  def kill(self, loc, temps):
+    for t in temps:
+      self.emit(ir.Kill(loc, t))
+
+  # Returns the temporary with the result of the expression in the
+  # given context, such as `ValueCtx(duplicate=True)`.
+  def exp(self, e, ctx):
+    outer = self.node
+    self.node = e
+    t = self.exp_instrs(e, ctx)
+    self.node = outer
+    return t
+
+  def exp_instrs(self, e, ctx):
+    loc = e.location
+    match e:
+      case Int(n) | Frac(n) | Bool(n):
+        return self.produce(loc, ir.Const(loc, self.temp(), n), ctx)
+      case Var(x):
+        x = self.names.get(x, x)
+        if isinstance(ctx, AddressCtx):
+          return self.emit(ir.Address(loc, self.temp(), x))
+        return self.emit(ir.Load(loc, self.temp(), x, ctx.duplicate))
+      case PrimitiveCall(op, args):
+        dup = op not in ('upgrade', 'permission')
+        temps = [self.exp(arg, ValueCtx(dup)) for arg in args]
+        t = self.emit(ir.Prim(loc, self.temp(), op, temps))
+        # `join` produces an address (see `PrimitiveCall.step`).
+        if isinstance(ctx, AddressCtx) and op != 'join':
+          t = self.emit(ir.Alloc(loc, self.temp(), t))
+        self.kill(loc, temps)
+        return t
+      case Call(fun, args):
+        f = self.exp(fun, ValueCtx(ctx.duplicate))
+        temps = [self.exp(arg, AddressCtx(ctx.duplicate)) for arg in args]
+        t = self.emit(ir.Call(loc, self.temp(), f, temps, ctx))
+        self.kill(loc, [f] + temps)
+        return t
+      case ApplyCoercion(arg, coercion):
+        a = self.exp(arg, ValueCtx())
+        return self.produce(loc, ir.Coerce(loc, self.temp(), a, coercion),
+                            ctx, [a])
+      case Index(arg, index):
+        a = self.exp(arg, AddressCtx(ctx.duplicate))
+        i = self.exp(index, ValueCtx())
+        t = self.emit(ir.Index(loc, self.temp(), a, i, ctx))
+        self.kill(loc, [a, i])
+        return t
+      case TupleExp(inits):
+        temps = [self.exp(init, ValueCtx()) for init in inits]
+        return self.produce(loc, ir.Tuple(loc, self.temp(), temps), ctx, temps)
+      case Array(size, arg):
+        s = self.exp(size, ValueCtx())
+        a = self.exp(arg, ValueCtx())
+        return self.produce(loc, ir.Array(loc, self.temp(), s, a), ctx, [s, a])
+      case Deref(arg):
+        a = self.exp(arg, ValueCtx(ctx.duplicate))
+        t = self.emit(ir.Deref(loc, self.temp(), a, ctx))
+        self.kill(loc, [a])
+        return t
+      case AddressOf(arg):
+        a = self.exp(arg, AddressCtx())
+        return self.produce(loc, ir.Share(loc, self.temp(), a), ctx, [a])
+      case BindingExp(param, arg, body):
+        a = self.exp(arg, AddressCtx())
+        outer = self.names
+        param = self.bind(param, a, arg.location)
+        b = self.exp(body, ctx)
+        self.leave(param, outer)
+        self.unbind(param, a, loc, kill=False)
+        t = self.emit(ir.Share(loc, self.temp(), b))
+        self.kill(loc, [a, b])
+        return t
+      case _:
+        raise NotLowerable()
+
+  # Emits the instruction, which produces a value, and an allocation of
+  # the value in an address context (see `NodeRunner.produce_value`),
+  # and then kills the operands.
+  def produce(self, loc, instr, ctx, operands=[]):
+    t = self.emit(instr)
+    if isinstance(ctx, AddressCtx):
+      t = self.emit(ir.Alloc(loc, self.temp(), t))
+    self.kill(loc, operands)
+    return t
+
+  # Binds the parameter to the address in `arg`, under a new name if
+  # its name is in scope, and returns the parameter with that name.
+  def bind(self, param, arg, loc):
+    x = param.ident
+    new = x
+    n = 1
+    while new in self.scope:
+      new = x + '⟨' + str(n) + '⟩'
+      n += 1
+    self.scope.add(new)
+    param = replace(param, ident=new)
+    self.names = {**self.names, x: new}
+    self.emit(ir.Bind(loc, param, arg))
+    return param
+
+  # Ends the scope of the binding, where `names` are the new names
+  # around it.
+  def leave(self, param, names):
+    self.scope.discard(param.ident)
+    self.names = names
+
+  def unbind(self, param, arg, loc, kill=True):
+    self.emit(ir.Unbind(loc, param, arg))
+    if kill:
+      self.kill(loc, [arg])
+
+  def stmt(self, s):
+    outer = self.node
+    self.node = s
+    self.stmt_instrs(s)
+    self.node = outer
+
+  def stmt_instrs(self, s):
+    loc = s.location
+    match s:
+      case Seq(first, rest):
+        # A long body is a long chain of statements.
+        while isinstance(s, Seq) and self.instrs is not None:
+          self.stmt(s.first)
+          s = s.rest
+        if self.instrs is not None:
+          self.stmt(s)
+      case Block(body):
+        self.stmt(body)
+      case BindingStmt(param, arg, body):
+        a = self.exp(arg, AddressCtx())
+        outer = self.names
+        param = self.bind(param, a, arg.location)
+        self.unwind.append(('unbind', param, a, s))
+        self.stmt(body)
+        self.unwind.pop()
+        self.leave(param, outer)
+        if self.instrs is not None:
+          self.unbind(param, a, loc)
+      case Write(lhs, rhs):
+        v = self.exp(rhs, ValueCtx())
+        p = self.exp(lhs, AddressCtx())
+        self.emit(ir.Write(loc, p, v))
+        self.kill(loc, [v, p])
+      case Expr(e):
+        self.kill(loc, [self.exp(e, ValueCtx())])
+      case Assert(e):
+        t = self.exp(e, ValueCtx())
+        self.emit(ir.Assert(loc, t, str(e)))
+        self.kill(loc, [t])
+      case IfStmt(cond, thn, els):
+        c = self.exp(cond, ValueCtx())
+        branch = ir.Branch(loc, c, 0, 0)
+        self.emit(branch)
+        ends = []
+        for body, which in ((thn, 'thn'), (els, 'els')):
+          self.instrs = self.new_block()
+          setattr(branch, which, len(self.blocks) - 1)
+          self.kill(loc, [c])
+          self.stmt(body)
+          if self.instrs is not None:
+            ends.append(self.emit_jump(loc))
+        self.join(ends)
+      case While(cond, body):
+        head = self.emit_jump(loc)
+        self.join([head])
+        head_label = len(self.blocks) - 1
+        c = self.exp(cond, ValueCtx())
+        branch = ir.Branch(loc, c, 0, 0)
+        self.emit(branch)
+        self.instrs = self.new_block()
+        branch.thn = len(self.blocks) - 1
+        self.kill(loc, [c])
+        self.unwind.append(('while', cond, self.names, s))
+        self.stmt(body)
+        self.unwind.pop()
+        if self.instrs is not None:
+          self.emit(ir.Jump(loc, head_label))
+        self.instrs = self.new_block()
+        branch.els = len(self.blocks) - 1
+        self.kill(loc, [c])
+      case Pass():
+        pass
+      case Return(arg):
+        if self.fun.return_mode == 'value':
+          ctx = ValueCtx(True)
+        else:
+          ctx = AddressCtx(True)
+        v = self.exp(arg, ctx)
+        self.emit(ir.Return(loc, v))
+        self.kill(loc, [v])
+        names = self.names
+        for action in reversed(self.unwind):
+          match action:
+            case ('unbind', param, a, binding):
+              self.node = binding
+              self.unbind(param, a, binding.location)
+            case ('while', cond, cond_names, loop):
+              self.node = loop
+              self.names = cond_names
+              self.kill(loop.location, [self.exp(cond, ValueCtx())])
+        self.node = s
+        self.names = names
+        self.exits.append(self.emit_jump(loc))
+        self.instrs = None
+      case Transfer(lhs, percent, rhs):
+        l = self.exp(lhs, ValueCtx(False))
+        p = self.exp(percent, ValueCtx())
+        r = self.exp(rhs, ValueCtx(False))
+        self.emit(ir.Transfer(loc, l, p, r))
+        self.kill(loc, [l, p, r])
+      case Delete(arg):
+        t = self.exp(arg, ValueCtx())
+        self.emit(ir.Delete(loc, t))
+        self.kill(loc, [t])
+      case _:
+        raise NotLowerable()
+
+  # Ends the block with a jump whose label is set by `join`.
+  def emit_jump(self, loc):
+    jump = ir.Jump(loc, None)
+    self.emit(jump)
+    self.instrs = None
+    return jump
+
+  # Starts a new block that the jumps go to, if there are any.
+  def join(self, jumps):
+    if len(jumps) == 0:
+      self.instrs = None
+      return
+    self.instrs = self.new_block()
+    for jump in jumps:
+      jump.label = len(self.blocks) - 1
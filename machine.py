@@ -19,7 +19,7 @@
 #   finish_statement()
 #   finish_and_return(value)
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Any
 import random
 import sys
@@ -32,10 +32,14 @@ from variants import *
 from modules import *
 from pointers import *
 from utilities import *
-from parser import parse, set_filename
+from parser import parse_files
 from type_check import type_check_program
 from const_eval import const_eval_decls
+from ast_cache import translation_key, load_translation, save_translation
+from decl_cache import load_decl_cache
+from optimizer import optimize_program
 from memory import *
+from output import OutputBuffer
 from graphviz import log_graphviz
 
 @dataclass
@@ -49,6 +53,13 @@ class NodeRunner:
     env: dict[str,Pointer]
     pause_on_finish : bool = False # for debugger control
 
+    # The AST node that the runner evaluates, for the error messages.
+    # The runner of a body in the IR is at the node of the instruction
+    # that it runs (see `IRBody.step`).
+    def node_str(self):
+      instr = getattr(self, 'instr', None)
+      return str(self.ast) if instr is None else instr.origin
+
     def produce_value(self, val, machine, location):
       if isinstance(self.context, ValueCtx):
           result = val
@@ -69,6 +80,9 @@ class Thread:
     num_children: int
     pause_on_call: bool = False # for debugger control
 
+class StepBudgetExceeded(Exception):
+  pass
+
 debug_commands = set(['e',  # print environment
                       'm',  # print memory
                       'n',  # next subexpression (don't dive into functions)
@@ -88,10 +102,21 @@ class Machine:
   main_thread: Thread
   return_value: Value
   pause : bool = False # for debugger control
+  output: OutputBuffer = field(default_factory=OutputBuffer)
+  # The number of steps left before the run is stopped with
+  # `StepBudgetExceeded`, or None for no limit.
+  step_budget: Any = None
 
   # Run the machine on the given program.
   # Execution begins by calling the 'main' function.
+  # The program's output is flushed however the run ends.
   def run(self, decls):
+      try:
+          return self.run_program(decls)
+      finally:
+          self.output.close()
+
+  def run_program(self, decls):
       self.main_thread = Thread([], None, None, 0)
       self.current_thread = self.main_thread
       self.threads = [self.main_thread]
@@ -133,6 +158,7 @@ class Machine:
 
       # Check for memory leaks.
       if self.memory.size() > 0:
+          self.output.flush()
           print('result:')
           print(self.return_value)
           if tracing_on():
@@ -161,6 +187,10 @@ class Machine:
           # case current_thread has work to do
           frame = self.current_frame()
           if len(frame.todo) > 0:
+            if self.step_budget is not None:
+              self.step_budget -= 1
+              if self.step_budget < 0:
+                raise StepBudgetExceeded('exceeded the step budget')
             runner = self.current_runner()
             if tracing_on():
               print(error_header(runner.ast.location))
@@ -211,13 +241,13 @@ class Machine:
                 continue
               else:
                 new_ex = Exception(str(ex) + '\nin evaluation of\n'
-                                   + str(self.current_runner().ast))
+                                   + self.current_runner().node_str())
                 raise new_ex
             if tracing_on() and len(frame.todo) > 0:
               print('before log_graphviz, env:')
               print(self.current_runner().env)
               log_graphviz('top', self.current_runner().env, self.memory.memory)
-              print(machine.memory)
+              print(self.memory)
               print()
             #machine.memory.compute_fractions()
             runner.state += 1
@@ -253,7 +283,7 @@ class Machine:
               # Catch a common mistake in the interpreter!
               if res.value is result.value:
                   error(location, "*** result is a temporary that's being deleted!")
-              res.value.kill(machine.memory, location)
+              res.value.kill(self.memory, location)
       self.current_frame().todo.pop()
       if len(self.current_frame().todo) > 0:
           self.current_runner().results.append(result)
@@ -275,7 +305,7 @@ class Machine:
           print('killing temporaries')
       for res in self.current_runner().results:
           if res.temporary:
-              res.value.kill(machine.memory, location)
+              res.value.kill(self.memory, location)
       self.current_frame().todo.pop()
       if len(self.current_frame().todo) > 0:
         self.current_runner().return_value = val
@@ -289,7 +319,7 @@ class Machine:
         self.pause = True
     for res in self.current_runner().results:
         if res.temporary:
-            res.value.kill(machine.memory, location)
+            res.value.kill(self.memory, location)
     self.current_frame().todo.pop()
         
   def push_frame(self):
@@ -330,6 +360,14 @@ class Machine:
 flags = set(['trace', # Enable the tracing output. (i.e. "printf" debugging)
              'debug', # Run the debugger.
              'fail',  # The program is expected to fail at runtime.
+             'compact', # Separate printed numbers by spaces, not newlines.
+             'no_cache', # Don't use or update the cache of translations.
+             'parallel', # Type check in parallel, reporting all type errors.
+             'monomorphize', # Specialize generic functions to their uses.
+             'no_opt', # Don't run the optimization passes.
+             'verify', # Check the program after each optimization pass.
+             'dump_passes', # Print the program after each optimization pass.
+             'opt_report', # Print what each optimization pass changed.
              'static_fail']) # The program is expected to fail during type checking.
 
 # Run the machine on the specified files, and process the command-line flags.
@@ -342,41 +380,96 @@ if __name__ == "__main__":
     if 'trace' in sys.argv:
       set_trace(True)
       set_verbose(True)
+    if 'monomorphize' in sys.argv:
+      set_monomorphize(True)
     if 'debug' in sys.argv:
       set_debug(True)
     else:
       set_debug(False)
 
-    # Parse the program files.
-    decls = []
+    # The optimization passes to run, by default all of them
+    # (see optimizer.py).
+    pass_names = None
+    for arg in sys.argv[1:]:
+      if arg.startswith('passes='):
+        pass_names = [name for name in arg[len('passes='):].split(',')
+                      if name != '']
+    if 'no_opt' in sys.argv:
+      pass_names = []
+
+    # Read the program files.
+    sources = []
     for filename in sys.argv[1:]:
-      if not (filename in flags):
-        set_filename(filename)
+      if not (filename in flags or filename.startswith('passes=')):
         file = open(filename, 'r')
-        p = file.read()
-        decls += parse(p, False)
-
-    # Evaluate constant expressions.
-    decls = const_eval_decls(decls, {})
-    if tracing_on():
-      print('**** after const_eval ****')
-      for decl in decls:
-          print(decl)
-          print()
-      print()
+        sources.append((filename, file.read()))
+
+    # Reuse the translation from a previous run of the same program.
+    use_cache = not ('no_cache' in sys.argv or 'verify' in sys.argv
+                     or 'dump_passes' in sys.argv or 'opt_report' in sys.argv
+                     or tracing_on())
+    if use_cache:
+      cache_key = translation_key(sources,
+                                  [flag for flag in ['monomorphize']
+                                   if flag in sys.argv]
+                                  + ([] if pass_names is None
+                                     else ['passes=' + ','.join(pass_names)]))
+      cached_decls = load_translation(sources, cache_key)
+    else:
+      cached_decls = None
+
+    if cached_decls is None:
+      # Parse the program files.
+      decls = parse_files(sources)
 
     # Type check the program.
     try:
-      decls = type_check_program(decls)
-      if tracing_on():
-        print('**** finished type checking ****')
-        for decl in decls:
-          print(decl)
+      if cached_decls is None:
+        # Compile the modules that the program imports, which type
+        # checks the module files, so their errors are reported here.
+        from module_loader import load_imported_modules
+        decls = load_imported_modules(decls, use_cache)
+
+        # Evaluate constant expressions.
+        decls = const_eval_decls(decls, {})
+        if tracing_on():
+          print('**** after const_eval ****')
+          for decl in decls:
+              print(decl)
+              print()
           print()
-        print()
+
+        # Recheck only the declarations whose inputs changed.
+        decl_cache = load_decl_cache(sources) if use_cache else None
+        complete = False
+        try:
+          decls = type_check_program(decls, 'parallel' in sys.argv, decl_cache)
+          complete = True
+        finally:
+          if decl_cache is not None:
+            decl_cache.save(sources, complete)
+        # Optimize the program.
+        decls, reports = optimize_program(decls, pass_names,
+                                          'verify' in sys.argv,
+                                          'dump_passes' in sys.argv)
+        if 'opt_report' in sys.argv:
+          for name, report in reports:
+            print(name + ': ' + str(report))
+        if use_cache:
+          from module_loader import loaded_module_files
+          save_translation(sources, cache_key, decls, loaded_module_files())
+        if tracing_on():
+          print('**** finished type checking ****')
+          for decl in decls:
+            print(decl)
+            print()
+          print()
+      else:
+        decls = cached_decls
 
       # Run the program
-      machine = Machine(Memory(), [], None, None, None)
+      machine = Machine(Memory(), [], None, None, None,
+                        output=OutputBuffer(compact='compact' in sys.argv))
       retval = machine.run(decls)
       
       if expect_fail():
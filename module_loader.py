@@ -0,0 +1,211 @@
+#
+# This file defines the loading of modules from files, for imports
+# that name a file instead of a module, such as
+#
+#   from "lib/algebraic_structures.rte" import Monoid, Monoid(int);
+#
+# A module file contains a single module definition. The path is
+# looked up relative to
+# 1. the directory of the file containing the import,
+# 2. each directory listed in the ARETE_PATH environment variable, and
+# 3. the directory of the interpreter, which contains `lib`.
+#
+# Modules are loaded lazily: only the files reachable through imports
+# are read, and each file is loaded at most once per run of the
+# interpreter. The import is changed to refer to the module by name.
+#
+# Each module file is compiled separately: it is type checked on its
+# own, seeing only the modules it imports, and the result is a
+# `CompiledModule` that is placed at the start of the program, after
+# the modules it imports. The type checker writes two files to the
+# `__pycache__` directory next to the module file:
+# * the interface (`.arete-iface`), that is, the module's type with
+#   its exported variables, interfaces, impls, and type operators, and
+# * the object (`.arete-obj`), that is, the module's translation.
+# A module whose source is unchanged and whose imported interfaces are
+# unchanged is not parsed or type checked again. So editing a module
+# only rechecks that module and the modules that depend on it, and the
+# dependents only when the module's interface changed.
+
+from dataclasses import dataclass
+from typing import Any
+from ast_base import *
+from modules import ModuleDef, Import, ModuleFile, CompiledModule
+from variables_and_binding import Var
+from parser import parse, grammar_hash
+from ast_cache import interpreter_version, module_cache_filename, \
+  read_cache, write_cache, text_hash
+from error import static_error
+from type_env import TypeEnv
+from utilities import tracing_on, with_recursion_limit
+from decl_cache import fingerprint
+import hashlib
+import os
+
+interpreter_dir = os.path.dirname(os.path.abspath(__file__))
+
+@dataclass
+class LoadedModule:
+  name: str
+  text: str
+  dependencies: list[str]  # absolute paths of the imported files
+  compiled: CompiledModule
+  digest: str              # hash of the interface
+
+# The contents of an interface file.
+@dataclass
+class ModuleInterface:
+  key: str
+  source_hash: str
+  name: str
+  dependencies: list[str]
+  module_type: Any
+  digest: str
+
+# Maps the absolute path of each module file to its LoadedModule.
+loaded_modules: dict[str, LoadedModule] = {}
+
+def module_search_path(location):
+  source = location.source()
+  importer = None if source is None else source.filename
+  if importer is not None and importer != '???':
+    path = [os.path.dirname(os.path.abspath(importer))]
+  else:
+    path = [os.getcwd()]
+  path += [d for d in os.environ.get('ARETE_PATH', '').split(os.pathsep)
+           if d != '']
+  path.append(interpreter_dir)
+  return path
+
+def find_module_file(path, location):
+  if os.path.isabs(path):
+    candidates = [path]
+  else:
+    candidates = [os.path.join(d, path) for d in module_search_path(location)]
+  for candidate in candidates:
+    if os.path.isfile(candidate):
+      return os.path.abspath(candidate)
+  static_error(location, 'could not find module file "' + path + '"')
+
+# Returns the declarations of the program, with the modules imported
+# from files added to the front.
+def load_imported_modules(decls, use_cache=True):
+  modules = []
+  new_decls = [resolve_imports(d, modules, [], use_cache) for d in decls]
+  return [loaded_modules[filename].compiled for filename in modules] \
+    + new_decls
+
+# The `modules` parameter accumulates the absolute paths of the module
+# files needed by the program, in dependency order, and `loading` is
+# the chain of files currently being loaded, for detecting cycles.
+def resolve_imports(decl, modules, loading, use_cache):
+  match decl:
+    case Import(ModuleFile(path), imports):
+      loc = decl.location
+      filename = find_module_file(path, loc)
+      loaded = load_module(filename, loc, loading, use_cache)
+      add_module(filename, modules)
+      return Import(loc, Var(loc, loaded.name), imports)
+    case ModuleDef(name, exports, body):
+      return ModuleDef(decl.location, name, exports,
+                       [resolve_imports(d, modules, loading, use_cache)
+                        for d in body])
+    case _:
+      return decl
+
+def load_module(filename, location, loading, use_cache):
+  if filename in loading:
+    static_error(location, 'cyclic import of module file ' + filename)
+  if filename not in loaded_modules:
+    with open(filename, 'r') as file:
+      text = file.read()
+    loaded = None
+    if use_cache:
+      loaded = load_compiled_module(filename, text, location,
+                                    loading + [filename])
+    if loaded is None:
+      loaded = compile_module(filename, text, location, loading + [filename],
+                              use_cache)
+    loaded_modules[filename] = loaded
+  return loaded_modules[filename]
+
+# The key of a compiled module is a hash of its source, the interfaces
+# of the modules it imports, and the version of the interpreter.
+def module_key(text, dependencies):
+  h = hashlib.sha256()
+  h.update(grammar_hash.encode('utf8'))
+  h.update(interpreter_version().encode('utf8'))
+  h.update(text.encode('utf8') + b'\0')
+  for dep in dependencies:
+    h.update(loaded_modules[dep].digest.encode('utf8'))
+  return h.hexdigest()
+
+# Returns the module from its interface and object files, or None
+# if they are missing or out of date.
+def load_compiled_module(filename, text, location, loading):
+  iface = read_cache(module_cache_filename(filename, '.arete-iface'))
+  if not isinstance(iface, ModuleInterface) \
+     or iface.source_hash != text_hash(text) \
+     or not all(os.path.isfile(dep) for dep in iface.dependencies):
+    return None
+  for dep in iface.dependencies:
+    load_module(dep, location, loading, True)
+  key = module_key(text, iface.dependencies)
+  if key != iface.key:
+    return None
+  obj = read_cache(module_cache_filename(filename, '.arete-obj'))
+  if obj is None or obj[0] != key:
+    return None
+  if tracing_on():
+    print('using compiled module ' + filename)
+  compiled = CompiledModule(obj[1].location, iface.name, iface.module_type,
+                            obj[1])
+  return LoadedModule(iface.name, text, iface.dependencies, compiled,
+                      iface.digest)
+
+# Parse and type check the module on its own, in an environment that
+# contains only the modules it imports.
+def compile_module(filename, text, location, loading, use_cache):
+  decls = parse(text, False, filename)
+  if len(decls) != 1 or not isinstance(decls[0], ModuleDef):
+    static_error(location, 'module file ' + filename
+                 + ' should contain a single module definition')
+  dependencies = []
+  mod = resolve_imports(decls[0], dependencies, loading, use_cache)
+  [mod] = mod.const_eval({})
+  env = TypeEnv()
+  for dep in dependencies:
+    env |= loaded_modules[dep].compiled.declare_type(env)
+  info = mod.declare_type(env)
+  env |= info
+  [translation] = mod.type_check(env)
+  module_type = info[mod.name].type
+  key = module_key(text, dependencies)
+  # The digest leaves out the locations in the interface, so that
+  # moving code around in the module does not recheck its dependents
+  # (see `fingerprint` in decl_cache.py).
+  try:
+    digest = with_recursion_limit(fingerprint, module_type)
+  except RecursionError:
+    # Without a digest of the interface, the dependents are
+    # rechecked whenever this module changes.
+    digest = key
+  if use_cache:
+    write_cache(module_cache_filename(filename, '.arete-iface'),
+                ModuleInterface(key, text_hash(text), mod.name, dependencies,
+                                module_type, digest))
+    write_cache(module_cache_filename(filename, '.arete-obj'),
+                (key, translation))
+  compiled = CompiledModule(mod.location, mod.name, module_type, translation)
+  return LoadedModule(mod.name, text, dependencies, compiled, digest)
+
+def add_module(filename, modules):
+  if filename not in modules:
+    for dep in loaded_modules[filename].dependencies:
+      add_module(dep, modules)
+    modules.append(filename)
+
+# The module files that were loaded, as (filename, contents) pairs.
+def loaded_module_files():
+  return [(filename, loaded.text)
+          for filename, loaded in loaded_modules.items()]
@@ -3,7 +3,8 @@
 # which includes
 # * module values,
 # * module definitions,
-# * imports, and
+# * imports, from a module definition or a module file,
+# * compiled modules, and
 # * member access.
 
 from dataclasses import dataclass
@@ -53,7 +54,7 @@ class Module(Value):
         return str(self.name)
 
     
-@dataclass
+@dataclass(slots=True)
 class ModuleDef(Decl):
   name: str
   exports: list[str]
@@ -100,9 +101,11 @@ class ModuleDef(Decl):
       new_members = d.declare_type(body_env)
       members |= new_members
       body_env |= new_members
+    # imported here because decl_cache.py imports this file
+    from decl_cache import check_declaration
     new_body = []
     for d in self.body:
-      new_body += d.type_check(body_env)
+      new_body += check_declaration(d, body_env)
     new_exports = []
     for ex in self.exports:
       if isinstance(ex,str) and isinstance(members[ex], StaticVarInfo):
@@ -114,26 +117,30 @@ class ModuleDef(Decl):
     
   def step(self, runner, machine):
     if runner.state == 0:
-      runner.body_env = {}
+      runner.members = {}
       for d in self.body:
-        d.declare(runner.body_env, machine.memory)
+        d.declare(runner.members, machine.memory)
+      # The body can refer to the definitions around the module,
+      # such as modules it imports from.
+      runner.body_env = runner.env | runner.members
     if runner.state < len(self.body):
       machine.schedule(self.body[runner.state], runner.body_env)
     else:
       for ex in self.exports:
-        if not ex in runner.body_env:
+        if not ex in runner.members:
           error(self.location, 'export ' + ex + ' not defined in module')
       mod = Module(self.name,
-                   {ex: runner.body_env[ex] for ex in self.exports},
-                   runner.body_env)
+                   {ex: runner.members[ex] for ex in self.exports},
+                   runner.members)
       machine.memory.memory[runner.env[self.name].address] = mod
       machine.finish_definition(self.location)
 
     
-@dataclass
+@dataclass(slots=True)
 class Import(Decl):
   module: Exp
   imports: list[Any]
+  module_type: ModuleType = None # set by declare_type
   __match_args__ = ("module", "imports")
   
   def __str__(self):
@@ -156,8 +163,8 @@ class Import(Decl):
       for x in self.imports:
         if isinstance(x, str):
           if not x in mod.member_info.keys():
-            static_error(decl.location, "in import, no " + x
-                         + " in " + str(module))
+            static_error(self.location, "in import, no " + x
+                         + " in " + str(self.module))
           results[x] = mod.member_info[x]
         elif isinstance(x, ImplReq):
           witness = x.search_impl(x.impl_types, mod.member_info, self.location)
@@ -210,7 +217,7 @@ class Import(Decl):
         if isinstance(x, str):
           if x in mod.exports.keys():
             val = machine.memory.read(mod.exports[x], self.location)
-            dup = val.duplicate(mod.exports[x].get_permission, self.location)
+            dup = val.duplicate(mod.exports[x].get_permission(), self.location)
             machine.memory.write(runner.env[x], dup, self.location)
           else:
             error(self.location, 'module does not export ' + x)
@@ -224,7 +231,58 @@ class Import(Decl):
           print('** finish import is complete')
 
 
-@dataclass
+# A module from a module file that has already been type checked on
+# its own (see module_loader.py). Type checking only needs the module's
+# type, that is, its interface, and produces the module's translation.
+@dataclass(slots=True)
+class CompiledModule(Decl):
+  name: str
+  module_type: ModuleType
+  translation: ModuleDef
+  __match_args__ = ("name", "module_type", "translation")
+
+  def __str__(self):
+    return 'compiled module ' + self.name
+
+  def __repr__(self):
+    return str(self)
+
+  def const_eval(self, env):
+    return [self]
+
+  def declare_type(self, env):
+    return {self.name: StaticVarInfo(self.module_type, None, ProperFraction())}
+
+  def type_check(self, env):
+    return [self.translation]
+
+
+# The module named by a file path in an import, as in
+#   from "lib/algebraic_structures.rte" import Monoid;
+# These are replaced by the name of the module defined in the file
+# before constant evaluation (see module_loader.py).
+@dataclass(slots=True)
+class ModuleFile(Exp):
+  path: str
+  __match_args__ = ("path",)
+
+  def __str__(self):
+    return '"' + self.path + '"'
+
+  def __repr__(self):
+    return str(self)
+
+  def free_vars(self):
+    return set()
+
+  def const_eval(self, env):
+    static_error(self.location, 'module file ' + str(self) + ' was not loaded')
+
+  def type_check(self, env, ctx):
+    static_error(self.location, 'module file ' + str(self) + ' was not loaded')
+
+
+@dataclass(slots=True)
 class ModuleMember(Exp):
   arg: Exp
   field: str
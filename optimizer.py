@@ -0,0 +1,178 @@
+#
+# This file defines the pass manager, which runs the optimization passes
+# over the program between type checking and execution.
+#
+# The passes work on the translation that the type checker produces,
+# which is what the machine runs, so an optimized program runs on the
+# same machine as an unoptimized one. In the translation, the casts are
+# explicit (see `ApplyCoercion`), and so are the parameters with their
+# kinds (`let`, `var`, `inout`, and so on), which determine the
+# permission operations that the machine performs when it binds them.
+#
+# The `lowering` pass translates the bodies of the functions to the IR
+# (see ir.py and lowering.py), with explicit permission operations and
+# allocations, and the passes after it, such as `dup_elimination`,
+# optimize the IR. The machine runs the lowered bodies (see `IRBody`),
+# so the passes before `lowering` work on the AST and the passes after
+# it on the IR.
+#
+# A pass is a function that takes the declarations of the program and
+# returns the new declarations and a report of what it changed. The
+# passes in `optimization_passes` run in order. The `passes=<name>,...`
+# option of machine.py runs only the named passes, and `no_opt` runs
+# none of them. The `verify` flag checks the program before the first
+# pass and after each one (see `verify_program`), `dump_passes` prints
+# the program after each pass, and `opt_report` prints the reports.
+
+from dataclasses import dataclass, fields, is_dataclass
+from functools import cache
+from typing import Any, Callable, get_type_hints, get_origin, get_args
+
+from ast_base import *
+from error import error
+from utilities import with_recursion_limit
+from coercions import Coercion
+from variables_and_binding import Param, Var
+from functions import Function
+from modules import ModuleDef
+from ast_walk import map_scoped_children
+from function_evaluation import evaluate_pure_calls
+from inlining import inline_calls
+from branch_elimination import eliminate_dead_branches
+from cast_elimination import eliminate_casts
+from lowering import lower_functions
+from dup_elimination import eliminate_dups
+from ir import IRBody, verify_ir, function_listing
+
+@dataclass(frozen=True)
+class OptimizationPass:
+  name: str
+  run: Callable[[list[Decl]], tuple[list[Decl], Any]]
+
+optimization_passes = [
+  OptimizationPass('function_evaluation', evaluate_pure_calls),
+  OptimizationPass('inlining', inline_calls),
+  OptimizationPass('branch_elimination', eliminate_dead_branches),
+  OptimizationPass('cast_elimination', eliminate_casts),
+  OptimizationPass('lowering', lower_functions),
+  OptimizationPass('dup_elimination', eliminate_dups),
+]
+
+def select_passes(names=None):
+  if names is None:
+    return optimization_passes
+  by_name = {p.name: p for p in optimization_passes}
+  for name in names:
+    if name not in by_name:
+      raise Exception('unknown optimization pass ' + name + ', expected one of '
+                      + ', '.join(by_name.keys()))
+  return [by_name[name] for name in names]
+
+# Runs the passes with the given names (or all of them) and returns the
+# new declarations and the (name, report) pair of each pass.
+def optimize_program(decls, names=None, verify=False, dump=False):
+  reports = []
+  if verify:
+    with_recursion_limit(verify_program, decls, 'type checking')
+  for opt in select_passes(names):
+    # The passes recurse down the chains of `Seq` nodes in long bodies.
+    decls, report = with_recursion_limit(opt.run, decls)
+    reports.append((opt.name, report))
+    if dump:
+      print('**** after ' + opt.name + ' ****')
+      for decl in decls:
+        match decl:
+          case Function(body=IRBody()):
+            print(function_listing(decl))
+          case _:
+            print(decl)
+        print()
+      print()
+    if verify:
+      with_recursion_limit(verify_program, decls, opt.name)
+  return decls, reports
+
+# Checks that the program is well formed, to catch a pass that breaks
+# it before the machine runs it:
+# * each field declared as an AST node, a coercion, or a type holds one,
+#   and so does each element of a field declared as a list of them,
+#   where a type may be missing, as in the witness parameters of a
+#   generic function (see `ImplReq.declare`),
+# * each variable is in scope, that is, it is bound by an enclosing
+#   parameter or by a declaration of the program or of its module, and
+# * each body in the IR passes `verify_ir`.
+def verify_program(decls, after):
+  verify(decls, declared_names(decls), after)
+
+def verify(x, scope, after):
+  match x:
+    case Var(ident) if ident not in scope:
+      error(x.location, 'after ' + after + ', variable ' + ident
+            + ' is not in scope')
+    case ModuleDef(body=body):
+      verify(body, scope | declared_names(body), after)
+      return
+    case Function(params=params, body=IRBody() as body):
+      verify_ir(body, {p.ident for p in params}, after)
+  if is_dataclass(x) and not isinstance(x, type):
+    hints = field_types(type(x))
+    for fld in fields(x):
+      value = getattr(x, fld.name)
+      expected = field_kind(hints.get(fld.name))
+      if expected is not None and not isinstance(value, expected) \
+         and not (value is None
+                  and (fld.default is None or expected is Type)):
+        bad_field(x, fld, expected, value, after)
+      expected = element_kind(hints.get(fld.name))
+      if expected is not None and isinstance(value, list):
+        for elt in value:
+          if not isinstance(elt, expected):
+            bad_field(x, fld, expected, elt, after)
+  map_scoped_children(x, lambda y, params:
+                      verify_child(y, scope, params, after))
+
+def verify_child(x, scope, params, after):
+  if len(params) > 0:
+    scope = scope | {p.ident for p in params if isinstance(p, Param)}
+  verify(x, scope, after)
+  return x
+
+def bad_field(x, fld, expected, value, after):
+  error(getattr(x, 'location', None),
+        'after ' + after + ', expected ' + expected.__name__
+        + ' in field ' + fld.name + ' of ' + type(x).__name__
+        + ', not ' + repr(value))
+
+# The type annotations of the fields of the class. The modules with
+# `from __future__ import annotations`, such as ast_base.py, store them
+# as strings, which `get_type_hints` evaluates.
+@cache
+def field_types(cls):
+  return get_type_hints(cls)
+
+# The kind of value that a field with the given type annotation holds,
+# or None if it is not checked.
+def field_kind(annotation):
+  for kind in (AST, Coercion, Type):
+    if isinstance(annotation, type) and issubclass(annotation, kind):
+      return kind
+  return None
+
+# The kind of the elements of a field annotated as a list, such as
+# `list[Exp]`, or None if they are not checked.
+def element_kind(annotation):
+  if get_origin(annotation) is list and len(get_args(annotation)) == 1:
+    return field_kind(get_args(annotation)[0])
+  return None
+
+# The names declared by the declarations, which are the names that the
+# machine binds when it runs them (see `Decl.declare`).
+def declared_names(decls):
+  env = {}
+  for d in decls:
+    d.declare(env, NameCollector())
+  return set(env.keys())
+
+class NameCollector:
+  def allocate(self, val):
+    return None
@@ -0,0 +1,58 @@
+#
+# This file defines the output buffer of the machine, which collects
+# the text produced by the `print` and `print_array` primitives and
+# writes it to standard output in large chunks.
+#
+# The buffer is flushed when it grows past `threshold` characters,
+# before the program reads input (so that prompts appear), and when
+# the machine finishes running the program, whether it finished
+# normally, by calling `exit`, or with an error.
+#
+# In compact mode, printed numbers are separated by a space instead
+# of a newline, and a single newline is written at the end.
+
+from dataclasses import dataclass, field
+import sys
+from utilities import tracing_on, debug
+
+@dataclass
+class OutputBuffer:
+  compact: bool = False
+  threshold: int = 1 << 16
+  chunks: list[str] = field(default_factory=list)
+  size: int = 0
+  wrote_compact: bool = False
+
+  def separator(self):
+    return ' ' if self.compact else '\n'
+
+  def write(self, text):
+    self.chunks.append(text)
+    self.size += len(text)
+    # Keep the output in order with the tracing and debugger output.
+    if self.size >= self.threshold or tracing_on() or debug():
+      self.flush()
+
+  def write_value(self, val):
+    self.wrote_compact = self.compact
+    self.write(str(val) + self.separator())
+
+  def write_values(self, vals):
+    if len(vals) > 0:
+      self.wrote_compact = self.compact
+      sep = self.separator()
+      self.write(''.join([str(v) + sep for v in vals]))
+
+  def flush(self):
+    if len(self.chunks) > 0:
+      sys.stdout.write(''.join(self.chunks))
+      self.chunks = []
+      self.size = 0
+    sys.stdout.flush()
+
+  # Called once the program is finished.
+  def close(self):
+    if self.wrote_compact:
+      self.chunks.append('\n')
+      self.wrote_compact = False
+    self.flush()
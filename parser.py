@@ -10,63 +10,89 @@ from futures import *
 from interfaces_and_impls import *
 from primitive_operations import PrimitiveCall
 from ast_types import *
+from utilities import with_recursion_limit, pickle_recursion_limit
+from locations import location_of
 from collections import OrderedDict
 from dataclasses import dataclass
-from lark import Lark, Token, logger
 from typing import List, Set, Dict, Tuple
+import hashlib
+import os
 import sys
 
-from lark import logger
-import logging
-#logger.setLevel(logging.DEBUG)
-
-filename = '???'
-
-def set_filename(fname):
-    global filename
-    filename = fname
 
 ##################################################
 # Concrete Syntax Parser
 ##################################################
 
-lark_parser = Lark(open("./Arete.lark").read(), start='arete', parser='lalr',
-                   debug=True, propagate_positions=True)
+# The LALR tables are built once per version of the grammar and cached
+# in `__pycache__` next to this file. The cache file name includes
+# a hash of the grammar, so editing Arete.lark starts a fresh cache.
+#
+# The parser is created the first time it is needed, so that runs that
+# reuse a cached translation (see ast_cache.py) never load lark.
+
+grammar_dir = os.path.dirname(os.path.abspath(__file__))
+grammar_text = open(os.path.join(grammar_dir, 'Arete.lark')).read()
+grammar_hash = hashlib.sha256(grammar_text.encode('utf8')).hexdigest()
+parser_cache = os.path.join(grammar_dir, '__pycache__',
+                            'Arete.lark.' + grammar_hash[:16] + '.cache')
+
+def make_lark_parser():
+    from lark.lark import Lark
+    options = {'start': 'arete', 'parser': 'lalr',
+               'propagate_positions': True}
+    try:
+        os.makedirs(os.path.dirname(parser_cache), exist_ok=True)
+        return Lark(grammar_text, cache=parser_cache, **options)
+    except OSError:
+        # read-only installation, build the tables every time
+        return Lark(grammar_text, **options)
+
+lark_parser = None
+
+def get_lark_parser():
+    global lark_parser
+    if lark_parser is None:
+        lark_parser = make_lark_parser()
+    return lark_parser
+
+def parse_text(s):
+    return get_lark_parser().parse(s)
 
 ##################################################
 # Parsing Concrete to Abstract Syntax
 ##################################################
 
+# The list rules in Arete.lark are right recursive, so a long list
+# parses into a deep chain of `push` nodes. Instead of recursing down
+# the chain, we walk it with a loop. For each element of the list,
+# the result contains the children of its `single` or `push` node,
+# not including the rest of the list.
+def parse_tree_to_elements(e):
+    elements = []
+    while e.data == 'push':
+        elements.append(e.children[:-1])
+        e = e.children[-1]
+    if e.data == 'single':
+        elements.append(e.children)
+    elif e.data != 'empty':
+        raise Exception('parse_tree_to_elements, unexpected ' + str(e))
+    return elements
+
 def parse_tree_to_list(e):
-    if e.data == 'empty':
-        return tuple([])
-    elif e.data == 'single':
-        return tuple([parse_tree_to_ast(e.children[0])])
-    elif e.data == 'push':
-        return tuple([parse_tree_to_ast(e.children[0])]) \
-            + parse_tree_to_list(e.children[1])
-    else:
-        raise Exception('parse_tree_to_str_list, unexpected ' + str(e))
+    return tuple(parse_tree_to_ast(c[0]) for c in parse_tree_to_elements(e))
     
 def parse_tree_to_str_list(e):
     if e.data == 'nothing':
         return tuple()
     elif e.data == 'just':
         return parse_tree_to_str_list(e.children[0])
-    elif e.data == 'empty':
-        return type()
-    elif e.data == 'single':
-        return tuple([e.children[0].value])
-    elif e.data == 'push':
-        return tuple([e.children[0].value]) \
-            + parse_tree_to_str_list(e.children[1])
     else:
-        raise Exception('parse_tree_to_str_list, unexpected ' + str(e))
+        return tuple(c[0].value for c in parse_tree_to_elements(e))
 
 def parse_tree_to_req(e):
-    e.meta.filename = filename
     if e.data == 'impl_req':
-        return ImplReq(e.meta,
+        return ImplReq(e.location,
                        str(e.children[0].value) + str(next_impl_num()),
                        str(e.children[0].value),
                        parse_tree_to_type_list(e.children[1]),
@@ -75,123 +101,80 @@ def parse_tree_to_req(e):
         raise Exception('unrecognized requirement ' + str(e))
     
 def parse_tree_to_type(e):
-    e.meta.filename = filename
     if e.data == 'nothing' or e.data == 'any_type':
-        return AnyType(e.meta)
+        return AnyType(e.location)
     elif e.data == 'just':
         return parse_tree_to_type(e.children[0])
     elif e.data == 'int_type':
-        return IntType(e.meta)
+        return IntType(e.location)
     elif e.data == 'rational_type':
-        return RationalType(e.meta)
+        return RationalType(e.location)
     elif e.data == 'bool_type':
-        return BoolType(e.meta)
+        return BoolType(e.location)
     elif e.data == 'void_type':
-        return VoidType(e.meta)
+        return VoidType(e.location)
     elif e.data == 'array_type':
-        return ArrayType(e.meta, parse_tree_to_type(e.children[0]))
+        return ArrayType(e.location, parse_tree_to_type(e.children[0]))
     elif e.data == 'ptr_type':
-        return PointerType(e.meta,
+        return PointerType(e.location,
                            parse_tree_to_type(e.children[0]))
     elif e.data == 'tuple_type':
-        return TupleType(e.meta,
+        return TupleType(e.location,
                          parse_tree_to_type_list(e.children[0]))
     elif e.data == 'function_type':
-       return FunctionType(e.meta,
+       return FunctionType(e.location,
                            tuple(), # TODO: add type parameters
                            parse_tree_to_param_type_list(e.children[0]),
                            parse_tree_to_type(e.children[1]),
                            tuple()) # TODO: add requirements
     elif e.data == 'variant_type':
-        return VariantType(e.meta,
+        return VariantType(e.location,
                            parse_tree_to_alt_list(e.children[0]))
     elif e.data == 'record_type':
-        return RecordType(e.meta,
+        return RecordType(e.location,
                            parse_tree_to_alt_list(e.children[0]))
     elif e.data == 'recursive_type':
-        return RecursiveType(e.meta,
+        return RecursiveType(e.location,
                              str(e.children[0].value),
                              parse_tree_to_type(e.children[1]))
     elif e.data == 'type_var':
-        return TypeVar(e.meta, str(e.children[0].value))
+        return TypeVar(e.location, str(e.children[0].value))
     elif e.data == 'type_application':
-        return TypeApplication(e.meta,
+        return TypeApplication(e.location,
                                parse_tree_to_type(e.children[0]),
                                parse_tree_to_type_list(e.children[1]))
     else:
         raise Exception('unrecognized type annotation ' + repr(e))
     
 def parse_tree_to_type_list(e):
-    e.meta.filename = filename
-    if e.data == 'empty':
-        return ()
-    elif e.data == 'single':
-        return (parse_tree_to_type(e.children[0]),)
-    elif e.data == 'push':
-        return (parse_tree_to_type(e.children[0]),) \
-            + parse_tree_to_type_list(e.children[1])
-    else:
-        raise Exception('unrecognized as a type list ' + repr(e))
+    return tuple(parse_tree_to_type(c[0]) for c in parse_tree_to_elements(e))
 
 def parse_tree_to_param_type_list(e):
-    e.meta.filename = filename
-    if e.data == 'empty':
-        return ()
-    elif e.data == 'single':
-        kind = str(e.children[0].data)
-        ty = parse_tree_to_type(e.children[1])
-        return ((kind, ty) ,)
-    elif e.data == 'push':
-        kind = str(e.children[0].data)
-        ty = parse_tree_to_type(e.children[1])
-        return ((kind, ty),) \
-            + parse_tree_to_param_type_list(e.children[2])
-    else:
-        raise Exception('unrecognized as a type list ' + repr(e))
+    return tuple((str(c[0].data), parse_tree_to_type(c[1]))
+                 for c in parse_tree_to_elements(e))
     
 def parse_tree_to_req_list(e):
-    e.meta.filename = filename
-    if e.data == 'empty':
-        return ()
-    elif e.data == 'single':
-        return (parse_tree_to_req(e.children[0]),)
-    elif e.data == 'push':
-        return (parse_tree_to_req(e.children[0]),) \
-            + parse_tree_to_req_list(e.children[1])
-    else:
-        raise Exception('unrecognized as a req list ' + repr(e))
+    return tuple(parse_tree_to_req(c[0]) for c in parse_tree_to_elements(e))
     
 def parse_tree_to_alt(e):
     return (str(e.children[0].value),
             parse_tree_to_type(e.children[1]))
     
 def parse_tree_to_alt_list(e):
-    if e.data == 'empty':
-        return ()
-    elif e.data == 'single':
-        return (parse_tree_to_alt(e.children[0]),)
-    elif e.data == 'push':
-        return (parse_tree_to_alt(e.children[0]),) \
-            + parse_tree_to_alt_list(e.children[1])
-    else:
-        raise Exception('unrecognized as a type list ' + repr(e))
+    return tuple(parse_tree_to_alt(c[0]) for c in parse_tree_to_elements(e))
     
 def parse_tree_to_param(e):
-  e.meta.filename = filename
   if e.data == 'empty' or e.data == 'nothing':
     return []
   elif e.data == 'just':
     return parse_tree_to_param(e.children[0])
-  elif e.data == 'single':
-    return [parse_tree_to_param(e.children[0])]
-  elif e.data == 'push':
-    return [parse_tree_to_param(e.children[0])] \
-      + parse_tree_to_param(e.children[1])
+  elif e.data == 'single' or e.data == 'push':
+    return [parse_tree_to_param(c[0]) for c in parse_tree_to_elements(e)]
   elif e.data == 'binding':
-    return Param(e.meta, e.children[0].data, None, e.children[1].value,
+    return Param(e.location, e.children[0].data, None, e.children[1].value,
                  parse_tree_to_type(e.children[2]))
   elif e.data == 'no_binding':
-    return NoParam(e.meta)
+    return NoParam(e.location)
   else:    
     raise Exception('unrecognized parameter' + repr(e))
 
@@ -202,13 +185,7 @@ def parse_tree_to_case(e):
     return (tag, var, body)
 
 def parse_tree_to_case_list(e):
-    if e.data == 'single':
-        return (parse_tree_to_case(e.children[0]),)
-    elif e.data == 'push':
-        return (parse_tree_to_case(e.children[0]),) \
-            + parse_tree_to_case_list(e.children[1])
-    else:
-        raise Exception('unrecognized as a type list ' + repr(e))
+    return tuple(parse_tree_to_case(c[0]) for c in parse_tree_to_elements(e))
     
 primitive_ops = {'add', 'sub', 'mul', 'div', 'int_div', 'mod', 'neg', 'sqrt',
                  'and', 'or', 'not',
@@ -217,7 +194,7 @@ primitive_ops = {'add', 'sub', 'mul', 'div', 'int_div', 'mod', 'neg', 'sqrt',
                  'equal', 'not_equal',
                  'less', 'greater', 'less_equal', 'greater_equal',
                  'permission', 'upgrade', 'breakpoint',
-                 'exit', 'input', 'print'}
+                 'exit', 'input', 'print', 'input_array', 'print_array'}
 
 impl_num = 0
 def next_impl_num():
@@ -227,32 +204,31 @@ def next_impl_num():
     return ret
     
 def parse_tree_to_ast(e):
-    e.meta.filename = filename
     # expressions
     if e.data == 'raw_string':
         return str(e.children[0].value)
     if e.data == 'var':
-        return Var(e.meta, str(e.children[0].value))
+        return Var(e.location, str(e.children[0].value))
     elif e.data == 'int':
-        return Int(e.meta, int(e.children[0]))
+        return Int(e.location, int(e.children[0]))
     elif e.data == 'true':
-        return Bool(e.meta, True)
+        return Bool(e.location, True)
     elif e.data == 'false':
-        return Bool(e.meta, False)
+        return Bool(e.location, False)
     elif e.data in primitive_ops:
-        return PrimitiveCall(e.meta, e.data,
+        return PrimitiveCall(e.location, e.data,
                              [parse_tree_to_ast(c) for c in e.children])
     elif e.data == 'tuple':
-        return TupleExp(e.meta, parse_tree_to_ast(e.children[0]))
+        return TupleExp(e.location, parse_tree_to_ast(e.children[0]))
     elif e.data == 'record':
-        return RecordExp(e.meta,
+        return RecordExp(e.location,
                          parse_tree_to_ast(e.children[0]))
     elif e.data == 'array':
-        return Array(e.meta,
+        return Array(e.location,
                      parse_tree_to_ast(e.children[0]),
                      parse_tree_to_ast(e.children[1]))
     elif e.data == 'lambda':
-        return Lambda(e.meta,
+        return Lambda(e.location,
                       parse_tree_to_param(e.children[0]),
                       parse_tree_to_param(e.children[1]),
                       str(e.children[2].data),
@@ -261,140 +237,135 @@ def parse_tree_to_ast(e):
                       'lambda')
     elif e.data == 'call':
         e1, e2 = e.children
-        return Call(e.meta, parse_tree_to_ast(e1), parse_tree_to_ast(e2))
+        return Call(e.location, parse_tree_to_ast(e1), parse_tree_to_ast(e2))
     elif e.data == 'index':
         e1, e2 = e.children
-        return Index(e.meta, parse_tree_to_ast(e1), parse_tree_to_ast(e2))
+        return Index(e.location, parse_tree_to_ast(e1), parse_tree_to_ast(e2))
     elif e.data == 'slice':
         e1, e2, e3, e4 = e.children
-        return Slice(e.meta, parse_tree_to_ast(e1), parse_tree_to_ast(e2),
+        return Slice(e.location, parse_tree_to_ast(e1), parse_tree_to_ast(e2),
                      parse_tree_to_ast(e3), parse_tree_to_ast(e4))
     elif e.data == 'deref':
-        return Deref(e.meta, parse_tree_to_ast(e.children[0]))
+        return Deref(e.location, parse_tree_to_ast(e.children[0]))
     elif e.data == 'addrof':
-        return AddressOf(e.meta, parse_tree_to_ast(e.children[0]))
+        return AddressOf(e.location, parse_tree_to_ast(e.children[0]))
     elif e.data == 'paren':
         return parse_tree_to_ast(e.children[0])
     elif e.data == 'module_member':
-        return ModuleMember(e.meta,
+        return ModuleMember(e.location,
                             parse_tree_to_ast(e.children[0]),
                             str(e.children[1].value))
     elif e.data == 'variant_member':
-        return VariantMember(e.meta,
+        return VariantMember(e.location,
                              parse_tree_to_ast(e.children[0]),
                              str(e.children[1].value))
     elif e.data == 'record_member':
-        return FieldAccess(e.meta,
+        return FieldAccess(e.location,
                            parse_tree_to_ast(e.children[0]),
                            str(e.children[1].value))
     elif e.data == 'condition':
-        return IfExp(e.meta,
+        return IfExp(e.location,
                      parse_tree_to_ast(e.children[0]),
                      parse_tree_to_ast(e.children[1]),
                      parse_tree_to_ast(e.children[2]))
     elif e.data == 'binding_exp':
-        return BindingExp(e.meta,
-                          Param(e.meta, e.children[0].data,
+        return BindingExp(e.location,
+                          Param(e.location, e.children[0].data,
                                 None, e.children[1].value,
                                 parse_tree_to_type(e.children[2])),
                           parse_tree_to_ast(e.children[3]),
                           parse_tree_to_ast(e.children[4]))
     elif e.data == 'future':
-        return FutureExp(e.meta, parse_tree_to_ast(e.children[0]))
+        return FutureExp(e.location, parse_tree_to_ast(e.children[0]))
     elif e.data == 'wait':
-        return Wait(e.meta, parse_tree_to_ast(e.children[0]))
+        return Wait(e.location, parse_tree_to_ast(e.children[0]))
     elif e.data == 'tag_variant':
-        return TagVariant(e.meta,
+        return TagVariant(e.location,
                           str(e.children[0].value),
                           parse_tree_to_ast(e.children[1]),
                           parse_tree_to_type(e.children[2]))
     
     # statements
-    elif e.data == 'binding_stmt':
-        return BindingStmt(e.meta,
-                           Param(e.meta, e.children[0].data,
-                                 None, e.children[1].value,
-                                 parse_tree_to_type(e.children[2])),
-                           parse_tree_to_ast(e.children[3]),
-                           parse_tree_to_ast(e.children[4]))
+    elif e.data == 'binding_stmt' or e.data == 'seq':
+        return parse_tree_to_statement_list(e)
     elif e.data == 'return':
-        return Return(e.meta, parse_tree_to_ast(e.children[0]))
+        return Return(e.location, parse_tree_to_ast(e.children[0]))
     elif e.data == 'write':
-        return Write(e.meta,
+        return Write(e.location,
                      parse_tree_to_ast(e.children[0]),
                      parse_tree_to_ast(e.children[1]))
     elif e.data == 'transfer':
-        return Transfer(e.meta,
+        return Transfer(e.location,
                         parse_tree_to_ast(e.children[0]),
                         parse_tree_to_ast(e.children[1]),
                         parse_tree_to_ast(e.children[2]))
     elif e.data == 'expr':
-        return Expr(e.meta, parse_tree_to_ast(e.children[0]))
+        return Expr(e.location, parse_tree_to_ast(e.children[0]))
     elif e.data == 'assert':
-        return Assert(e.meta, parse_tree_to_ast(e.children[0]))
+        return Assert(e.location, parse_tree_to_ast(e.children[0]))
     elif e.data == 'return':
-        return Return(e.meta, parse_tree_to_ast(e.children[0]))
-    elif e.data == 'seq':
-        return Seq(e.meta,
-                   parse_tree_to_ast(e.children[0]),
-                   parse_tree_to_ast(e.children[1]))
+        return Return(e.location, parse_tree_to_ast(e.children[0]))
     elif e.data == 'last_statement':
         return parse_tree_to_ast(e.children[0])
     elif e.data == 'if' or e.data == 'else_if':
-        return IfStmt(e.meta,
+        return IfStmt(e.location,
                       parse_tree_to_ast(e.children[0]),
                       parse_tree_to_ast(e.children[1]),
                       parse_tree_to_ast(e.children[2]))
     elif e.data == 'else':
         return parse_tree_to_ast(e.children[0])
     elif e.data == 'no_else':
-        return Pass(e.meta)
+        return Pass(e.location)
     elif e.data == 'while':
-        return While(e.meta,
+        return While(e.location,
                       parse_tree_to_ast(e.children[0]),
                       parse_tree_to_ast(e.children[1]))
     elif e.data == 'for_in':
-        return ForIn(e.meta,
+        return ForIn(e.location,
                      parse_tree_to_param(e.children[0]),
                      parse_tree_to_ast(e.children[1]),
                      parse_tree_to_ast(e.children[2]))
     elif e.data == 'delete':
-        return Delete(e.meta, parse_tree_to_ast(e.children[0]))
+        return Delete(e.location, parse_tree_to_ast(e.children[0]))
     elif e.data == 'block':
-        return Block(e.meta, body=parse_tree_to_ast(e.children[0]))
+        return Block(e.location, body=parse_tree_to_ast(e.children[0]))
     elif e.data == 'pass':
-        return Pass(e.meta)
+        return Pass(e.location)
     elif e.data == 'match':
-        return Match(e.meta,
+        return Match(e.location,
                      parse_tree_to_ast(e.children[0]),
                      parse_tree_to_case_list(e.children[1]))
 
     # definitions
     elif e.data == 'import':
-        return Import(e.meta,
+        return Import(e.location,
                       parse_tree_to_ast(e.children[0]),
                       parse_tree_to_list(e.children[1]))
+    elif e.data == 'import_file':
+        return Import(e.location,
+                      ModuleFile(e.location, str(e.children[0].value)[1:-1]),
+                      parse_tree_to_list(e.children[1]))
     elif e.data == 'global':
-        return Global(e.meta,
+        return Global(e.location,
                       str(e.children[0].value),
                       parse_tree_to_type(e.children[1]),
                       parse_tree_to_ast(e.children[2]))
     elif e.data == 'constant':
-        return ConstantDef(e.meta,
+        return ConstantDef(e.location,
                             str(e.children[0].value),
                             parse_tree_to_type(e.children[1]),
                             parse_tree_to_ast(e.children[2]))
     elif e.data == 'type_definition':
-        return TypeAlias(e.meta,
+        return TypeAlias(e.location,
                          str(e.children[0].value),
                          parse_tree_to_type(e.children[1]))
     elif e.data == 'type_operator':
-        return TypeOperator(e.meta,
+        return TypeOperator(e.location,
                             str(e.children[0].value),
                             parse_tree_to_str_list(e.children[1]),
                             parse_tree_to_type(e.children[2]))
     elif e.data == 'function':
-        return Function(e.meta,
+        return Function(e.location,
                         str(e.children[0].value),
                         parse_tree_to_str_list(e.children[1]),
                         parse_tree_to_param(e.children[2]),
@@ -403,12 +374,12 @@ def parse_tree_to_ast(e):
                         parse_tree_to_req_list(e.children[5]),
                         parse_tree_to_ast(e.children[6]))
     elif e.data == 'module':
-        return ModuleDef(e.meta,
+        return ModuleDef(e.location,
                           str(e.children[0].value),
                           parse_tree_to_list(e.children[1]),
                           parse_tree_to_ast(e.children[2]))
     elif e.data == 'interface':
-        return Interface(e.meta,
+        return Interface(e.location,
                          str(e.children[0].value),
                          parse_tree_to_str_list(e.children[1]),
                          parse_tree_to_req_list(e.children[2]),
@@ -416,7 +387,7 @@ def parse_tree_to_ast(e):
     elif e.data == 'declaration':
         return (str(e.children[0].value), parse_tree_to_type(e.children[1]))
     elif e.data == 'implementation':
-        return Impl(e.meta,
+        return Impl(e.location,
                     str(e.children[0].value) + str(next_impl_num()),
                     str(e.children[0].value),
                     parse_tree_to_type_list(e.children[1]),
@@ -430,7 +401,7 @@ def parse_tree_to_ast(e):
     
     # is impl_req needed?
     elif e.data == 'impl_req':
-        return ImplReq(e.meta,
+        return ImplReq(e.location,
                        str(e.children[0].value) + str(next_impl_num()),
                        str(e.children[0].value),
                        parse_tree_to_type_list(e.children[1]),
@@ -438,34 +409,63 @@ def parse_tree_to_ast(e):
     elif e.data == 'default_initializer':
         return parse_tree_to_ast(e.children[0])
     elif e.data == 'frac_initializer':
-        return PercentOf(e.meta, parse_tree_to_ast(e.children[0]), parse_tree_to_ast(e.children[1]))
+        return PercentOf(e.location, parse_tree_to_ast(e.children[0]), parse_tree_to_ast(e.children[1]))
     
     # lists
-    elif e.data == 'single':
-        return [parse_tree_to_ast(e.children[0])]
-    elif e.data == 'push':
-        return [parse_tree_to_ast(e.children[0])] \
-            + parse_tree_to_ast(e.children[1])
-    elif e.data == 'empty':
-        return []
+    elif e.data == 'single' or e.data == 'push' or e.data == 'empty':
+        return [parse_tree_to_ast(c[0]) for c in parse_tree_to_elements(e)]
     # whole program
     elif e.data == 'arete':
         return parse_tree_to_ast(e.children[0])
     else:
         raise Exception('unhandled parse tree', e)
 
-def parse(s, trace = False):
-    lexed = lark_parser.lex(s)
+# A statement list is a right-nested chain of `seq` and `binding_stmt`
+# nodes. We translate the statements and initializers front-to-back
+# with a loop and then build the `Seq` and `BindingStmt` nodes
+# back-to-front, so long functions don't recurse once per statement.
+def parse_tree_to_statement_list(e):
+    chain = []
+    while e.data == 'seq' or e.data == 'binding_stmt':
+        if e.data == 'seq':
+            chain.append((e, parse_tree_to_ast(e.children[0])))
+        else:
+            param = Param(e.location, e.children[0].data,
+                          None, e.children[1].value,
+                          parse_tree_to_type(e.children[2]))
+            chain.append((e, param, parse_tree_to_ast(e.children[3])))
+        e = e.children[-1]
+    result = parse_tree_to_ast(e)
+    for link in reversed(chain):
+        if link[0].data == 'seq':
+            result = Seq(link[0].location, link[1], result)
+        else:
+            result = BindingStmt(link[0].location, link[1], link[2], result)
+    return result
+
+# Give every node of the parse tree its location in the source file,
+# from which the abstract syntax tree gets its locations. The file name
+# is passed along instead of being stored in a global, so that files
+# can be parsed in any order.
+def assign_locations(parse_tree, filename):
+    for subtree in parse_tree.iter_subtrees():
+        subtree.location = location_of(subtree.meta, filename)
+
+def parse_tree_of(s, trace = False):
     if trace:
         print('tokens: ')
-        for word in lexed:
+        for word in get_lark_parser().lex(s):
             print(repr(word))
         print('')
-    parse_tree = lark_parser.parse(s)
+    parse_tree = parse_text(s)
     if trace:
         print('parse tree: ')
         print(parse_tree)
         print('')
+    return parse_tree
+
+def parse_tree_to_program(parse_tree, filename, trace = False):
+    assign_locations(parse_tree, filename)
     ast = parse_tree_to_ast(parse_tree)
     if trace:
         print('abstract syntax tree: ')
@@ -473,9 +473,61 @@ def parse(s, trace = False):
         print('')
     return ast
 
+def parse(s, trace = False, filename = '???'):
+    return parse_tree_to_program(parse_tree_of(s, trace), filename, trace)
+
+# Parse several source files, given as a list of (filename, contents)
+# pairs, and return all of their declarations in order.
+#
+# Running the LALR parser is by far the most expensive part of parsing,
+# so when there are several large files, their parse trees are built
+# in parallel by a pool of processes. The translation to abstract
+# syntax happens here, one file after another, so that the names
+# generated for impls (see `next_impl_num`) are the same as when
+# parsing the files one at a time.
+parallel_parse_threshold = 1 << 14
+
+def parse_files(sources, trace = False):
+    total = sum(len(text) for _, text in sources)
+    if len(sources) > 1 and total >= parallel_parse_threshold and not trace:
+        parse_trees = with_recursion_limit(parse_trees_in_parallel,
+                                           [text for _, text in sources])
+    else:
+        parse_trees = [None for _ in sources]
+    decls = []
+    for (filename, text), parse_tree in zip(sources, parse_trees):
+        if parse_tree is None:
+            parse_tree = parse_tree_of(text, trace)
+        decls += parse_tree_to_program(parse_tree, filename, trace)
+    return decls
+
+# Returns the parse tree of each text, or None for the texts that
+# could not be parsed in the pool, such as those with syntax errors.
+# Those are parsed again by `parse_files`, which reports the error.
+def parse_trees_in_parallel(texts):
+    # imported here because most runs only have one file
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    workers = min(len(texts), os.cpu_count() or 1)
+    try:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=sys.setrecursionlimit,
+                                 initargs=(pickle_recursion_limit,)) as pool:
+            jobs = [pool.submit(parse_text, text) for text in texts]
+            return [parse_tree_or_none(job) for job in jobs]
+    except (OSError, NotImplementedError, BrokenProcessPool):
+        # no process pool on this platform, parse sequentially
+        return [None for _ in texts]
+
+def parse_tree_or_none(job):
+    try:
+        return job.result()
+    except Exception:
+        return None
+
 if __name__ == "__main__":
     filename = sys.argv[1]
     file = open(filename, 'r')
     p = file.read()
-    ast = parse(p)
+    ast = parse(p, False, filename)
     print(str(ast))
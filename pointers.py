@@ -15,9 +15,9 @@ from ast_types import *
 from values import *
 from utilities import *
 
-@dataclass
+@dataclass(slots=True)
 class PercentOf(Exp):
-  location: Meta
+  location: Location
   percentage: Exp
   arg: Exp
   __match_args__ = ("location", "percentage", "arg")
@@ -76,7 +76,7 @@ class PercentOf(Exp):
                                 self.location)
 
 
-@dataclass
+@dataclass(slots=True)
 class Deref(Exp):
   arg: Exp
   __match_args__ = ("arg",)
@@ -126,7 +126,7 @@ class Deref(Exp):
 
     
       
-@dataclass
+@dataclass(slots=True)
 class AddressOf(Exp):
   arg: Exp
   __match_args__ = ("arg",)
@@ -160,7 +160,7 @@ class AddressOf(Exp):
         result = Result(True, machine.memory.allocate(res.value))
       machine.finish_expression(result, self.location)
 
-@dataclass
+@dataclass(slots=True)
 class Transfer(Stmt):
   lhs: Exp
   percent: Exp
@@ -213,7 +213,7 @@ class Transfer(Stmt):
       dest_ptr.transfer(percent, src_ptr, self.location)
       machine.finish_statement(self.location)
 
-@dataclass
+@dataclass(slots=True)
 class Delete(Stmt):
   arg: Exp
   __match_args__ = ("arg",)
@@ -1,6 +1,7 @@
 from values import *
 from ast_types import *
-from abstract_syntax import make_cast
+from abstract_syntax import make_cast, Int, Frac, Bool, is_constant
+from variables_and_binding import const_eval_operand
 import math
 
 compare_ops = {'less': lambda x, y: x < y,
@@ -20,9 +21,10 @@ def eval_prim(op, vals, machine, location):
         case 'exit':
             exit(vals[0])
         case 'input':
+            machine.output.flush()
             return Number(int(input()))
         case 'print':
-            print(vals[0])
+            machine.output.write_value(vals[0])
             return Void()
         case 'copy':
             return vals[0].duplicate(1, location)
@@ -111,7 +113,7 @@ prim_types = {'add': FunctionType(None, [], [IntType(None), IntType(None)], IntT
               'not': FunctionType(None, [], [BoolType(None)], BoolType(None), [])}
 
 
-def type_check_prim(location: Meta, op: str, arg_types: list[Type], args: list[Exp]) -> tuple[Type,list[Exp]]:
+def type_check_prim(location: Location, op: str, arg_types: list[Type], args: list[Exp]) -> tuple[Type,list[Exp]]:
     arg_types = [unfold(arg_ty) for arg_ty in arg_types]
     match op:
         case op if op in prim_types.keys():
@@ -193,23 +195,62 @@ def type_check_prim(location: Meta, op: str, arg_types: list[Type], args: list[E
             new_args = [make_cast(arg, arg_t, IntType(location)) for arg, arg_t in zip(args, arg_types)]
             return BoolType(location), new_args
         case _:
-            return get_primitive_type_check(op)(arg_types, location)
+            return get_primitive_type_check(op)(arg_types, location), args
 
 
+# The primitive operations that have no effects, which const_eval
+# performs when their arguments are constants of the types they expect.
+int_ops = {'add': lambda x, y: x + y,
+           'sub': lambda x, y: x - y,
+           'mul': lambda x, y: x * y}
+
+# These fail when the divisor is zero, which is left for runtime.
+division_ops = {'int_div': lambda x, y: x // y,
+                'mod': lambda x, y: x % y}
+
+bool_ops = {'and': lambda x, y: x and y,
+            'or': lambda x, y: x or y}
+
+pure_ops = set(int_ops.keys()) | set(division_ops.keys()) \
+    | set(bool_ops.keys()) | set(compare_ops.keys()) \
+    | set(['neg', 'sqrt', 'not', 'equal', 'not_equal'])
+
+# Returns the constant result of the primitive operation, or a call to
+# perform it at runtime.
 def const_eval_prim(loc, op, args):
-    match op:
-        case 'div':
-            if is_constant(args[0]) and is_constant(args[1]):
-                left = to_number(eval_constant(args[0]), loc)
-                right = to_number(eval_constant(args[1]), loc)
-                return Frac(loc, Fraction(left, right))
-            else:
-                return PrimitiveCall(loc, op, args)
+    result = fold_prim(loc, op, args)
+    if result is None:
+        return PrimitiveCall(loc, op, args)
+    return result
+
+def fold_prim(loc, op, args):
+    match (op, args):
+        case (op, [Int(left), Int(right)]) if op in int_ops:
+            return Int(loc, int_ops[op](left, right))
+        case (op, [Int(left), Int(right)]) \
+              if op in division_ops and right != 0:
+            return Int(loc, division_ops[op](left, right))
+        case ('div', [Int(left), Int(right)]) if right != 0:
+            return Frac(loc, Fraction(left, right))
+        case ('neg', [Int(n)]):
+            return Int(loc, - n)
+        case ('sqrt', [Int(n)]) if n >= 0:
+            return Int(loc, int(math.sqrt(n)))
+        case (cmp, [Int(left), Int(right)]) if cmp in compare_ops.keys():
+            return Bool(loc, compare_ops[cmp](left, right))
+        case ('equal' | 'not_equal', [left, right]) \
+              if is_constant(left) and type(left) is type(right):
+            return Bool(loc, (left.value == right.value) == (op == 'equal'))
+        case (op, [Bool(left), Bool(right)]) if op in bool_ops:
+            return Bool(loc, bool_ops[op](left, right))
+        case ('not', [Bool(b)]):
+            return Bool(loc, not b)
         case _:
-            return PrimitiveCall(loc, op, args)
+            fold = get_primitive_const_eval(op)
+            return None if fold is None else fold(args, loc)
 
 
-@dataclass
+@dataclass(slots=True)
 class PrimitiveCall(Exp):
     op: str
     args: list[Exp]
@@ -228,7 +269,15 @@ class PrimitiveCall(Exp):
     def const_eval(self, env):
         op = self.op
         args = self.args
-        new_args = [arg.const_eval(env) for arg in args]
+        if op in pure_ops:
+            new_args = [const_eval_operand(arg, env) for arg in args]
+        else:
+            new_args = [arg.const_eval(env) for arg in args]
+        # `div` of two constants, as in `1/2`, is a rational literal, but
+        # the type of `div` is int, so a `div` of operations is left for
+        # runtime even if they fold to constants.
+        if op == 'div' and any(isinstance(arg, PrimitiveCall) for arg in args):
+            return PrimitiveCall(self.location, op, new_args)
         return const_eval_prim(self.location, op, new_args)
 
     def type_check(self, env, ctx):
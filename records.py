@@ -96,7 +96,7 @@ class Record(Value):
 
 # Record Creation
 
-@dataclass
+@dataclass(slots=True)
 class RecordExp(Exp):
   fields: list[tuple[str,Exp]]
   __match_args__ = ("fields",)
@@ -138,7 +138,7 @@ class RecordExp(Exp):
 
 # Field Access
 
-@dataclass
+@dataclass(slots=True)
 class FieldAccess(Exp):
   arg: Exp
   field: str
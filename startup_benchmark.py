@@ -0,0 +1,63 @@
+#
+# This file measures the startup time of the interpreter, that is, the
+# time to run a trivial program, which is dominated by importing the
+# interpreter's modules. Usage:
+#
+#   python3.10 ./startup_benchmark.py [runs]
+#
+# For each mode, it reports the best wall-clock time over the runs and
+# the modules with the largest cumulative import time, as reported by
+# `python3 -X importtime`. The modes are
+# * cached: the program's translation is in the cache (see ast_cache.py),
+#   so nothing is parsed or type checked, and
+# * no_cache: the program is parsed and type checked.
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+interpreter_dir = os.path.dirname(os.path.abspath(__file__))
+machine = os.path.join(interpreter_dir, 'machine.py')
+program = 'fun main() -> int {\n  return 0;\n}\n'
+modes = {'cached': [], 'no_cache': ['no_cache']}
+
+def run(filename, flags, extra=[]):
+  cmd = [sys.executable] + extra + [machine, filename] + flags
+  start = time.perf_counter()
+  proc = subprocess.run(cmd, capture_output=True, text=True)
+  elapsed = time.perf_counter() - start
+  if proc.returncode != 0:
+    print(proc.stdout + proc.stderr)
+    raise Exception('benchmark program failed: ' + ' '.join(cmd))
+  return elapsed, proc.stderr
+
+# Returns the (cumulative microseconds, module) pairs of the top-level
+# imports in the output of -X importtime.
+def top_level_imports(importtime):
+  imports = []
+  for line in importtime.splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    _, cumulative, name = line[len('import time:'):].split('|')
+    if not name.startswith('  '):
+      imports.append((int(cumulative), name.strip()))
+  return sorted(imports, reverse=True)
+
+def main(runs):
+  with tempfile.TemporaryDirectory() as tmp:
+    filename = os.path.join(tmp, 'startup.rte')
+    with open(filename, 'w') as f:
+      f.write(program)
+    run(filename, [])   # fill the caches
+    for mode, flags in modes.items():
+      best = min(run(filename, flags)[0] for _ in range(runs))
+      print('{mode}: {ms:.1f} ms (best of {runs})'
+            .format(mode=mode, ms=best * 1000, runs=runs))
+      _, importtime = run(filename, flags, ['-X', 'importtime'])
+      for usec, name in top_level_imports(importtime)[:8]:
+        print('  {ms:7.1f} ms  {name}'.format(ms=usec / 1000, name=name))
+
+if __name__ == "__main__":
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
@@ -11,7 +11,7 @@
 # operations (split) also make use of tuple values.
 
 from dataclasses import dataclass
-from abstract_syntax import Int
+from abstract_syntax import Int, is_constant
 from variables_and_binding import Param
 from ast_base import *
 from ast_types import *
@@ -20,6 +20,7 @@ from values import Result, to_integer, duplicate_if_temporary, PointerOffset, \
 from utilities import *
 from tuple_value import *
 import math
+import sys
 
     
 # The primitive `split` operator
@@ -59,9 +60,64 @@ def type_check_len(arg_types, location):
     
 set_primitive_type_check('len', type_check_len)
 
+# The length of an array or tuple literal whose elements are constants.
+def const_eval_len(args, location):
+  match args[0]:
+    case Array(Int(n), init) if n >= 1 and is_constant(init):
+      return Int(location, n)
+    case TupleExp(inits) if all(is_constant(init) for init in inits):
+      return Int(location, len(inits))
+    case _:
+      return None
+
+set_primitive_const_eval('len', const_eval_len)
+
+# The primitive `input_array` operator reads all of the integers
+# (separated by whitespace) from standard input into a new array,
+# so that bulk input does not take one `input()` call per element.
+
+def interp_input_array(vals, machine, location):
+  machine.output.flush()
+  words = sys.stdin.read().split()
+  try:
+    return TupleValue([Number(int(w)) for w in words])
+  except ValueError as ex:
+    error(location, 'in input_array, expected integers: ' + str(ex))
+
+set_primitive_interp('input_array', interp_input_array)
+
+def type_check_input_array(arg_types, location):
+  assert len(arg_types) == 0
+  return ArrayType(location, IntType(location))
+
+set_primitive_type_check('input_array', type_check_input_array)
+
+# The primitive `print_array` operator writes the elements of an array,
+# one per line, into the machine's output buffer.
+
+def interp_print_array(vals, machine, location):
+  tup = vals[0]
+  if isinstance(tup, Box):
+      tup = tup.value
+  if not isinstance(tup, TupleValue):
+      error(location, 'in print_array, expected an array, not ' + str(tup))
+  machine.output.write_values([to_integer(elt, location)
+                               for elt in tup.elts])
+  return Void()
+
+set_primitive_interp('print_array', interp_print_array)
+
+def type_check_print_array(arg_types, location):
+  assert len(arg_types) == 1
+  require_consistent(arg_types[0], ArrayType(location, IntType(location)),
+                     'in print_array', location)
+  return VoidType(location)
+
+set_primitive_type_check('print_array', type_check_print_array)
+
 # Array creation
 
-@dataclass
+@dataclass(slots=True)
 class Array(Exp):
   size: Exp
   arg: Exp
@@ -113,7 +169,7 @@ class Array(Exp):
 
 # Tuple Creation
 
-@dataclass
+@dataclass(slots=True)
 class TupleExp(Exp):
   inits: list[Exp]
   __match_args__ = ("inits",)
@@ -155,7 +211,7 @@ class TupleExp(Exp):
 
 # Element Access
 
-@dataclass
+@dataclass(slots=True)
 class Index(Exp):
   arg: Exp
   index: Exp
@@ -235,7 +291,7 @@ class Index(Exp):
         error(self.location, 'unrecognized context ' + repr(runner.context))
       machine.finish_expression(result, self.location)
 
-@dataclass
+@dataclass(slots=True)
 class Slice(Exp):
   arg: Exp
   start: Exp
@@ -302,7 +358,7 @@ class Slice(Exp):
 # TODO partition
 
 # for_in loop
-@dataclass
+@dataclass(slots=True)
 class ForIn(Stmt):
   param: Param
   arg: Exp
@@ -323,7 +379,10 @@ class ForIn(Stmt):
   def const_eval(self, env):
     new_param = self.param.with_type(simplify(self.param.type_annot, env))
     new_arg = self.arg.const_eval(env)
-    new_body = self.body.const_eval(env)
+    body_env = env.copy()
+    if new_param.ident in body_env.keys():
+      del body_env[new_param.ident]
+    new_body = self.body.const_eval(body_env)
     return ForIn(self.location, new_param, new_arg, new_body)
     
   def type_check(self, env, ret):
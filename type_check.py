@@ -1,15 +1,144 @@
 from ast_types import *
 from abstract_syntax import *
+from functions import Function, start_monomorphization, \
+  type_check_instances
+from modules import ModuleDef
 
 from utilities import *
+from type_env import TypeEnv
+import decl_cache
+from decl_cache import check_declaration
+import multiprocessing
+import os
+import sys
 
-def type_check_program(decls):
-    env = {}
+# The `cache` parameter is a `DeclCache` (see decl_cache.py) holding
+# the declarations checked by previous runs, or None.
+#
+# When monomorphizing, checking a declaration may add instances of
+# generic functions to the program (see functions.py), so the
+# declarations are checked in order, without the cache.
+def type_check_program(decls, parallel=False, cache=None):
+    if monomorphize():
+      parallel, cache = False, None
+    decl_cache.active_cache = cache
+    try:
+      env = TypeEnv()
+      new_decls = []
+      for d in decls:
+        env |= d.declare_type(env)
+      if parallel:
+        return type_check_in_parallel(decls, env)
+      if monomorphize():
+        start_monomorphization(decls, env)
+      # The cache walks the bodies of the declarations, which recurses
+      # down the chains of statements in long bodies (see `Link`).
+      for d in decls:
+        new_decls += with_recursion_limit(check_declaration, d, env)
+      if monomorphize():
+        new_decls += type_check_instances(env)
+      return new_decls
+    finally:
+      decl_cache.active_cache = None
+
+# In parallel mode, the bodies of the functions and modules, which is
+# where type checking spends its time, are checked by a pool of
+# processes, and all of the static errors are reported instead of only
+# the first one.
+#
+# After `declare_type`, the bodies are independent of one another:
+# checking a body reads the environment but does not change it. The
+# other declarations (such as global variables) may change it, so they
+# are checked here, in order, and each body is checked in a snapshot
+# of the environment at its position in the program. Snapshots are
+# cheap because the environment is persistent (see type_env.py).
+parallel_check_threshold = 32
+
+def type_check_in_parallel(decls, env):
+    results = [None for d in decls]
+    bodies = []
+    cache = decl_cache.active_cache
+    for i, d in enumerate(decls):
+      if isinstance(d, (Function, ModuleDef)):
+        translation = None if cache is None else cache.lookup(d, env)
+        if translation is not None:
+          results[i] = ('ok', translation)
+        else:
+          bodies.append((i, env.copy()))
+      else:
+        results[i] = check_decl(d, env)
+    checked = with_recursion_limit(check_bodies,
+                                   [(decls[i], body_env)
+                                    for i, body_env in bodies])
+    for (i, _), result in zip(bodies, checked):
+      results[i] = result
     new_decls = []
-    for d in decls:
-      env |= d.declare_type(env)
-    for d in decls:
-      new_decls += d.type_check(env)
+    errors = []
+    for result in results:
+      match result:
+        case ('ok', translation):
+          new_decls += translation
+        case ('static_error', msg):
+          errors.append(msg)
+        case ('error', ex):
+          # Report the static errors of the declarations before it, as
+          # checking them in order would have.
+          if len(errors) > 0:
+            raise StaticError('\n\n'.join(errors))
+          raise ex
+    if len(errors) > 0:
+      raise StaticError('\n\n'.join(errors))
     return new_decls
-        
-    
+
+def check_decl(d, env):
+    try:
+      return ('ok', check_declaration(d, env))
+    except StaticError as ex:
+      return ('static_error', str(ex))
+    except Exception as ex:
+      return ('error', ex)
+
+# The (declaration, environment) pairs being checked by the pool.
+# The worker processes are forked, so they inherit this list and only
+# the indices are sent to them. They send back the result and the
+# entries they used or added to the declaration cache.
+pending_bodies = []
+
+def check_pending_body(k):
+    d, env = pending_bodies[k]
+    cache = decl_cache.active_cache
+    if cache is None:
+      return check_decl(d, env), {}, 0
+    cache.used, cache.misses = {}, 0
+    result = check_decl(d, env)
+    return result, cache.used, cache.misses
+
+def check_bodies(bodies):
+    global pending_bodies
+    workers = os.cpu_count() or 1
+    if len(bodies) < parallel_check_threshold or workers < 2 \
+       or tracing_on() \
+       or 'fork' not in multiprocessing.get_all_start_methods():
+      return [check_decl(d, env) for d, env in bodies]
+    # imported here because most runs do not check in parallel
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+    pending_bodies = bodies
+    try:
+      with ProcessPoolExecutor(max_workers=workers,
+                               mp_context=multiprocessing.get_context('fork'),
+                               initializer=sys.setrecursionlimit,
+                               initargs=(pickle_recursion_limit,)) as pool:
+        checked = list(pool.map(check_pending_body, range(len(bodies)),
+                                chunksize=max(1, len(bodies) // (4*workers))))
+      cache = decl_cache.active_cache
+      if cache is not None:
+        for _, used, misses in checked:
+          cache.used |= used
+          cache.misses += misses
+      return [result for result, _, _ in checked]
+    except (OSError, NotImplementedError, BrokenProcessPool):
+      # no process pool on this platform, check sequentially
+      return [check_decl(d, env) for d, env in bodies]
+    finally:
+      pending_bodies = []
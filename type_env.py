@@ -0,0 +1,224 @@
+#
+# This file defines the persistent type environment used by the type
+# checker, which maps each variable in scope to its static information
+# (such as a `StaticVarInfo`).
+#
+# A `TypeEnv` behaves like a dictionary, except that `copy` takes
+# constant time: the copy shares its structure with the original, and
+# updating either one only copies the path to the updated entry. The
+# entries are stored in a hash array mapped trie (HAMT), so lookup and
+# update take O(log n) time. So entering a scope, which copies the
+# environment, no longer costs time proportional to the number of
+# variables in scope.
+#
+# The static information stored in a `TypeEnv` is shared between the
+# copies, so it must not be changed in place. Instead, store a new
+# object, as in `env[x] = info.with_state(state)`.
+
+BITS = 5
+MASK = (1 << BITS) - 1
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+
+# A node of the trie. The bitmap says which of the 32 children are
+# present, and `entries` holds them in order. A child is either a leaf,
+# that is, a (key, value, position) tuple, or another node.
+class Node:
+  __slots__ = ('bitmap', 'entries')
+
+  def __init__(self, bitmap, entries):
+    self.bitmap = bitmap
+    self.entries = entries
+
+# The leaves for keys whose hashes are equal.
+class Bucket:
+  __slots__ = ('leaves',)
+
+  def __init__(self, leaves):
+    self.leaves = leaves
+
+empty_node = Node(0, ())
+
+# Returns the updated node and whether the key is new.
+def assoc(node, shift, h, key, value, position):
+  if isinstance(node, Bucket):
+    for i, leaf in enumerate(node.leaves):
+      if leaf[0] == key:
+        return Bucket(node.leaves[:i] + ((key, value, leaf[2]),)
+                      + node.leaves[i+1:]), False
+    return Bucket(node.leaves + ((key, value, position),)), True
+  bit = 1 << ((h >> shift) & MASK)
+  index = (node.bitmap & (bit - 1)).bit_count()
+  entries = node.entries
+  if not node.bitmap & bit:
+    return Node(node.bitmap | bit,
+                entries[:index] + ((key, value, position),)
+                + entries[index:]), True
+  entry = entries[index]
+  if isinstance(entry, tuple):
+    if entry[0] == key:
+      new_entry, added = (key, value, entry[2]), False
+    else:
+      new_entry, added = split(shift + BITS, entry, h, key, value,
+                               position), True
+  else:
+    new_entry, added = assoc(entry, shift + BITS, h, key, value, position)
+  return Node(node.bitmap,
+              entries[:index] + (new_entry,) + entries[index+1:]), added
+
+# Returns a node that contains the given leaf and the new entry.
+def split(shift, leaf, h, key, value, position):
+  if shift >= HASH_BITS:
+    return Bucket((leaf, (key, value, position)))
+  node, _ = assoc(empty_node, shift, hash(leaf[0]) & HASH_MASK,
+                  leaf[0], leaf[1], leaf[2])
+  node, _ = assoc(node, shift, h, key, value, position)
+  return node
+
+def lookup(node, h, key):
+  shift = 0
+  while True:
+    if isinstance(node, Bucket):
+      for leaf in node.leaves:
+        if leaf[0] == key:
+          return leaf[1]
+      return absent
+    bit = 1 << ((h >> shift) & MASK)
+    if not node.bitmap & bit:
+      return absent
+    entry = node.entries[(node.bitmap & (bit - 1)).bit_count()]
+    if isinstance(entry, tuple):
+      return entry[1] if entry[0] == key else absent
+    node = entry
+    shift += BITS
+
+def leaves(node):
+  if isinstance(node, Bucket):
+    yield from node.leaves
+  else:
+    for entry in node.entries:
+      if isinstance(entry, tuple):
+        yield entry
+      else:
+        yield from leaves(entry)
+
+# The value of a removed key, and the result of looking up a key that
+# is not present.
+class Absent:
+  __slots__ = ()
+
+absent = Absent()
+
+# The position of each key, so that iteration follows insertion
+# order, like a dictionary.
+next_position = 0
+
+# The names looked up in any type environment while a declaration is
+# type checked, or None when the lookups are not being recorded (see
+# decl_cache.py). Iterating over an environment reads all of its names,
+# which is recorded as `all_names`.
+read_names = None
+all_names = '*'
+
+class TypeEnv:
+  __slots__ = ('root', 'size')
+
+  def __init__(self, entries=None):
+    self.root = empty_node
+    self.size = 0
+    if entries is not None:
+      self.update(entries)
+
+  # Returns a TypeEnv with the entries of `env`, which may be a
+  # TypeEnv (and then is not copied until it is updated) or a dict.
+  @staticmethod
+  def of(env):
+    if isinstance(env, TypeEnv):
+      return env.copy()
+    else:
+      return TypeEnv(env)
+
+  def copy(self):
+    env = TypeEnv()
+    env.root = self.root
+    env.size = self.size
+    return env
+
+  def __getitem__(self, key):
+    if read_names is not None:
+      read_names.add(key)
+    value = lookup(self.root, hash(key) & HASH_MASK, key)
+    if value is absent:
+      raise KeyError(key)
+    return value
+
+  def get(self, key, default=None):
+    if read_names is not None:
+      read_names.add(key)
+    value = lookup(self.root, hash(key) & HASH_MASK, key)
+    return default if value is absent else value
+
+  def __contains__(self, key):
+    if read_names is not None:
+      read_names.add(key)
+    return lookup(self.root, hash(key) & HASH_MASK, key) is not absent
+
+  def __setitem__(self, key, value):
+    global next_position
+    h = hash(key) & HASH_MASK
+    was_absent = lookup(self.root, h, key) is absent
+    self.root, _ = assoc(self.root, 0, h, key, value, next_position)
+    next_position += 1
+    if was_absent:
+      self.size += 1
+
+  def __delitem__(self, key):
+    h = hash(key) & HASH_MASK
+    if lookup(self.root, h, key) is absent:
+      raise KeyError(key)
+    self.root, _ = assoc(self.root, 0, h, key, absent, 0)
+    self.size -= 1
+
+  def update(self, entries):
+    for key, value in entries.items():
+      self[key] = value
+
+  def __ior__(self, entries):
+    self.update(entries)
+    return self
+
+  def __or__(self, entries):
+    env = self.copy()
+    env.update(entries)
+    return env
+
+  def __ror__(self, entries):
+    env = TypeEnv(entries)
+    env.update(self)
+    return env
+
+  def __len__(self):
+    return self.size
+
+  def items(self):
+    if read_names is not None:
+      read_names.add(all_names)
+    present = [leaf for leaf in leaves(self.root) if leaf[1] is not absent]
+    present.sort(key=lambda leaf: leaf[2])
+    return [(key, value) for key, value, _ in present]
+
+  def keys(self):
+    return [key for key, _ in self.items()]
+
+  def values(self):
+    return [value for _, value in self.items()]
+
+  def __iter__(self):
+    return iter(self.keys())
+
+  def __str__(self):
+    return '{' + ', '.join(repr(key) + ': ' + str(value)
+                           for key, value in self.items()) + '}'
+
+  def __repr__(self):
+    return str(self)
@@ -1,6 +1,7 @@
 from dataclasses import dataclass
-from lark.tree import Meta
+from locations import Location
 import numbers
+import sys
 from fractions import Fraction
 from typing import Any, Optional
 from ast_base import *
@@ -40,6 +41,17 @@ def set_debug_mode(cmd):
   debug_cmd = cmd
 
 
+# flag for monomorphizing generic functions (see functions.py)
+
+monomorphize_flag = False
+
+def monomorphize():
+  return monomorphize_flag
+
+def set_monomorphize(v):
+  global monomorphize_flag
+  monomorphize_flag = v
+
 # flag for verbose
 
 verbose_flag = False
@@ -72,6 +84,17 @@ def get_primitive_type_check(op):
   if not op in type_check_prim.keys():
     raise Exception('unrecognized primitive operation ' + op)
   return type_check_prim[op]
+
+# constant evaluating primitives (see `const_eval_prim`), for the
+# primitives defined outside of primitive_operations.py
+
+const_eval_prim_funs = {}
+
+def set_primitive_const_eval(op, fun):
+  const_eval_prim_funs[op] = fun
+
+def get_primitive_const_eval(op):
+  return const_eval_prim_funs.get(op)
   
 # Context information:
 # do you want value or address of the expression? (i.e. rvalue/lvalue)
@@ -130,3 +153,15 @@ def print_dict(dict):
     print(str(k) + ': ' + str(v))
   print()
 
+# Pickling recurses once per level of the tree being pickled, and
+# the body of a long function is a deep chain of `Seq` nodes, so we
+# temporarily raise Python's recursion limit.
+pickle_recursion_limit = 50000
+
+def with_recursion_limit(f, *args):
+  old_limit = sys.getrecursionlimit()
+  sys.setrecursionlimit(max(old_limit, pickle_recursion_limit))
+  try:
+    return f(*args)
+  finally:
+    sys.setrecursionlimit(old_limit)
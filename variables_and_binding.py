@@ -13,15 +13,16 @@ from ast_base import *
 from ast_types import *
 from values import *
 from utilities import *
-from abstract_syntax import make_cast
+from abstract_syntax import make_cast, Int, Frac, Bool, Link, \
+  chain_free_vars, chain_const_eval, chain_type_check
 
 
 # ===========================================================================
 # Parameters
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class Param:
-    location: Meta
+    location: Location
     kind: str  # let, var, inout, sink, set
     privilege: str  # read, write # OBSOLETE?
     ident: str
@@ -156,9 +157,9 @@ class Param:
 
 
 # ===========================================================================
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class NoParam:
-    location: Meta
+    location: Location
 
     def bind(self, res: Result, env, mem, loc):
         pass
@@ -179,9 +180,10 @@ def clear_borrowed_vars():
     borrowed_vars = dict()
 
 
+# The static information in a type environment is never changed in
+# place, so it is saved without copying it.
 def add_borrowed_var(var, info):
-    global borrowed_vars
-    borrowed_vars = borrowed_vars | {var: info.copy()}
+    borrowed_vars[var] = info
 
 
 def get_borrowed_vars():
@@ -189,7 +191,7 @@ def get_borrowed_vars():
 
 
 # ===========================================================================
-@dataclass
+@dataclass(slots=True)
 class Var(Exp):
     ident: str
     __match_args__ = ("ident",)
@@ -204,7 +206,7 @@ class Var(Exp):
         return set([self.ident])
 
     def const_eval(self, env):
-        if self.ident in env:
+        if self.ident in env and not isinstance(env[self.ident], LetConstant):
             return env[self.ident]
         else:
             return self
@@ -223,20 +225,20 @@ class Var(Exp):
                              "don't have read permission for " + self.ident
                              + ", only " + str(info.state))
             add_borrowed_var(self.ident, info)
-            info.state = ProperFraction()
+            env[self.ident] = info.with_state(ProperFraction())
         elif ctx == 'var':
             if info.state != FullFraction():
                 static_error(self.location,
                              "dont' have write permission for " + self.ident
                              + ", only " + str(info.state))
-            info.state = Dead()
+            env[self.ident] = info.with_state(Dead())
         elif ctx == 'inout':
             if info.state != FullFraction():
                 static_error(self.location,
                              "don't have full permission for " + self.ident
                              + ", only " + str(info.state))
             add_borrowed_var(self.ident, info)
-            info.state = EmptyFraction()
+            env[self.ident] = info.with_state(EmptyFraction())
         elif ctx == 'write_lhs':
             if info.state != FullFraction():
                 static_error(self.location,
@@ -258,7 +260,7 @@ class Var(Exp):
                              "don't have read permission for " + self.ident
                              + ", only " + str(info.state))
             add_borrowed_var(self.ident, info)
-            info.state = ProperFraction()  ## ??
+            env[self.ident] = info.with_state(ProperFraction())  ## ??
         else:
             static_error(self.location, "unrecognized context: " + ctx)
 
@@ -281,10 +283,36 @@ class Var(Exp):
         machine.finish_expression(result, self.location)
 
 
+# A `let` variable whose initializer is a constant of its declared
+# type, in the environment of const_eval. Unlike a `const`, the
+# variable is only replaced by its value where it is an operand
+# (see `const_eval_operand`), because its other uses, such as `&x`,
+# need its address.
+@dataclass(frozen=True)
+class LetConstant:
+    value: Exp
+
+def let_constant(param, init):
+    match (init, param.type_annot):
+        case (Int(), IntType()) | (Frac(), RationalType()) \
+              | (Bool(), BoolType()):
+            return LetConstant(init) if param.kind == 'let' else None
+        case _:
+            return None
+
+# Constant evaluates an expression whose value is only read, such as an
+# operand of a primitive operation or the condition of an `if`.
+def const_eval_operand(e, env):
+    match e:
+        case Var(x) if isinstance(env.get(x), LetConstant):
+            return env[x].value
+        case _:
+            return e.const_eval(env)
+
 # ===========================================================================
 # aka. let-expressions in functional languages
 #
-@dataclass
+@dataclass(slots=True)
 class BindingExp(Exp):
     param: Param
     arg: Exp
@@ -314,6 +342,9 @@ class BindingExp(Exp):
         body_env = env.copy()
         if new_param.ident in body_env.keys():
             del body_env[new_param.ident]
+        value = let_constant(new_param, new_rhs)
+        if value is not None:
+            body_env[new_param.ident] = value
         new_body = body.const_eval(body_env)
         return BindingExp(self.location, new_param, new_rhs, new_body)
 
@@ -349,8 +380,8 @@ class BindingExp(Exp):
 # ===========================================================================
 # This is meant to have the same semantics as the `let`, `var`, and
 # `inout` statement in Val.
-@dataclass
-class BindingStmt(Exp):
+@dataclass(slots=True)
+class BindingStmt(Exp, Link):
     param: Param
     arg: Exp
     body: Stmt
@@ -366,23 +397,29 @@ class BindingStmt(Exp):
     def __repr__(self):
         return str(self)
 
-    def free_vars(self):
-        return self.arg.free_vars() \
-               | (self.body.free_vars() - set([self.param.ident]))
+    # A run of bindings is a chain of `BindingStmt` nodes, so these
+    # methods loop down the chain (see `Link`).
+    def chain_rest(self):
+        return self.body
 
-    def const_eval(self, env):
-        param = self.param
-        rhs = self.arg
-        body = self.body
-        new_param = param.with_type(simplify(param.type_annot, env))
-        new_rhs = rhs.const_eval(env)
+    def head_free_vars(self):
+        return self.arg.free_vars()
+
+    def bound_vars(self):
+        return set([self.param.ident])
+
+    def const_eval_head(self, env):
+        new_param = self.param.with_type(simplify(self.param.type_annot, env))
+        new_rhs = self.arg.const_eval(env)
         body_env = env.copy()
         if new_param.ident in body_env.keys():
             del body_env[new_param.ident]
-        new_body = body.const_eval(body_env)
-        return BindingStmt(self.location, new_param, new_rhs, new_body)
+        value = let_constant(new_param, new_rhs)
+        if value is not None:
+            body_env[new_param.ident] = value
+        return (new_param, new_rhs), body_env
 
-    def type_check(self, env, ret):
+    def type_check_head(self, env, ret):
         if self.param.kind == 'var':
             arg_env = env
         else:
@@ -391,12 +428,24 @@ class BindingStmt(Exp):
         if not consistent(arg_type, self.param.type_annot):
             static_error(self.arg.location, 'type of initializer ' + str(arg_type)
                          + '\nis inconsistent with declared type '
-                         + str(new_param.type_annot))
+                         + str(self.param.type_annot))
         cast_arg = make_cast(new_arg, arg_type, self.param.type_annot)
         body_env = copy_type_env(arg_env)
         self.param.bind_type(body_env)
-        new_body = self.body.type_check(body_env, ret)
-        return BindingStmt(self.location, self.param, cast_arg, new_body)
+        return (self.param, cast_arg), body_env
+
+    def relink(self, head, rest):
+        param, arg = head
+        return BindingStmt(self.location, param, arg, rest)
+
+    def free_vars(self):
+        return chain_free_vars(self)
+
+    def const_eval(self, env):
+        return chain_const_eval(self, env)
+
+    def type_check(self, env, ret):
+        return chain_type_check(self, env, ret)
 
     def step(self, runner, machine):
         if runner.state == 0:
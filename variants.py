@@ -15,7 +15,7 @@ from variant_value import Variant
 from utilities import *
 
 
-@dataclass
+@dataclass(slots=True)
 class TagVariant(Exp):
   tag: str
   arg: Exp
@@ -69,7 +69,7 @@ class TagVariant(Exp):
       machine.finish_expression(Result(True, result), self.location)
 
     
-@dataclass
+@dataclass(slots=True)
 class Match(Stmt):
   condition: Exp
   cases: list[tuple[str,Param,Stmt]]
@@ -189,7 +189,7 @@ class Match(Stmt):
         error(self.location, 'failed to match a case with ' + str(runner.variant))
       machine.finish_statement(self.location)
           
-@dataclass
+@dataclass(slots=True)
 class VariantMember(Exp):
   arg: Exp
   field: str
@@ -0,0 +1,172 @@
+#
+# This file defines a daemon that watches the files of an Arete program
+# and type checks the program each time one of them is saved, reporting
+# the static errors right away. Usage:
+#
+#   python3.10 ./watch.py <filename> ... [interval=<seconds>]
+#
+# The daemon keeps the results of the previous check in memory, so a
+# check only redoes the work affected by the edit:
+# * only the files whose contents changed are parsed again,
+# * a declaration is constant evaluated again only if it changed or
+#   moved or the constants before it changed, and
+# * a declaration is type checked again only if it changed or the
+#   static information of some name that it looked up changed (see
+#   decl_cache.py).
+# The imported module files are watched too, and reloaded when one of
+# them changes (see module_loader.py).
+
+from dataclasses import dataclass, field
+from typing import Any
+import os
+import sys
+import time
+
+from parser import parse
+from error import StaticError
+from type_env import TypeEnv
+import decl_cache
+from decl_cache import DeclCache, check_declaration
+import module_loader
+
+@dataclass
+class ParsedFile:
+  text: str
+  decls: list[Any]
+
+@dataclass
+class Watcher:
+  filenames: list[str]
+  files: dict[str, ParsedFile] = field(default_factory=dict)
+  # Maps (declaration, its location, constants before it) to the
+  # declarations produced by const_eval and the constants after it.
+  const_evaluated: dict[Any, Any] = field(default_factory=dict)
+  # The declarations that type checked, which also remembers the
+  # fingerprints of the declarations, because the declarations of the
+  # unchanged files are reused from check to check.
+  checked: DeclCache = field(default_factory=DeclCache)
+  # Whether the last check found errors, which may have stopped it
+  # before checking the rest of a module.
+  had_errors: bool = False
+  module_times: dict[str, float] = field(default_factory=dict)
+
+  # Returns the parsed declarations of all the files, parsing only the
+  # files that changed since the last check.
+  def parse_program(self):
+    decls = []
+    for filename in self.filenames:
+      with open(filename, 'r') as f:
+        text = f.read()
+      parsed = self.files.get(filename)
+      if parsed is None or parsed.text != text:
+        parsed = ParsedFile(text, parse(text, False, filename))
+        self.files[filename] = parsed
+      decls += parsed.decls
+    return decls
+
+  def module_files_changed(self):
+    changed = False
+    for filename in module_loader.loaded_modules.keys():
+      mtime = os.path.getmtime(filename) if os.path.exists(filename) else None
+      if self.module_times.get(filename) != mtime:
+        self.module_times[filename] = mtime
+        changed = True
+    return changed
+
+  def const_eval(self, decls):
+    env = {}
+    new_decls = []
+    const_evaluated = {}
+    for d in decls:
+      key = (self.checked.fingerprint(d), repr(d.location),
+             constants_fingerprint(env))
+      if key in self.const_evaluated:
+        result, after = self.const_evaluated[key]
+        env = dict(after)
+      else:
+        result = d.const_eval(env)
+      const_evaluated[key] = (result, dict(env))
+      new_decls += result
+    self.const_evaluated = const_evaluated
+    return new_decls
+
+  # Type checks the program and returns the static errors.
+  # The declarations with errors are not cached, so they are
+  # checked again each time.
+  def type_check(self, parsed_decls, decls):
+    # Forget the results for declarations that no longer exist.
+    self.checked.next_run(parsed_decls + decls, not self.had_errors)
+    env = TypeEnv()
+    for d in decls:
+      env |= d.declare_type(env)
+    errors = []
+    decl_cache.active_cache = self.checked
+    try:
+      for d in decls:
+        try:
+          check_declaration(d, env)
+        except StaticError as ex:
+          errors.append(str(ex))
+    finally:
+      decl_cache.active_cache = None
+    return errors, self.checked.misses
+
+  def check(self):
+    start = time.perf_counter()
+    if self.module_files_changed():
+      module_loader.loaded_modules.clear()
+      self.const_evaluated.clear()
+      self.checked = DeclCache()
+    try:
+      parsed_decls = self.parse_program()
+      parsed_decls = module_loader.load_imported_modules(parsed_decls)
+      self.module_files_changed()
+      decls = self.const_eval(parsed_decls)
+      errors, rechecked = self.type_check(parsed_decls, decls)
+    except StaticError as ex:
+      errors, rechecked = [str(ex)], 0
+    except Exception as ex:
+      # for example, a syntax error
+      errors, rechecked = [str(ex)], 0
+    self.had_errors = len(errors) > 0
+    elapsed = (time.perf_counter() - start) * 1000
+    for msg in errors:
+      print(msg)
+    status = 'ok' if len(errors) == 0 \
+      else str(len(errors)) + ' error' + ('s' if len(errors) > 1 else '')
+    print('{status} ({rechecked} rechecked, {ms:.1f} ms)'
+          .format(status=status, rechecked=rechecked, ms=elapsed))
+    sys.stdout.flush()
+    return errors
+
+  def watched_files(self):
+    return self.filenames + list(module_loader.loaded_modules.keys())
+
+  def run(self, interval):
+    times = None
+    while True:
+      new_times = {}
+      for filename in self.watched_files():
+        if os.path.exists(filename):
+          new_times[filename] = os.path.getmtime(filename)
+      if new_times != times:
+        times = new_times
+        self.check()
+      time.sleep(interval)
+
+def constants_fingerprint(env):
+  return tuple((x, str(e)) for x, e in env.items())
+
+if __name__ == "__main__":
+  interval = 0.5
+  filenames = []
+  for arg in sys.argv[1:]:
+    if arg.startswith('interval='):
+      interval = float(arg[len('interval='):])
+    else:
+      filenames.append(arg)
+  sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+  try:
+    Watcher(filenames).run(interval)
+  except KeyboardInterrupt:
+    pass